@@ -0,0 +1,92 @@
+import datetime
+import fcntl
+
+import pytest
+
+from alerts import AlertEngine, AlertRule
+
+RULES = [
+    {'name': 'low water', 'metric': 'gallons', 'below': 800, 'clear': 1000},
+    {'name': 'sensor silent', 'metric': 'stale', 'minutes': 15},
+]
+
+
+def engine(tmp_path, sent):
+    def notify(message):
+        sent.append(message)
+        return True
+    return AlertEngine(str(tmp_path / 'alert_state.json'), [AlertRule(rule) for rule in RULES], notify)
+
+
+def test_processes_sharing_the_state_file_keep_each_others_updates(tmp_path):
+    sampler_sent, checker_sent = [], []
+    sampler = engine(tmp_path, sampler_sent)
+    checker = engine(tmp_path, checker_sent)
+    start = datetime.datetime(2024, 6, 1, 12, 0)
+
+    sampler.evaluate('gallons', 700.0, start.timestamp())
+    checker.check_stale(start, now=start + datetime.timedelta(minutes=20))
+    # The sampler's next reading must see the checker's stale alert to clear it...
+    sampler.evaluate('stale', 0.0, (start + datetime.timedelta(minutes=21)).timestamp())
+    # ...and the checker must not resend it or forget the low-water alert.
+    checker.check_stale(start + datetime.timedelta(minutes=21), now=start + datetime.timedelta(minutes=22))
+    sampler.evaluate('gallons', 750.0, (start + datetime.timedelta(minutes=22)).timestamp())
+
+    assert sampler_sent == ['ALERT low water: 700 gallons', 'CLEARED sensor silent: no reading for 0 min']
+    assert checker_sent == ['ALERT sensor silent: no reading for 20 min']
+
+
+def test_level_rules_need_a_clear_level_past_the_threshold():
+    with pytest.raises(ValueError, match='clear'):
+        AlertRule({'metric': 'gallons', 'below': 800})
+    with pytest.raises(ValueError, match='clear'):
+        AlertRule({'metric': 'rate', 'below': -3.0, 'clear': -4.0})
+    assert AlertRule({'metric': 'stale', 'minutes': 15}).clear < 15
+
+
+def test_alerts_for_a_tank_in_a_tanks_list_name_the_tank(tmp_path):
+    sent = []
+    rules = [AlertRule(RULES[0])]
+    tank = AlertEngine(str(tmp_path / 'house_alerts.json'), rules, lambda message: sent.append(message) or True,
+                       tank_name='house')
+    tank.evaluate('gallons', 700.0, 0.0)
+    tank.evaluate('gallons', 1100.0, 60.0)
+    assert sent == ['ALERT low water [house]: 700 gallons', 'CLEARED low water [house]: 1,100 gallons']
+
+
+def test_a_reading_reads_the_state_once_and_notifies_after_unlocking(tmp_path, monkeypatch):
+    locked = []
+    sent = []
+
+    def notify(message):
+        # Another process must be able to take the lock while Slack is slow.
+        with open(str(tmp_path / 'alert_state.json.lock'), 'a') as other:
+            fcntl.flock(other.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        sent.append(message)
+        return True
+
+    rules = [AlertRule(rule) for rule in RULES + [{'name': 'draining', 'metric': 'rate', 'below': -3, 'clear': -1}]]
+    alerts = AlertEngine(str(tmp_path / 'alert_state.json'), rules, notify)
+    loads = []
+    real_load = alerts._load
+    monkeypatch.setattr(alerts, '_load', lambda: loads.append(1) or real_load())
+    flow = type('Flow', (), {'state': {'ewma_gpm': -5.0}})()
+    start = datetime.datetime(2024, 6, 1, 12, 0)
+
+    # Empty tank: low water and draining fire together, with one locked read.
+    alerts.on_reading(start, 120.0, flow=flow)
+    assert [message.partition(':')[0] for message in sent] == ['ALERT low water', 'ALERT draining']
+    assert len(loads) == 2
+    # Nothing changes on the next reading, so the state file is not read again.
+    alerts.on_reading(start + datetime.timedelta(minutes=1), 120.0, flow=flow)
+    assert len(loads) == 2 and len(sent) == 2
+
+
+def test_failed_alert_is_not_held_back_by_the_cooldown(tmp_path):
+    attempts = []
+    alerts = AlertEngine(str(tmp_path / 'alert_state.json'), [AlertRule(RULES[0])],
+                         lambda message: attempts.append(message) and len(attempts) > 1)
+    alerts.evaluate('gallons', 700.0, 0.0)
+    alerts.evaluate('gallons', 1100.0, 60.0)
+    alerts.evaluate('gallons', 700.0, 120.0)
+    assert attempts == ['ALERT low water: 700 gallons', 'ALERT low water: 700 gallons']
@@ -0,0 +1,95 @@
+import datetime
+import json
+import threading
+import time
+
+from check_slack_commands import SlackCommandChecker
+from config_loader import ConfigLoader
+from fake_slack import FakeSlackServer
+from log_distance import LogDistance
+
+
+def wait_for_posts(server, count, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while len(server.posts) < count:
+        assert time.monotonic() < deadline, "only %d of %d replies posted" % (len(server.posts), count)
+        time.sleep(0.02)
+    return [post['text'] for post in server.posts]
+
+
+def write_config(tmp_path, server):
+    config = {
+        'paths': {
+            'log_file': str(tmp_path / 'log.txt'),
+            'state_file': str(tmp_path / 'state.json'),
+            'command_log': str(tmp_path / 'commands.log'),
+        },
+        'log': {'rollup_file': str(tmp_path / 'rollups')},
+        'flow': {'state_file': str(tmp_path / 'flow.json')},
+        'slack': {'channel_id': 'C1', 'api_base': server.base_url + '/api'},
+        'polling': {'min_interval_seconds': 0.05, 'max_interval_seconds': 0.05},
+        'tank': {},
+    }
+    config_path = tmp_path / 'config.json'
+    secrets_path = tmp_path / 'secrets.json'
+    config_path.write_text(json.dumps(config))
+    secrets_path.write_text(json.dumps({'slack': {'bot_token': 'xoxb-test',
+                                                  'webhook_endpoint': server.base_url + '/webhook'}}))
+    return config, ConfigLoader(str(config_path), str(secrets_path))
+
+
+def test_daemon_replies_follow_state_written_by_another_process(tmp_path):
+    server = FakeSlackServer().start()
+    config, loader = write_config(tmp_path, server)
+    # Stands in for the sampler process: its own LogDistance, flow tracker and rollups.
+    sampler = LogDistance.from_config(config)
+    start = datetime.datetime.now() - datetime.timedelta(minutes=30)
+    for minute in range(10):
+        sampler.append_reading(20.0 + minute, timestamp=start + datetime.timedelta(minutes=minute))
+
+    checker = SlackCommandChecker(loader)
+    stop_event = threading.Event()
+    daemon = threading.Thread(target=checker.run_daemon, args=(stop_event,))
+    daemon.start()
+    try:
+        server.inject('tank:rate')
+        server.inject('tank:graph 24h')
+        first_rate, first_graph = wait_for_posts(server, 2)
+        assert first_rate.startswith('Rate: -')
+
+        # The tank refills between polls.
+        for minute in range(10, 20):
+            sampler.append_reading(29.0 - 2 * (minute - 9), timestamp=start + datetime.timedelta(minutes=minute))
+        server.inject('tank:rate')
+        server.inject('tank:graph 24h')
+        second_rate, second_graph = wait_for_posts(server, 4)[2:]
+    finally:
+        stop_event.set()
+        daemon.join()
+        sampler.close()
+        server.stop()
+
+    assert second_rate.startswith('Rate: +')
+    assert second_graph != first_graph
+    assert ' 9.00 in' in second_graph
+
+
+def test_backlog_spanning_several_pages_is_answered_once_per_command(tmp_path):
+    server = FakeSlackServer().start()
+    config, loader = write_config(tmp_path, server)
+    with LogDistance.from_config(config) as sampler:
+        sampler.append_reading(30.0)
+    commands = {10: 'tank:level', 250: 'tank:graph 3', 300: 'tank:level', 440: 'tank:level'}
+    for i in range(450):
+        last_ts = server.inject(commands.get(i, 'chatter %d' % i))
+    try:
+        assert SlackCommandChecker(loader).process_commands()
+    finally:
+        server.stop()
+
+    assert server.history_calls == 3
+    # The newest page (messages 250-449) is answered first, oldest message first.
+    graph, level = [post['text'] for post in server.posts]
+    assert graph.startswith('Last 1 readings') and level.startswith('Distance: ')
+    with open(config['paths']['state_file']) as f:
+        assert json.load(f)['last_processed_ts'] == str(float(last_ts))
@@ -0,0 +1,28 @@
+import pytest
+
+from config_loader import ConfigError, PathsConfig, TankConfig
+
+
+@pytest.mark.parametrize('section, message', [
+    ({'shape': 'horizontl_cylinder'}, 'tank.shape'),
+    ({'shape': 'horizontal_cylinder'}, 'tank.length_in'),
+    ({'shape': 'cone_bottom', 'cone_height_in': -3}, 'tank.cone_height_in'),
+    ({'shape': 'table'}, 'tank.strapping_table'),
+    ({'shape': 'table', 'strapping_table': [[0, 0], [10, 50], [10, 60]]}, 'tank.strapping_table'),
+])
+def test_bad_tank_geometry_fails_when_the_section_loads(section, message):
+    with pytest.raises(ConfigError, match=message):
+        TankConfig(section)
+
+
+def test_valid_shapes_load_and_build_a_tank():
+    tank = TankConfig({'shape': 'horizontal_cylinder', 'radius_in': 24, 'height_in': 48, 'length_in': 96})
+    assert tank.water_tank() is not None
+    table = TankConfig({'shape': 'table', 'strapping_table': [[0, 0], [40, 400]], 'meter_height_in': 0})
+    assert table.water_tank().gallons_at_height(20) == pytest.approx(200.0)
+
+
+def test_paths_without_a_state_file_have_no_default_lock():
+    paths = PathsConfig({'state_file': None})
+    assert paths.lock_file is None
+    assert PathsConfig({'state_file': '/tmp/state.json'}).lock_file == '/tmp/state.json.lock'
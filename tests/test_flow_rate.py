@@ -0,0 +1,22 @@
+import datetime
+
+from flow_rate import FlowRateTracker
+
+
+def test_leak_is_judged_afresh_each_night(tmp_path):
+    tracker = FlowRateTracker(str(tmp_path / 'flow.json'), {}, {'leak_gpm': 0.2, 'leak_minutes': 120})
+    inches_per_reading = 0.0625  # about 0.25 gal/min at 10-minute spacing
+    start = datetime.datetime(2024, 6, 1, 0, 0)
+    leak_by_time = {}
+    for step in range(24 * 6 + 1):
+        timestamp = start + datetime.timedelta(minutes=10 * step)
+        tracker.add(timestamp, 10.0 + step * inches_per_reading)
+        leak_by_time[timestamp] = tracker.state.get('leak')
+
+    # Night one: a steady drain is flagged once it has lasted leak_minutes.
+    assert not leak_by_time[datetime.datetime(2024, 6, 1, 1, 0)]
+    assert leak_by_time[datetime.datetime(2024, 6, 1, 2, 30)]
+    # Day: the same drain is ordinary use.
+    assert not leak_by_time[datetime.datetime(2024, 6, 1, 12, 0)]
+    # Night two starts over instead of flagging the first reading.
+    assert not leak_by_time[datetime.datetime(2024, 6, 2, 0, 0)]
@@ -0,0 +1,31 @@
+import pytest
+
+from graph_utils import lttb_downsample, minmax_downsample
+
+# A zigzag, so every bucket has distinct minimum and maximum points.
+POINTS = [(float(t), float(t % 7)) for t in range(100)]
+
+
+@pytest.mark.parametrize('downsample', [minmax_downsample, lttb_downsample])
+@pytest.mark.parametrize('width', [1, 2, 3, 4, 5, 10, 99, 100, 150])
+def test_downsampling_never_exceeds_width(downsample, width):
+    sampled = downsample(iter(POINTS), width)
+    assert 1 <= len(sampled) <= width
+    assert sampled == sorted(sampled)
+    assert set(sampled) <= set(POINTS)
+
+
+@pytest.mark.parametrize('downsample', [minmax_downsample, lttb_downsample])
+def test_a_single_point_is_the_newest(downsample):
+    assert downsample(iter(POINTS), 1) == [POINTS[-1]]
+
+
+def test_narrow_widths_keep_the_extremes_or_the_ends():
+    assert minmax_downsample(iter(POINTS), 3) == [(0.0, 0.0), (6.0, 6.0)]
+    assert lttb_downsample(iter(POINTS), 2) == [POINTS[0], POINTS[-1]]
+
+
+@pytest.mark.parametrize('downsample', [minmax_downsample, lttb_downsample])
+def test_width_below_one_is_rejected(downsample):
+    with pytest.raises(ValueError):
+        downsample(iter(POINTS), 0)
@@ -0,0 +1,12 @@
+import pytest
+
+import import_profile
+
+
+@pytest.mark.parametrize('module', import_profile.ENTRY_POINTS)
+def test_entry_point_cold_start(module):
+    # Fastest of a few runs, so a busy CI machine does not fail the budget.
+    runs = [import_profile.profile_import(module) for _ in range(3)]
+    rows = min(runs, key=lambda r: import_profile.cumulative_ms(r, module) or 0.0)
+    assert import_profile.deferred_imports(rows) == []
+    assert import_profile.cumulative_ms(rows, module) < import_profile.DEFAULT_BUDGET_MS
@@ -0,0 +1,22 @@
+import datetime
+
+from log_distance import LogDistance
+from reading_db import ReadingDatabase
+
+
+def test_readers_see_readings_the_writer_has_not_committed(tmp_path):
+    log_path = str(tmp_path / 'log.txt')
+    db_path = str(tmp_path / 'history.db')
+    writer = LogDistance(log_path, keep_open=True, database=ReadingDatabase(db_path, batch_size=4))
+    reader = LogDistance(log_path, database=ReadingDatabase(db_path))
+    start = datetime.datetime(2024, 6, 1, 12, 0)
+    try:
+        for minute in range(6):
+            writer.append_reading(20.0 + minute, timestamp=start + datetime.timedelta(minutes=minute))
+        # Four rows are committed; the last two are only in the writer's pending batch.
+        assert [distance for _, distance in reader.read_last_readings(3)] == [23.0, 24.0, 25.0]
+        assert len(list(reader.read_range(start))) == 6
+        assert len(list(reader.read_range(start, start + datetime.timedelta(minutes=5)))) == 5
+    finally:
+        writer.close()
+        reader.close()
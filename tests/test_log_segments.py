@@ -0,0 +1,57 @@
+import datetime
+import os
+
+import pytest
+
+import log_segments
+from log_segments import SegmentedLogDistance
+
+START = datetime.datetime(2024, 6, 1, 12, 0)
+
+
+def write_readings(log, count, first=0):
+    for minute in range(first, first + count):
+        log.append_reading(20.0 + minute, timestamp=START + datetime.timedelta(minutes=minute))
+
+
+def crash_on_rename_of(monkeypatch, path, after_rename):
+    real_rename = os.rename
+
+    def rename(src, dst):
+        if src == path:
+            if after_rename:
+                real_rename(src, dst)
+            raise KeyboardInterrupt("power cut")
+        real_rename(src, dst)
+    monkeypatch.setattr(log_segments.os, 'rename', rename)
+
+
+@pytest.mark.parametrize('after_rename', [False, True])
+def test_crash_while_rotating_keeps_every_line_once(tmp_path, monkeypatch, after_rename):
+    path = str(tmp_path / 'log.txt')
+    log = SegmentedLogDistance(path, max_bytes=10 ** 6)
+    write_readings(log, 5)
+    crash_on_rename_of(monkeypatch, path, after_rename)
+    with pytest.raises(KeyboardInterrupt):
+        log.rotate()
+    monkeypatch.undo()
+
+    reader = SegmentedLogDistance(path, max_bytes=10 ** 6)
+    assert len(reader.load_manifest()) == (1 if after_rename else 0)
+    assert len(list(reader.read_range(START))) == 5
+    assert reader.read_last_lines(2)[-1].startswith(str(START + datetime.timedelta(minutes=4)))
+
+    write_readings(reader, 2, first=5)
+    reader.rotate()
+    assert len(reader.load_manifest()) == (2 if after_rename else 1)
+    assert len(list(reader.read_range(START))) == 7
+
+
+def test_last_lines_come_from_segments_after_rotation(tmp_path):
+    path = str(tmp_path / 'log.txt')
+    log = SegmentedLogDistance(path, max_bytes=10 ** 6)
+    write_readings(log, 3)
+    log.rotate()
+    assert not os.path.exists(path)
+    assert [line[-8:] for line in log.read_last_lines(2)] == ["21.00 in", "22.00 in"]
+    assert log.read_last_line().endswith("22.00 in")
@@ -0,0 +1,41 @@
+import datetime
+
+from rollups import HOURLY, GallonRollups
+
+TANK = {'radius_in': 54.23, 'height_in': 75.0, 'meter_height_in': 0.0}
+NOON = datetime.datetime(2024, 6, 10, 12, 0)
+
+
+def hourly_lines(rollups):
+    with open(rollups._bucket_path(HOURLY)) as f:
+        return f.read().splitlines()
+
+
+def test_window_covers_a_time_span_not_a_bucket_count(tmp_path):
+    rollups = GallonRollups(str(tmp_path / 'rollups'), TANK)
+    # Three days of readings, then nothing for two days.
+    for hour in range(72):
+        rollups.add_gallons(NOON + datetime.timedelta(hours=hour), 1000.0 + hour)
+    last = NOON + datetime.timedelta(hours=71)
+
+    assert len(rollups.window('24h', now=last + datetime.timedelta(minutes=30))) == 24
+    assert rollups.window('24h', now=last + datetime.timedelta(days=2)) == []
+    later = rollups.window('7d', now=last + datetime.timedelta(days=2))
+    assert later[0].start == str(NOON) and later[-1].last == 1071.0
+    assert [b.start for b in rollups.window('30d', now=last)][0] == str(NOON.replace(hour=0))
+
+
+def test_bucket_closed_twice_after_a_crash_is_written_once(tmp_path):
+    base = str(tmp_path / 'rollups')
+    rollups = GallonRollups(base, TANK)
+    rollups.add_gallons(NOON, 1000.0)
+    rollups.add_gallons(NOON + datetime.timedelta(minutes=30), 1010.0)
+    # Crash after the closed bucket's line was appended but before the open state was saved.
+    rollups.add_gallons(NOON + datetime.timedelta(hours=1), 1020.0, save=False)
+    assert len(hourly_lines(rollups)) == 1
+
+    restarted = GallonRollups(base, TANK)
+    restarted.add_gallons(NOON + datetime.timedelta(hours=1, minutes=1), 1021.0)
+    assert len(hourly_lines(restarted)) == 1
+    restarted.add_gallons(NOON + datetime.timedelta(hours=2), 1030.0)
+    assert [line.split('\t')[0] for line in hourly_lines(restarted)] == [str(NOON), str(NOON.replace(hour=13))]
@@ -0,0 +1,53 @@
+import socket
+
+import pytest
+
+from fake_slack import FakeSlackServer
+from slack_client import SlackClient
+
+
+@pytest.fixture
+def slack():
+    server = FakeSlackServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(slack):
+    client = SlackClient(webhook_endpoint=slack.base_url + '/webhook', timeout=(1.0, 0.3), retries=3, backoff=0.01)
+    client.delays = []
+    client._sleep = client.delays.append
+    yield client
+    client.close()
+
+
+def test_post_waits_out_retry_after_on_429(slack, client):
+    slack.fail_next(429, retry_after=2)
+    assert client.post_message("Tank: 61%")
+    assert client.delays == [2.0]
+    assert [post['text'] for post in slack.posts] == ["Tank: 61%"]
+
+
+def test_post_retried_after_503(slack, client):
+    slack.fail_next(503)
+    assert client.post_message("Tank: 61%")
+    assert len(client.delays) == 1
+    assert client.latency_stats()['post_message']['retries'] == 1
+    assert len(slack.posts) == 1
+
+
+def test_post_not_resent_after_read_timeout(slack, client):
+    slack.stall_next(1.0)
+    assert not client.post_message("Tank: 61%")
+    assert client.delays == []
+    assert len(slack.posts) == 1
+
+
+def test_post_retried_when_connection_refused(client):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    assert not client.post_message("Tank: 61%", endpoint="http://127.0.0.1:%d/webhook" % port)
+    assert len(client.delays) == 3
@@ -0,0 +1,19 @@
+import pytest
+
+from tank_geometry import compile_table
+
+
+def test_strapping_table_is_sorted_by_height():
+    table = compile_table({'shape': 'table', 'strapping_table': [[40, 400], [0, 0], [20, 150]]})
+    assert list(table.heights) == [0.0, 20.0, 40.0]
+    assert table.gallons_at(30) == pytest.approx(275.0)
+
+
+def test_strapping_table_rejects_duplicate_heights():
+    with pytest.raises(ValueError, match="height 20"):
+        compile_table({'shape': 'table', 'strapping_table': [[0, 0], [20, 150], [20, 160], [40, 400]]})
+
+
+def test_strapping_table_rejects_falling_gallons():
+    with pytest.raises(ValueError, match=r"\[40, 120\]"):
+        compile_table({'shape': 'table', 'strapping_table': [[0, 0], [20, 150], [40, 120]]})
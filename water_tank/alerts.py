@@ -0,0 +1,254 @@
+'''
+Threshold alerting evaluated as readings are written.
+
+Rules come from the `alerts` section of config.json. Each rule watches one
+metric -- "gallons", "rate" (smoothed gal/min from the flow tracker) or
+"stale" (minutes since the last reading) -- and fires when it crosses its
+threshold. It only clears once the value is back past a separate clear
+threshold (hysteresis), so a level hovering around the limit does not flap.
+Notifications are sent only on state transitions, at most once per cooldown
+per rule, and the per-rule state is persisted only when it changes.
+
+The sampler and the command checker (for "stale") both update the state
+file, so a transition rereads it under an flock before changing it; a
+reading that changes nothing costs a stat() of the state file.
+'''
+import datetime
+import fcntl
+import json
+import logging
+import os
+
+from config_loader import file_signature
+from watertank import WaterTank
+
+GALLONS = 'gallons'
+RATE = 'rate'
+STALE = 'stale'
+
+DEFAULT_COOLDOWN_MINUTES = 60.0
+
+
+class AlertRule:
+    def __init__(self, rule_config):
+        self.name = rule_config.get('name') or rule_config['metric']
+        self.metric = rule_config['metric']
+        if self.metric not in (GALLONS, RATE, STALE):
+            raise ValueError("Unknown alert metric: %r" % self.metric)
+        if self.metric == STALE:
+            self.above = float(rule_config['minutes'])
+            self.below = None
+        else:
+            self.below = rule_config.get('below')
+            self.above = rule_config.get('above')
+            if (self.below is None) == (self.above is None):
+                raise ValueError("Alert rule %r needs exactly one of below/above" % self.name)
+        threshold = self.below if self.below is not None else self.above
+        self.threshold = float(threshold)
+        if self.metric == STALE:
+            # Any fresh reading clears a stale alert; the margin only matters for check_stale.
+            self.clear = float(rule_config.get('clear', self.threshold / 2.0))
+        elif 'clear' not in rule_config:
+            raise ValueError("Alert rule %r needs a clear level" % self.name)
+        else:
+            self.clear = float(rule_config['clear'])
+        if self.below is not None and self.clear <= self.threshold:
+            raise ValueError("Alert rule %r: clear must be over the threshold" % self.name)
+        if self.below is None and self.clear >= self.threshold:
+            raise ValueError("Alert rule %r: clear must be under the threshold" % self.name)
+        self.cooldown = float(rule_config.get('cooldown_minutes', DEFAULT_COOLDOWN_MINUTES)) * 60.0
+
+    def triggered(self, value):
+        if self.below is not None:
+            return value < self.threshold
+        return value > self.threshold
+
+    def cleared(self, value):
+        if self.below is not None:
+            return value >= self.clear
+        return value <= self.clear
+
+    def describe(self, value):
+        if self.metric == GALLONS:
+            return "{:,.0f} gallons".format(value)
+        if self.metric == RATE:
+            return "{:+.2f} gal/min".format(value)
+        return "no reading for {:.0f} min".format(value)
+
+
+class AlertEngine:
+    def __init__(self, state_path, rules, notify, tank_config=None, tank_name=None):
+        self.state_path = state_path
+        self.rules = rules
+        # Callable taking the message text and returning True when delivered.
+        self.notify = notify
+        self.tank = WaterTank.from_config(tank_config or {})
+        # Set for a tank in a `tanks` list, so its alerts say which tank they are about.
+        self.tank_name = tank_name
+        self.lock_path = state_path + '.lock'
+        # (file signature, state) as last read or written by this process.
+        self._cached = None
+
+    def _load(self):
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r') as f:
+                    return json.load(f)
+            except Exception as exc:
+                logging.error("Error loading alert state %s: %s", self.state_path, exc)
+        return {}
+
+    def _save(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp_path, self.state_path)
+        self._cached = (file_signature(self.state_path), state)
+
+    def _locked(self):
+        lock_file = open(self.lock_path, 'a')
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        return lock_file
+
+    def evaluate(self, metric, value, now):
+        """Update every rule on metric with value; notify and persist only on transitions."""
+        self.evaluate_many([(metric, value)], now)
+
+    def evaluate_many(self, values, now):
+        """Evaluate (metric, value) pairs with one read of the state file.
+
+        Most readings change nothing, which the cached state shows after a
+        stat(). Otherwise the state is reread, updated and saved under the
+        lock, and the notifications are sent once it is released.
+        """
+        checks = [(rule, value) for metric, value in values for rule in self.rules if rule.metric == metric]
+        if not checks:
+            return
+        signature = file_signature(self.state_path)
+        if self._cached is None or self._cached[0] != signature:
+            self._cached = (signature, self._load())
+        cached = self._cached[1]
+        if not any(self._transition(rule, cached.get(rule.name), value) for rule, value in checks):
+            return
+        lock_file = self._locked()
+        try:
+            # Held across the read and the save, so no other writer's update is lost.
+            state = self._load()
+            messages = self._apply(checks, state, now)
+            if messages is not None:
+                self._save(state)
+        finally:
+            lock_file.close()
+        failed = []
+        for rule, message, fired in messages or ():
+            if not self._send(message) and fired:
+                failed.append(rule)
+        if failed:
+            self._forget_notified(failed, now)
+
+    @staticmethod
+    def _transition(rule, rule_state, value):
+        """'fire', 'clear' or None for rule given its saved state and a new value."""
+        active = bool(rule_state and rule_state.get('active'))
+        if not active and rule.triggered(value):
+            return 'fire'
+        if active and rule.cleared(value):
+            return 'clear'
+        return None
+
+    def _apply(self, checks, state, now):
+        """Update state in place; return [(rule, message, fired)] to send, or None if nothing changed."""
+        messages = []
+        changed = False
+        for rule, value in checks:
+            rule_state = state.setdefault(rule.name, {'active': False, 'notified': False, 'last_sent': None})
+            transition = self._transition(rule, rule_state, value)
+            if transition == 'fire':
+                rule_state['active'] = True
+                last_sent = rule_state.get('last_sent')
+                if last_sent is None or now - last_sent >= rule.cooldown:
+                    # Assumed delivered; _forget_notified undoes this if the send fails.
+                    rule_state['notified'] = True
+                    rule_state['last_sent'] = now
+                    messages.append((rule, "ALERT {}: {}".format(self._label(rule), rule.describe(value)), True))
+                else:
+                    logging.info("Alert %s fired within cooldown; not notifying", rule.name)
+                    rule_state['notified'] = False
+                changed = True
+            elif transition == 'clear':
+                rule_state['active'] = False
+                if rule_state.get('notified'):
+                    messages.append((rule, "CLEARED {}: {}".format(self._label(rule), rule.describe(value)), False))
+                rule_state['notified'] = False
+                changed = True
+        return messages if changed else None
+
+    def _forget_notified(self, rules, now):
+        """Mark alerts whose notification failed as unsent, so the next firing is not held by the cooldown."""
+        lock_file = self._locked()
+        try:
+            state = self._load()
+            for rule in rules:
+                rule_state = state.get(rule.name) or {}
+                if rule_state.get('last_sent') == now:
+                    rule_state['notified'] = False
+                    rule_state['last_sent'] = None
+            self._save(state)
+        finally:
+            lock_file.close()
+
+    def _label(self, rule):
+        if self.tank_name is None:
+            return rule.name
+        return "{} [{}]".format(rule.name, self.tank_name)
+
+    def _send(self, message):
+        logging.warning(message)
+        try:
+            return bool(self.notify(message))
+        except Exception as exc:
+            logging.error("Failed to send alert: %s", exc)
+            return False
+
+    def on_reading(self, timestamp, distance_in_inches, flow=None):
+        gallons = self.tank.gallons_at_height(self.tank.height_at_distance(distance_in_inches))
+        # A fresh reading is zero minutes stale, which clears any stale alert.
+        values = [(GALLONS, gallons), (STALE, 0.0)]
+        if flow is not None:
+            rate = flow.state.get('ewma_gpm')
+            if rate is not None:
+                values.append((RATE, rate))
+        self.evaluate_many(values, timestamp.timestamp())
+
+    def check_stale(self, last_reading_time, now=None):
+        """Evaluate "stale" rules; call from a process that outlives a dead sampler."""
+        now = now or datetime.datetime.now()
+        minutes = (now - last_reading_time).total_seconds() / 60.0
+        self.evaluate(STALE, minutes, now.timestamp())
+
+
+def build_alert_engine(config, secrets, tank_name=None):
+    """AlertEngine posting to the Slack webhook, or None if alerts are not configured."""
+    alerts_config = config.get('alerts') or {}
+    rules_config = alerts_config.get('rules') or []
+    state_path = alerts_config.get('state_file')
+    if not rules_config or not state_path:
+        return None
+    webhook_endpoint = (secrets.get('slack') or {}).get('webhook_endpoint')
+    if not webhook_endpoint:
+        logging.error("Alerts configured but no webhook_endpoint; alerts disabled")
+        return None
+    try:
+        rules = [AlertRule(rule) for rule in rules_config]
+    except (KeyError, ValueError) as exc:
+        logging.error("Invalid alert rule: %s", exc)
+        return None
+    from outbox import KIND_ALERT, outbox_from_config
+    outbox = outbox_from_config(config, kind=KIND_ALERT)
+    if outbox is not None:
+        # Queued, so a reading never waits on Slack; the command checker or cron flushes.
+        return AlertEngine(state_path, rules, outbox.post_message, config.get('tank') or {}, tank_name)
+    # Imported here: requests is only needed once an alert is configured.
+    from slack_client import SlackClient
+    client = SlackClient(webhook_endpoint=webhook_endpoint)
+    return AlertEngine(state_path, rules, client.post_message, config.get('tank') or {}, tank_name)
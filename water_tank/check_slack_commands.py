@@ -1,21 +1,28 @@
 #!/usr/bin/env python3
 """
 Check Slack channel for commands and respond.
-Runs every minute via cron to check for commands like "tank:level".
+Runs every minute via cron to check for commands like "tank:level", or stays
+resident with --daemon and polls adaptively.
 Python 3.5-compatible, Pi Zero friendly.
+
+Most runs find nothing to do, so modules that are slow to import on a Pi Zero
+(requests, numpy via watertank, the log readers) are imported inside the
+functions that need them rather than at the top of this file.
 """
 
+import argparse
+import fcntl
 import json
 import logging
+import signal
+import threading
 import time
 import os
 
-from config_loader import ConfigLoader
-from log_distance import LogDistance
-from slack_client import SlackClient
-from graph_utils import sparkline
-from tank_message import build_tank_message, gallons_from_distance, parse_distance_in_inches
-from watertank import WaterTank
+import metrics
+from config_loader import ConfigLoader, file_signature
+from outbox import outbox_from_config
+from response_cache import ResponseCache, log_signature
 
 # Configuration paths
 DEFAULT_CONFIG_PATH = ConfigLoader.default_config_path()
@@ -28,6 +35,19 @@ DEFAULT_LOOKBACK_SECONDS = 5 * 60
 # Allowed Slack user IDs fallback
 DEFAULT_ALLOWED_USERS = []  # e.g. ["U012ABCDEF"]
 
+COMMANDS = ("tank:level", "tank:graph", "tank:rate")
+
+# "tank:graph 2000" graphs that many readings, downsampled to a fixed width
+MAX_GRAPH_READINGS = 10080
+
+# Daemon polling: fast right after a command, backing off while idle
+DEFAULT_MIN_POLL_SECONDS = 2.0
+DEFAULT_MAX_POLL_SECONDS = 30.0
+DEFAULT_POLL_BACKOFF = 1.5
+
+COMMAND_SECONDS = metrics.histogram('water_tank_command_seconds',
+                                    'Time to build and post (or queue) the reply to a command', ('command',))
+
 # Setup logging (file handler added after config load)
 logging.basicConfig(
     level=logging.INFO,
@@ -96,51 +116,129 @@ def save_state_atomic(state, state_path):
             pass
 
 
-def handle_tank_level_command(slack_client, log_reader, tank_config, webhook_endpoint):
-    """Handle tank:level by posting a tank status message"""
+def acquire_lock(lock_path):
+    """Take an exclusive non-blocking lock; return the open file or None if held elsewhere."""
+    lock_file = open(lock_path, 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def build_tank_level_message(log_reader, tank_config):
+    """Tank status text for tank:level, or None if there is no reading."""
+    from tank_message import build_tank_message
     last_line = log_reader.read_last_line()
     if last_line is None:
         logging.error("Cannot read tank log; not sending response")
-        return
+        return None
     if last_line == "":
         logging.error("Tank log is empty; not sending response")
-        return
+        return None
     message, _, _, _ = build_tank_message(last_line, tank_config)
-    ok = slack_client.post_message(message, endpoint=webhook_endpoint)
-    if ok:
-        logging.info("Sent tank level to Slack")
-    else:
-        logging.error("Failed to send tank level to Slack")
+    return message
+
+
+def build_all_tanks_level_message(site_readers):
+    """One tank:level reply covering every (TankSite, reader) pair."""
+    parts = []
+    for site, log_reader in site_readers:
+        message = build_tank_level_message(log_reader, site.tank)
+        parts.append("*{}*\n{}".format(site.name, message or "No readings"))
+    return "\n".join(parts)
+
+
+def build_tank_graph_message(log_reader, tank_config, count=10, window=None):
+    """Sparkline text for tank:graph, or None if there is nothing to graph."""
+    from graph_utils import fixed_width_sparkline
+    from log_distance import format_entry
+    from rollups import WINDOWS as ROLLUP_WINDOWS
+    from tank_message import build_tank_message
+    from watertank import WaterTank
+    if window is not None and window.isdigit():
+        count = max(1, min(int(window), MAX_GRAPH_READINGS))
+        window = None
+    if window is not None:
+        if log_reader.rollups is None or window not in ROLLUP_WINDOWS:
+            logging.warning("Graph window %r unavailable; graphing last %d readings", window, count)
+        else:
+            return build_tank_graph_window_message(log_reader, tank_config, window)
+    tank = WaterTank.from_config(tank_config)
+    readings = log_reader.read_last_readings(count)
+    if not readings:
+        logging.error("No valid readings for graph")
+        return None
+    values = tank.gallons_at_distances([distance for _, distance in readings])
+    latest_line = format_entry(*readings[-1])
+    # Peaks survive the downsampling, so long histories still fit one Slack line.
+    graph = fixed_width_sparkline(zip((stamp.timestamp() for stamp, _ in readings), values))
+    message, _, _, _ = build_tank_message(latest_line, tank_config)
+    return "Last {} readings (gal): {}\n{}".format(len(values), graph, message)
 
 
-def handle_tank_graph_command(slack_client, log_reader, tank_config, webhook_endpoint, count=10):
-    lines = log_reader.read_last_lines(count)
-    if not lines:
-        logging.error("Tank log is empty; not sending graph")
-        return
-    values = []
-    tank_height = float(tank_config.get('height_in', 75.0))
-    tank_radius = float(tank_config.get('radius_in', 54.23))
-    meter_height = float(tank_config.get('meter_height_in', 4.0))
-    tank = WaterTank(tank_radius, tank_height)
-    for line in lines:
-        try:
-            meter_read = parse_distance_in_inches(line)
-            values.append(gallons_from_distance(meter_read, tank, tank_height, meter_height))
-        except Exception:
-            continue
-    if not values:
-        logging.error("No valid readings for graph")
+def build_tank_rate_message(log_reader):
+    """Streaming flow-rate summary for tank:rate, or None if flow is not tracked."""
+    if log_reader.flow is None:
+        logging.error("Flow tracking not configured (flow.state_file); not sending rate")
+        return None
+    return log_reader.flow.summary()
+
+
+def build_tank_graph_window_message(log_reader, tank_config, window):
+    """Graph a long window (24h/7d/30d) from pre-aggregated rollup buckets."""
+    from graph_utils import sparkline
+    from tank_message import build_tank_message
+    buckets = log_reader.rollups.window(window)
+    if not buckets:
+        logging.error("No rollups for graph window %s", window)
+        return None
+    graph = sparkline([b.mean for b in buckets])
+    low = min(b.min for b in buckets)
+    high = max(b.max for b in buckets)
+    graph_message = "Last {} (gal): {}\n    Range: {:,.0f} - {:,.0f} gallons".format(window, graph, low, high)
+    last_line = log_reader.read_last_line()
+    if last_line:
+        message, _, _, _ = build_tank_message(last_line, tank_config)
+        graph_message = "{}\n{}".format(graph_message, message)
+    return graph_message
+
+
+def build_command_message(name, argument, log_reader, tank_config):
+    """Response text for a parsed command, or None if there is nothing to send."""
+    if name == "tank:level":
+        return build_tank_level_message(log_reader, tank_config)
+    if name == "tank:graph":
+        return build_tank_graph_message(log_reader, tank_config, window=argument)
+    if name == "tank:rate":
+        return build_tank_rate_message(log_reader)
+    return None
+
+
+def post_response(slack_client, message, webhook_endpoint, description):
+    if message is None:
         return
-    graph = sparkline(values)
-    latest_line = lines[-1]
-    message, _, _, _ = build_tank_message(latest_line, tank_config)
-    graph_message = "Last {} readings (gal): {}\n{}".format(len(values), graph, message)
-    ok = slack_client.post_message(graph_message, endpoint=webhook_endpoint)
+    ok = slack_client.post_message(message, endpoint=webhook_endpoint)
     if ok:
-        logging.info("Sent tank graph to Slack")
+        logging.info("Sent %s to Slack", description)
     else:
-        logging.error("Failed to send tank graph to Slack")
+        logging.error("Failed to send %s to Slack", description)
+
+
+def command_argument(text):
+    """Return the first word after the command name, lower-cased, or None."""
+    tokens = (text or "").strip().lower().split()
+    return tokens[1] if len(tokens) > 1 else None
+
+
+def parse_command(text):
+    """Return (command, argument) for a recognised command message, else None."""
+    for name in COMMANDS:
+        if is_command(text, name):
+            # Only tank:graph takes an argument; ignore trailing words otherwise.
+            return name, command_argument(text) if name == "tank:graph" else None
+    return None
 
 
 def is_command(text, command_name):
@@ -152,32 +250,129 @@ def is_command(text, command_name):
 
 
 class SlackCommandChecker:
-    def __init__(self, config, secrets):
+    def __init__(self, loader):
+        self.loader = loader
+        self.config = None
+        self.secrets = None
+        # Reused across polls in daemon mode so connections and readers stay warm.
+        self._slack_client = None
+        # LogDistance per tank name (None for a single-tank config)
+        self._log_readers = {}
+        self.outbox = None
+        self.response_cache = None
+        self.reload()
+
+    def reload(self):
+        """Pick up edits to config.json/secrets.json; a stat() of each when unchanged."""
+        config = self.loader.load_config()
+        secrets = self.loader.load_secrets()
+        if config is self.config and secrets is self.secrets:
+            return
+        if self.config is not None:
+            logging.info("Configuration changed; reloading")
         self.config = config
         self.secrets = secrets
+        for reader in self._log_readers.values():
+            reader.close()
+        if self._slack_client is not None:
+            self._slack_client.close()
+        self._slack_client = None
+        self._log_readers = {}
+        # When configured, replies are queued on disk and flushed after each poll.
+        self.outbox = outbox_from_config(config)
+        self.response_cache = ResponseCache.from_config(config)
+
+    def slack_client(self, bot_token):
+        if self._slack_client is None:
+            from slack_client import SlackClient
+            self._slack_client = SlackClient(bot_token=bot_token, api_base=self.loader.slack().api_base)
+        return self._slack_client
+
+    def log_reader(self, site):
+        reader = self._log_readers.get(site.name)
+        if reader is None:
+            from log_distance import LogDistance
+            reader = self._log_readers[site.name] = LogDistance.from_config(site.config, site.log_file)
+        return reader
+
+    def check_stale_readings(self, sites):
+        """Evaluate "stale" alert rules; the sampler cannot report its own silence."""
+        for site in sites:
+            rules = (site.config.get('alerts') or {}).get('rules') or []
+            if not any(rule.get('metric') == 'stale' for rule in rules):
+                continue
+            from alerts import build_alert_engine
+            from tank_message import parse_timestamp
+            engine = build_alert_engine(site.config, self.secrets, site.name)
+            last_line = self.log_reader(site).read_last_line()
+            if engine is None or not last_line:
+                continue
+            try:
+                engine.check_stale(parse_timestamp(last_line))
+            except ValueError as exc:
+                logging.error("Cannot check for stale readings: %s", exc)
+
+    def build_message(self, name, argument, sites):
+        if name == "tank:level" and len(sites) > 1:
+            return build_all_tanks_level_message([(site, self.log_reader(site)) for site in sites])
+        # Graphs and rates are for the first tank listed.
+        site = sites[0]
+        return build_command_message(name, argument, self.log_reader(site), site.tank)
+
+    def command_message(self, name, argument, sites):
+        """Response text for a command, reused while the tank logs are unchanged."""
+        signatures = [log_signature(site.log_file) for site in sites]
+        if None in signatures:
+            return self.build_message(name, argument, sites)
+        # The sampler saves flow and rollup state just after the log line, so key on those files too.
+        for site in sites:
+            reader = self.log_reader(site)
+            if reader.flow is not None:
+                signatures.append(file_signature(reader.flow.state_path))
+            if reader.rollups is not None:
+                signatures.append(file_signature(reader.rollups.state_path))
+        if name == "tank:graph":
+            # Rollup windows end at the current time, so age out with the hour.
+            signatures.append(time.strftime('%Y-%m-%d %H'))
+        key = self.response_cache.make_key(signatures, name, [argument, [site.tank.raw for site in sites]])
+        message = self.response_cache.get(key)
+        if message is None:
+            message = self.build_message(name, argument, sites)
+            if message is not None:
+                self.response_cache.put(key, message)
+        return message
+
+    def flush_outbox(self, slack_client, webhook_endpoint):
+        """Send queued replies and alerts; anything unsent stays queued for the next poll."""
+        if self.outbox is None:
+            return
+        sent, remaining = self.outbox.flush(slack_client, endpoint=webhook_endpoint)
+        if sent or remaining:
+            logging.info("Outbox: sent %d, %d remaining", sent, remaining)
 
     def process_commands(self):
-        slack_config = self.config.get('slack') or {}
-        slack_secrets = self.secrets.get('slack') or {}
+        """Handle new commands once; return True if any command was processed."""
+        self.reload()
+        slack_config = self.loader.slack()
 
-        bot_token = slack_secrets.get('bot_token')
-        channel_id = slack_config.get('channel_id')
-        webhook_endpoint = slack_secrets.get('webhook_endpoint')
-        allowed_users = set(slack_config.get('allowed_user_ids') or DEFAULT_ALLOWED_USERS)
+        bot_token = slack_config.bot_token
+        channel_id = slack_config.channel_id
+        webhook_endpoint = slack_config.webhook_endpoint
+        allowed_users = set(slack_config.allowed_user_ids or DEFAULT_ALLOWED_USERS)
 
         if not bot_token or not channel_id:
             logging.error("Missing bot_token or channel_id")
-            return
+            return False
 
         if not webhook_endpoint:
             logging.warning("No webhook_endpoint configured; can't respond")
-            return
+            return False
 
-        paths_config = self.config.get('paths') or {}
-        state_path = paths_config.get('state_file', '/home/eukota/.water_tank/slack_commands_state.json')
-        log_path = paths_config.get('log_file', '/home/eukota/.water_tank/water_distance.txt')
-        command_log_path = paths_config.get('command_log', '/home/eukota/.water_tank/slack_commands.log')
-        add_file_logger(command_log_path)
+        paths_config = self.loader.paths()
+        state_path = paths_config.state_file
+        sites = self.loader.tanks()
+        add_file_logger(paths_config.command_log)
+        self.check_stale_readings(sites)
 
         state = load_state(state_path)
         last_processed_ts = state.get("last_processed_ts", "0")
@@ -195,23 +390,45 @@ class SlackCommandChecker:
         if lookback_oldest > oldest:
             oldest = lookback_oldest
 
-        slack_client = SlackClient(bot_token=bot_token)
-        messages = slack_client.fetch_history(channel_id, oldest)
-        if messages is None:
-            return
-
-        if not messages:
-            return
-
-        messages.reverse()
+        slack_client = self.slack_client(bot_token)
+        self.flush_outbox(slack_client, webhook_endpoint)
+        # Already loaded by self.slack_client; imported here to keep requests off startup.
+        from slack_client import SlackHistoryError
 
+        # Pages arrive newest first and are answered one at a time, so a long
+        # outage never holds more than one page in memory. A command repeated
+        # on an older page shares the response already sent for it.
+        responder = self.outbox or slack_client
+        answered = []
         new_last_ts = last_ts_num
-        processed_any = False
-
-        log_reader = LogDistance(log_path)
-        tank_config = self.config.get('tank') or {}
-
-        for m in messages:
+        try:
+            for page in slack_client.iter_history_pages(channel_id, oldest):
+                commands, page_last_ts = self.page_commands(page, last_ts_num, allowed_users, answered)
+                for name, argument in commands:
+                    with COMMAND_SECONDS.labels(name).time():
+                        message = self.command_message(name, argument, sites)
+                        post_response(responder, message, webhook_endpoint, name)
+                answered.extend(commands)
+                if page_last_ts > new_last_ts:
+                    new_last_ts = page_last_ts
+                    state["last_processed_ts"] = str(new_last_ts)
+                    save_state_atomic(state, state_path)
+        except SlackHistoryError as exc:
+            logging.error("Error fetching Slack messages: %s", exc)
+            if not answered:
+                return False
+
+        processed_any = bool(answered)
+        if processed_any:
+            self.flush_outbox(slack_client, webhook_endpoint)
+        return processed_any
+
+    @staticmethod
+    def page_commands(page, last_ts_num, allowed_users, answered):
+        """New commands on one history page, oldest first, and the page's newest ts."""
+        commands = []
+        page_last_ts = last_ts_num
+        for m in reversed(page):
             ts = m.get("ts")
             if not ts:
                 continue
@@ -231,43 +448,90 @@ class SlackCommandChecker:
             if allowed_users and user not in allowed_users:
                 continue
 
-            text = m.get("text", "")
+            command = parse_command(m.get("text", ""))
+            if command is not None:
+                if command in commands or command in answered:
+                    logging.info("Coalescing duplicate %s from %s ts=%s", command[0], user, ts)
+                else:
+                    logging.info("Command %s from %s ts=%s", command[0], user, ts)
+                    commands.append(command)
+
+            if ts_num > page_last_ts:
+                page_last_ts = ts_num
+        return commands, page_last_ts
+
+    def run_daemon(self, stop_event):
+        """Poll until stop_event is set, fast after a command and backing off when idle."""
+        interval = None
+        while not stop_event.is_set():
+            try:
+                active = self.process_commands()
+            except Exception as exc:
+                logging.error("Unexpected error: %s", exc)
+                active = False
+            # Read each cycle so polling edits apply without a restart.
+            polling_config = self.config.get('polling') or {}
+            min_interval = float(polling_config.get('min_interval_seconds', DEFAULT_MIN_POLL_SECONDS))
+            max_interval = float(polling_config.get('max_interval_seconds', DEFAULT_MAX_POLL_SECONDS))
+            backoff = float(polling_config.get('backoff', DEFAULT_POLL_BACKOFF))
+            if interval is None:
+                interval = min_interval
+            if active:
+                interval = min_interval
+            else:
+                interval = min(interval * backoff, max_interval)
+            stop_event.wait(interval)
+
+
+def process_commands(daemon=False, config_path=None, secrets_path=None):
+    loader = ConfigLoader(
+        config_path=config_path or DEFAULT_CONFIG_PATH,
+        secrets_path=secrets_path or DEFAULT_SECRETS_PATH
+    )
+    if not load_config_and_secrets(loader):
+        return
 
-            if is_command(text, "tank:level"):
-                logging.info("Command tank:level from %s ts=%s", user, ts)
-                handle_tank_level_command(slack_client, log_reader, tank_config, webhook_endpoint)
-                processed_any = True
-            elif is_command(text, "tank:graph"):
-                logging.info("Command tank:graph from %s ts=%s", user, ts)
-                handle_tank_graph_command(slack_client, log_reader, tank_config, webhook_endpoint)
-                processed_any = True
+    paths_config = loader.paths()
+    if paths_config.state_file is None or paths_config.lock_file is None:
+        logging.error("paths.state_file is not set; the command checker needs it")
+        return
 
-            if ts_num > new_last_ts:
-                new_last_ts = ts_num
+    # One instance at a time, so cron runs and the daemon never race on the state file.
+    lock_file = acquire_lock(paths_config.lock_file)
+    if lock_file is None:
+        logging.info("Another command checker is running; exiting")
+        return
 
-        if processed_any:
-            state["last_processed_ts"] = str(new_last_ts)
-            save_state_atomic(state, state_path)
-        else:
-            state["last_processed_ts"] = str(new_last_ts)
-            save_state_atomic(state, state_path)
+    try:
+        with metrics.exporting(loader, 'commands', periodic=daemon):
+            checker = SlackCommandChecker(loader)
+            if not daemon:
+                checker.process_commands()
+                return
+            stop_event = threading.Event()
 
+            def handle_stop(signum, frame):
+                logging.info("Received signal %s; stopping command checker", signum)
+                stop_event.set()
 
-def process_commands():
-    loader = ConfigLoader(
-        config_path=DEFAULT_CONFIG_PATH,
-        secrets_path=DEFAULT_SECRETS_PATH
-    )
-    config_secrets = load_config_and_secrets(loader)
-    if not config_secrets:
-        return
-    config, secrets = config_secrets
-    checker = SlackCommandChecker(config, secrets)
-    checker.process_commands()
+            signal.signal(signal.SIGTERM, handle_stop)
+            signal.signal(signal.SIGINT, handle_stop)
+            checker.run_daemon(stop_event)
+    finally:
+        lock_file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check Slack for tank commands and respond.')
+    parser.add_argument('--daemon', help='Stay resident and poll adaptively until SIGTERM', action='store_true')
+    parser.add_argument('--config', type=str, help='Path to config.json', default=None)
+    parser.add_argument('--secrets', type=str, help='Path to secrets.json', default=None)
+    args = parser.parse_args()
+    process_commands(daemon=args.daemon, config_path=args.config, secrets_path=args.secrets)
 
 
 if __name__ == "__main__":
     try:
-        process_commands()
+        main()
     except Exception as e:
         logging.error("Unexpected error: %s", e)
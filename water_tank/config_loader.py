@@ -3,11 +3,340 @@ import logging
 import os
 
 
+class ConfigError(ValueError):
+    '''Raised when a config section fails validation.'''
+
+
+def _positive_float(value):
+    value = float(value)
+    if value <= 0:
+        raise ValueError("must be positive")
+    return value
+
+
+def _non_negative_float(value):
+    value = float(value)
+    if value < 0:
+        raise ValueError("must not be negative")
+    return value
+
+
+def _positive_int(value):
+    if isinstance(value, bool) or int(value) != float(value):
+        raise ValueError("must be a whole number")
+    value = int(value)
+    if value <= 0:
+        raise ValueError("must be positive")
+    return value
+
+
+def _bool(value):
+    if not isinstance(value, bool):
+        raise ValueError("must be true or false")
+    return value
+
+
+def _optional_str(value):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError("must be a string")
+    return value
+
+
+def _str_tuple(value):
+    if value is None:
+        return ()
+    if isinstance(value, str) or not all(isinstance(v, str) for v in value):
+        raise ValueError("must be a list of strings")
+    return tuple(value)
+
+
+def _one_of(*choices):
+    def check(value):
+        if value not in choices:
+            raise ValueError("must be one of %s" % ", ".join(choices))
+        return value
+    return check
+
+
+class ConfigSection:
+    '''A validated config section with defaults applied.
+
+    Subclasses list FIELDS as (name, converter, default); every field is
+    converted once at load time so readers use plain attributes.
+    '''
+    __slots__ = ('raw',)
+    NAME = None
+    FIELDS = ()
+    SECRET_FIELDS = ()
+
+    def __init__(self, section=None):
+        section = section or {}
+        if not isinstance(section, dict):
+            raise ConfigError("%s: must be an object" % self.NAME)
+        # Original mapping, for modules that still take a plain dict.
+        self.raw = section
+        for name, convert, default in self.FIELDS:
+            value = section.get(name, default)
+            try:
+                value = convert(value) if value is not None else None
+            except (TypeError, ValueError) as exc:
+                raise ConfigError("%s.%s = %r: %s" % (self.NAME, name, value, exc))
+            setattr(self, name, value)
+
+    def __repr__(self):
+        values = []
+        for name, _, _ in self.FIELDS:
+            value = getattr(self, name)
+            # Keep tokens out of logs.
+            values.append("%s=%r" % (name, '***' if value and name in self.SECRET_FIELDS else value))
+        fields = ", ".join(values)
+        return "%s(%s)" % (type(self).__name__, fields)
+
+
+class TankConfig(ConfigSection):
+    __slots__ = ('radius_in', 'height_in', 'meter_height_in', 'shape', '_table', '_water_tank')
+    NAME = 'tank'
+    FIELDS = (
+        ('radius_in', _positive_float, 54.23),
+        ('height_in', _positive_float, 75.0),
+        ('meter_height_in', _non_negative_float, 4.0),
+        ('shape', _one_of('vertical_cylinder', 'horizontal_cylinder', 'cone_bottom', 'table'), 'vertical_cylinder'),
+    )
+    # Dimension each computed shape needs besides radius_in; see tank_geometry.
+    SHAPE_FIELDS = {
+        'horizontal_cylinder': 'length_in',
+        'cone_bottom': 'cone_height_in',
+    }
+
+    def __init__(self, section=None):
+        ConfigSection.__init__(self, section)
+        self._table = None
+        self._water_tank = None
+        if self.shape is None:
+            self.shape = 'vertical_cylinder'
+        field = self.SHAPE_FIELDS.get(self.shape)
+        if field is not None:
+            value = self.raw.get(field)
+            try:
+                _positive_float(value)
+            except (TypeError, ValueError) as exc:
+                raise ConfigError("tank.%s = %r: required for shape %s and %s" % (field, value, self.shape, exc))
+        elif self.shape == 'table':
+            if not self.raw.get('strapping_table'):
+                raise ConfigError("tank.strapping_table: required for shape table")
+            # Imported here: only table tanks need tank_geometry at load time.
+            from tank_geometry import compile_table
+            try:
+                self._table = compile_table(self.raw)
+            except (TypeError, ValueError) as exc:
+                raise ConfigError("tank.strapping_table: %s" % exc)
+
+    def water_tank(self):
+        '''The WaterTank for this section, built on first use'''
+        if self._water_tank is None:
+            # Imported here: watertank imports this module.
+            from watertank import WaterTank
+            from tank_geometry import VERTICAL_CYLINDER, compile_table
+            table = self._table
+            if table is None and self.shape != VERTICAL_CYLINDER:
+                table = compile_table(self.raw)
+            self._water_tank = WaterTank(self.radius_in, self.height_in, self.meter_height_in, table=table)
+        return self._water_tank
+
+
+class SensorConfig(ConfigSection):
+    __slots__ = ('pin_trigger', 'pin_echo', 'sleep_time', 'sample_interval', 'timing', 'echo_timeout',
+                 'burst_count', 'adaptive', 'min_sample_interval', 'max_sample_interval', 'change_rate_in_per_min',
+                 'deadband_in', 'max_gap_seconds', 'stagger_seconds')
+    NAME = 'sensor'
+    # Defaults mirror distance_sensor/log_distance, which import RPi.GPIO and so are not imported here.
+    FIELDS = (
+        ('pin_trigger', _positive_int, 7),
+        ('pin_echo', _positive_int, 11),
+        ('sleep_time', _non_negative_float, 5.0),
+        ('sample_interval', _positive_float, 60.0),
+        ('timing', _one_of('edge', 'busy'), 'edge'),
+        ('echo_timeout', _positive_float, 0.1),
+        ('burst_count', _positive_int, 1),
+        # Adaptive sampling (daemon mode only); see sampling.AdaptiveSampler.
+        ('adaptive', _bool, False),
+        ('min_sample_interval', _positive_float, 10.0),
+        ('max_sample_interval', _positive_float, 300.0),
+        ('change_rate_in_per_min', _positive_float, 0.1),
+        ('deadband_in', _non_negative_float, 0.2),
+        ('max_gap_seconds', _positive_float, 900.0),
+        # Minimum spacing between trigger pulses of different sensors (see `tanks`).
+        ('stagger_seconds', _positive_float, 0.06),
+    )
+
+    def __init__(self, section=None):
+        ConfigSection.__init__(self, section)
+        if self.min_sample_interval > self.max_sample_interval:
+            raise ConfigError("sensor.min_sample_interval must not exceed sensor.max_sample_interval")
+
+
+class PathsConfig(ConfigSection):
+    __slots__ = ('log_file', 'state_file', 'command_log', 'lock_file', 'outbox_dir')
+    NAME = 'paths'
+    FIELDS = (
+        ('log_file', _optional_str, '/home/eukota/.water_tank/water_distance.txt'),
+        ('state_file', _optional_str, '/home/eukota/.water_tank/slack_commands_state.json'),
+        ('command_log', _optional_str, '/home/eukota/.water_tank/slack_commands.log'),
+        ('lock_file', _optional_str, None),
+        ('outbox_dir', _optional_str, None),
+    )
+
+    def __init__(self, section=None):
+        ConfigSection.__init__(self, section)
+        if self.lock_file is None and self.state_file is not None:
+            self.lock_file = self.state_file + '.lock'
+
+
+class SlackConfig(ConfigSection):
+    '''The config.json slack section merged with the secrets.json one.'''
+    __slots__ = ('channel_id', 'allowed_user_ids', 'api_base', 'bot_token', 'webhook_endpoint')
+    NAME = 'slack'
+    FIELDS = (
+        ('channel_id', _optional_str, None),
+        ('allowed_user_ids', _str_tuple, ()),
+        ('api_base', _optional_str, None),
+        ('bot_token', _optional_str, None),
+        ('webhook_endpoint', _optional_str, None),
+    )
+    SECRET_FIELDS = ('bot_token', 'webhook_endpoint')
+
+
+class FleetConfig(ConfigSection):
+    __slots__ = ('collector_url', 'device_id', 'token', 'state_file', 'batch_size', 'interval', 'timeout')
+    NAME = 'fleet'
+    FIELDS = (
+        ('collector_url', _optional_str, None),
+        ('device_id', _optional_str, None),
+        ('token', _optional_str, None),
+        ('state_file', _optional_str, '/home/eukota/.water_tank/fleet_shipper_state.json'),
+        ('batch_size', _positive_int, 500),
+        ('interval', _positive_float, 60.0),
+        ('timeout', _positive_float, 10.0),
+    )
+    SECRET_FIELDS = ('token',)
+
+
+class MetricsConfig(ConfigSection):
+    __slots__ = ('textfile_dir', 'write_interval')
+    NAME = 'metrics'
+    FIELDS = (
+        ('textfile_dir', _optional_str, None),
+        ('write_interval', _positive_float, 15.0),
+    )
+
+
+class TankSite:
+    '''One sensor and the tank it measures, with that tank's log.
+
+    config is a single-tank config dict (tank, sensor, paths.log_file and any
+    per-tank log/flow/alerts sections filled in) for the modules that take a
+    whole config, such as LogDistance.from_config.
+    '''
+    __slots__ = ('name', 'sensor', 'tank', 'log_file', 'config')
+
+    def __init__(self, name, sensor, tank, log_file, config):
+        self.name = name
+        self.sensor = sensor
+        self.tank = tank
+        self.log_file = log_file
+        self.config = config
+
+    def __repr__(self):
+        return "TankSite(name=%r, log_file=%r, pins=(%d, %d))" % (
+            self.name, self.log_file, self.sensor.pin_trigger, self.sensor.pin_echo)
+
+
+# Per-tank sections in a `tanks` entry; anything else is inherited from the top level.
+PER_TANK_SECTIONS = ('log', 'flow', 'alerts')
+
+
+def build_tank_sites(config):
+    '''TankSite tuple for the `tanks` list, or the single top-level tank when there is none'''
+    entries = config.get('tanks')
+    paths = config.get('paths') or {}
+    if not entries:
+        return (TankSite(None, SensorConfig(config.get('sensor')), TankConfig(config.get('tank')),
+                         PathsConfig(paths).log_file, config),)
+    if not isinstance(entries, list):
+        raise ConfigError("tanks: must be a list")
+    sites = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not isinstance(entry.get('name'), str):
+            raise ConfigError("tanks[%d]: needs a name" % i)
+        name = entry['name']
+        if not isinstance(entry.get('log_file'), str):
+            raise ConfigError("tanks[%s]: needs a log_file" % name)
+        # Shared settings (timing, intervals, tank shape) come from the top-level sections.
+        sensor_raw = dict(config.get('sensor') or {})
+        sensor_raw.update(entry.get('sensor') or {})
+        tank_raw = dict(config.get('tank') or {})
+        tank_raw.update(entry.get('tank') or {})
+        try:
+            sensor = SensorConfig(sensor_raw)
+            tank = TankConfig(tank_raw)
+        except ConfigError as exc:
+            raise ConfigError("tanks[%s]: %s" % (name, exc))
+        site_config = dict((k, v) for k, v in config.items() if k != 'tanks')
+        site_config.update({'sensor': sensor_raw, 'tank': tank_raw, 'paths': dict(paths, log_file=entry['log_file'])})
+        for section in PER_TANK_SECTIONS:
+            # Never shared between tanks: each one needs its own state files.
+            site_config[section] = entry.get(section) or {}
+        sites.append(TankSite(name, sensor, tank, entry['log_file'], site_config))
+
+    for attr, label in (('name', 'name'), ('log_file', 'log_file')):
+        values = [getattr(site, attr) for site in sites]
+        if len(set(values)) != len(values):
+            raise ConfigError("tanks: duplicate %s" % label)
+    pins = [pin for site in sites for pin in (site.sensor.pin_trigger, site.sensor.pin_echo)]
+    if len(set(pins)) != len(pins):
+        raise ConfigError("tanks: GPIO pins are shared between sensors")
+    return tuple(sites)
+
+
+TANKS = 'tanks'
+
+SECTION_TYPES = {
+    TankConfig.NAME: TankConfig,
+    SensorConfig.NAME: SensorConfig,
+    PathsConfig.NAME: PathsConfig,
+    SlackConfig.NAME: SlackConfig,
+    FleetConfig.NAME: FleetConfig,
+    MetricsConfig.NAME: MetricsConfig,
+}
+
+
+def file_signature(path):
+    '''(mtime_ns, size) of path, or None if it does not exist'''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
 class ConfigLoader:
+    '''Loads config.json/secrets.json, re-reading a file only when its mtime or size changes.
+
+    load_config() returns the same dict object until the file changes, so
+    long-running processes can call it every cycle and compare identity to
+    notice an edit. tank()/sensor()/paths()/slack() return typed sections that
+    are validated once per change.
+    '''
+
     def __init__(self, config_path=None, secrets_path=None):
         self.config_path = config_path or self.default_config_path()
         self.secrets_path = secrets_path or self.default_secrets_path()
+        # path -> (signature, parsed JSON)
         self._cache = {}
+        # section name -> (source dicts, typed section)
+        self._sections = {}
 
     @staticmethod
     def _config_dir():
@@ -29,13 +358,66 @@ class ConfigLoader:
         return self._load_json(self.secrets_path, force_reload=force_reload)
 
     def _load_json(self, path, force_reload=False):
-        if not force_reload and path in self._cache:
-            return self._cache[path]
+        signature = file_signature(path)
+        cached = self._cache.get(path)
+        if not force_reload and cached is not None and cached[0] == signature:
+            return cached[1]
         try:
             with open(path, 'r') as f:
                 data = json.load(f)
         except Exception as exc:
             logging.error("Failed to load JSON from %s: %s", path, exc)
-            data = {}
-        self._cache[path] = data
+            if cached is not None and signature is not None:
+                # Probably caught mid-edit; keep the last good copy and retry next change.
+                data = cached[1]
+            else:
+                data = {}
+        if cached is not None and data is not cached[1]:
+            logging.info("Reloaded %s", path)
+        self._cache[path] = (signature, data)
         return data
+
+    def section(self, name):
+        '''Typed, validated section; on an invalid edit keeps the previous valid one'''
+        config = self.load_config()
+        sources = (config,)
+        raw = config.get(name) or {}
+        if name in SECTION_TYPES and SECTION_TYPES[name].SECRET_FIELDS:
+            secrets = self.load_secrets()
+            sources = (config, secrets)
+            raw = dict(raw)
+            raw.update(secrets.get(name) or {})
+        cached = self._sections.get(name)
+        if cached is not None and all(a is b for a, b in zip(cached[0], sources)):
+            return cached[1]
+        try:
+            typed = build_tank_sites(config) if name == TANKS else SECTION_TYPES[name](raw)
+        except ConfigError as exc:
+            if cached is None:
+                raise
+            logging.error("Invalid config, keeping previous %s settings: %s", name, exc)
+            typed = cached[1]
+        self._sections[name] = (sources, typed)
+        return typed
+
+    def tank(self):
+        return self.section(TankConfig.NAME)
+
+    def sensor(self):
+        return self.section(SensorConfig.NAME)
+
+    def paths(self):
+        return self.section(PathsConfig.NAME)
+
+    def slack(self):
+        return self.section(SlackConfig.NAME)
+
+    def fleet(self):
+        return self.section(FleetConfig.NAME)
+
+    def metrics(self):
+        return self.section(MetricsConfig.NAME)
+
+    def tanks(self):
+        '''Every configured TankSite; one site built from the top-level sections if there is no `tanks` list'''
+        return self.section(TANKS)
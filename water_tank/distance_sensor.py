@@ -2,20 +2,111 @@
 Distance sensor wrapper for interacting with the ultrasonic sensor.
 '''
 import RPi.GPIO as GPIO
+import collections
+import statistics
+import threading
 import time
 import logging
 
+import metrics
+
 SPEED_OF_SOUND_IN_CM_PER_S = 34300.0
 
+# Longest plausible round trip is ~25 ms (4 m range); anything past this is a lost echo.
+DEFAULT_ECHO_TIMEOUT = 0.1
+
+# HC-SR04 datasheet recommends at least 60 ms between triggers so the previous
+# ping's echoes have died away.
+MIN_RETRIGGER_GAP = 0.06
+
+# Samples further than this many (scaled) MADs from the median are rejected.
+OUTLIER_MAD_LIMIT = 3.0
+MAD_TO_STDDEV = 1.4826
+
+TIMING_EDGE = 'edge'
+TIMING_BUSY = 'busy'
+
+ECHO_SECONDS = metrics.histogram(
+    'water_tank_echo_seconds', 'Seconds from trigger to echo (or timeout) per ping',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.015, 0.02, 0.025, 0.05, 0.1, 0.25))
+TRIGGER_WAIT_SECONDS = metrics.histogram(
+    'water_tank_trigger_wait_seconds', 'Seconds a ping waited for its turn at the shared trigger gate',
+    buckets=(0.001, 0.01, 0.02, 0.04, 0.06, 0.1, 0.25))
+ECHO_TIMEOUTS = metrics.counter('water_tank_echo_timeouts_total', 'Pings that produced no complete echo')
+
+
+class EchoTimeoutError(Exception):
+    '''Raised when no complete echo pulse is seen within the timeout.'''
+
+
+BurstReading = collections.namedtuple('BurstReading', ['median', 'mad', 'stddev', 'rejected', 'samples'])
+
+
+def filter_burst(samples, missed=0):
+    '''Median-filter a list of distances, rejecting MAD outliers.
+
+    missed counts pings that produced no echo; they are reported as rejected.
+    '''
+    if not samples:
+        raise EchoTimeoutError("No echoes in burst of %d" % missed)
+    median = statistics.median(samples)
+    mad = statistics.median([abs(s - median) for s in samples])
+    if mad > 0:
+        limit = OUTLIER_MAD_LIMIT * MAD_TO_STDDEV * mad
+        kept = [s for s in samples if abs(s - median) <= limit]
+    else:
+        kept = list(samples)
+    median = statistics.median(kept)
+    mad = statistics.median([abs(s - median) for s in kept])
+    stddev = statistics.stdev(kept) if len(kept) > 1 else 0.0
+    rejected = (len(samples) - len(kept)) + missed
+    return BurstReading(median, mad, stddev, rejected, len(samples) + missed)
+
+
+class TriggerGate:
+    '''Spaces trigger pulses from several sensors at least gap seconds apart.
+
+    Shared by the sensors of one process so one sensor's ping is never taken
+    for another's echo; the echo waits themselves still overlap.
+    '''
+
+    def __init__(self, gap=MIN_RETRIGGER_GAP):
+        self.gap = gap
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait_turn(self):
+        '''Block until this sensor may trigger; return the seconds waited.'''
+        started = time.perf_counter()
+        with self._lock:
+            delay = self._next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            now = time.perf_counter()
+            self._next_at = now + self.gap
+        return now - started
+
 
 class DistanceSensor:
-    def __init__(self, pin_trigger, pin_echo, sleep_time=5):
+    def __init__(self, pin_trigger, pin_echo, sleep_time=5, timing=TIMING_EDGE, echo_timeout=DEFAULT_ECHO_TIMEOUT,
+                 trigger_gate=None):
+        if timing not in (TIMING_EDGE, TIMING_BUSY):
+            raise ValueError("Unknown timing mode: %r" % timing)
         GPIO.setmode(GPIO.BOARD)
         self.pin_trigger = pin_trigger
         self.pin_echo = pin_echo
+        self.timing = timing
+        self.echo_timeout = echo_timeout
+        self.trigger_gate = trigger_gate
+        self._echo_rise = None
+        self._echo_fall = None
+        self._echo_done = threading.Event()
+        self._triggered_at = None
         GPIO.setup(self.pin_trigger, GPIO.OUT)
         GPIO.setup(self.pin_echo, GPIO.IN)
         GPIO.output(self.pin_trigger, GPIO.LOW)
+        if self.timing == TIMING_EDGE:
+            GPIO.add_event_detect(self.pin_echo, GPIO.BOTH, callback=self._on_echo_edge)
         logging.debug("Waiting for sensor to settle")
         time.sleep(sleep_time)
         logging.debug("Calculating distance")
@@ -24,20 +115,95 @@ class DistanceSensor:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        GPIO.cleanup()
+        # Only this sensor's pins; other sensors in the process may still be running.
+        GPIO.cleanup((self.pin_trigger, self.pin_echo))
 
     def pulse(self, interval=0.00001):
+        if self.trigger_gate is not None:
+            TRIGGER_WAIT_SECONDS.observe(self.trigger_gate.wait_turn())
+        # The echo timer starts here, not before the gate, so other sensors'
+        # turns are not reported as slow echoes.
+        self._triggered_at = time.perf_counter()
         GPIO.output(self.pin_trigger, GPIO.HIGH)
         time.sleep(interval)
         GPIO.output(self.pin_trigger, GPIO.LOW)
 
     def distance_in_inches(self):
-        self.pulse()
-        while GPIO.input(self.pin_echo) == 0:
-            pulse_start_time = time.time()
-        while GPIO.input(self.pin_echo) == 1:
-            pulse_end_time = time.time()
-        pulse_duration = pulse_end_time - pulse_start_time
+        self._triggered_at = None
+        try:
+            if self.timing == TIMING_EDGE:
+                pulse_duration = self._echo_duration_edge()
+            else:
+                pulse_duration = self._echo_duration_busy()
+        except EchoTimeoutError:
+            ECHO_TIMEOUTS.inc()
+            raise
+        finally:
+            # None if the echo pin was stuck high and no ping was sent.
+            if self._triggered_at is not None:
+                ECHO_SECONDS.observe(time.perf_counter() - self._triggered_at)
+        return self.inches_from_duration(pulse_duration)
+
+    def read_burst(self, n=5, spacing=MIN_RETRIGGER_GAP):
+        '''Fire n pings and return a BurstReading with outliers rejected.'''
+        spacing = max(spacing, MIN_RETRIGGER_GAP)
+        samples = []
+        missed = 0
+        for i in range(n):
+            if i:
+                time.sleep(spacing)
+            try:
+                samples.append(self.distance_in_inches())
+            except EchoTimeoutError as exc:
+                logging.debug("Burst ping %d missed: %s", i, exc)
+                missed += 1
+        return filter_burst(samples, missed)
+
+    @staticmethod
+    def inches_from_duration(pulse_duration):
         roundtrip_distance_in_cm = SPEED_OF_SOUND_IN_CM_PER_S * pulse_duration
         distance_in_inches = roundtrip_distance_in_cm / 2.0 / 2.54
         return distance_in_inches
+
+    def _on_echo_edge(self, channel):
+        # Runs on the RPi.GPIO event thread; take the timestamp first.
+        now = time.perf_counter()
+        if GPIO.input(channel):
+            self._echo_rise = now
+        elif self._echo_rise is not None:
+            self._echo_fall = now
+            self._echo_done.set()
+
+    def _wait_for_echo_low(self):
+        deadline = time.perf_counter() + self.echo_timeout
+        while GPIO.input(self.pin_echo) == 1:
+            if time.perf_counter() > deadline:
+                raise EchoTimeoutError("Echo pin stuck high before trigger")
+            time.sleep(0.001)
+
+    def _echo_duration_edge(self):
+        self._wait_for_echo_low()
+        self._echo_rise = None
+        self._echo_fall = None
+        self._echo_done.clear()
+        self.pulse()
+        if not self._echo_done.wait(self.echo_timeout):
+            raise EchoTimeoutError("No echo within %.3f s" % self.echo_timeout)
+        return self._echo_fall - self._echo_rise
+
+    def _echo_duration_busy(self):
+        '''Opt-in fallback that polls the echo pin; pins the CPU while waiting.'''
+        self._wait_for_echo_low()
+        self.pulse()
+        deadline = time.perf_counter() + self.echo_timeout
+        pulse_start_time = time.perf_counter()
+        while GPIO.input(self.pin_echo) == 0:
+            pulse_start_time = time.perf_counter()
+            if pulse_start_time > deadline:
+                raise EchoTimeoutError("Echo never started within %.3f s" % self.echo_timeout)
+        pulse_end_time = pulse_start_time
+        while GPIO.input(self.pin_echo) == 1:
+            pulse_end_time = time.perf_counter()
+            if pulse_end_time > deadline:
+                raise EchoTimeoutError("Echo never ended within %.3f s" % self.echo_timeout)
+        return pulse_end_time - pulse_start_time
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+'''
+Extract the log lines between two timestamps.
+
+Replaces extract_lines.sh: the start line is found by binary search over the
+time-ordered log instead of scanning the whole file, and output is streamed.
+'''
+import argparse
+import gzip
+import logging
+import sys
+
+from config_loader import ConfigLoader
+from log_distance import LogDistance
+from tank_message import parse_timestamp
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract log lines with from_search <= timestamp < to_search.')
+    parser.add_argument('--from_search', '-f', type=str, help='Start timestamp, e.g. 2023-05-01 or "2023-05-01 06:00"', required=True)
+    parser.add_argument('--to_search', '-t', type=str, help='End timestamp (exclusive). Defaults to end of log', default=None)
+    parser.add_argument('--data_file', '-d', type=str, help='Log file to read. Defaults to config.json log_file', default=None)
+    parser.add_argument('--out_file', '-o', type=str, help='File to write. Defaults to stdout', default=None)
+    parser.add_argument('--gzip', help='gzip-compress the output', action='store_true')
+    parser.add_argument('--config', type=str, help='Path to config.json', required=False)
+    parser.add_argument('--build_index', help='Rebuild the sparse timestamp index before extracting', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        start = parse_timestamp(args.from_search)
+        end = parse_timestamp(args.to_search) if args.to_search else None
+    except ValueError as exc:
+        raise SystemExit(str(exc))
+
+    loader = ConfigLoader(config_path=args.config or ConfigLoader.default_config_path())
+    config = loader.load_config()
+    data_file = args.data_file or (config.get('paths') or {}).get('log_file')
+    if not data_file:
+        raise SystemExit("Missing log file. Use --data_file or set paths.log_file in config.json.")
+
+    reader = LogDistance.from_config(config, data_file)
+    if args.build_index:
+        reader.rebuild_index()
+
+    if args.out_file:
+        out = gzip.open(args.out_file, 'wt') if args.gzip else open(args.out_file, 'w')
+    elif args.gzip:
+        out = gzip.open(sys.stdout.buffer, 'wt')
+    else:
+        out = sys.stdout
+
+    count = 0
+    try:
+        for line in reader.read_range(start, end):
+            out.write(line)
+            out.write("\n")
+            count += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logging.info("Extracted %d lines from %s", count, data_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+'''
+Minimal local stand-in for the Slack endpoints this project uses.
+
+Serves conversations.history from an in-memory channel and accepts webhook
+posts, so the command checker can be exercised without a network or a real
+workspace. Point config.json slack.api_base at http://127.0.0.1:PORT/api and
+secrets.json webhook_endpoint at http://127.0.0.1:PORT/webhook.
+
+Add a message to the channel with:
+    curl -X POST 'http://127.0.0.1:PORT/inject?user=U1&text=tank:level'
+'''
+import argparse
+import json
+import logging
+import socketserver
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # A keep-alive client must not block stop().
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # A client that timed out and hung up mid-reply is expected, not a bug.
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            logging.debug("fake slack: client %s went away", client_address)
+        else:
+            HTTPServer.handle_error(self, request, client_address)
+
+
+class FakeSlackServer:
+    def __init__(self, host='127.0.0.1', port=0):
+        self.messages = []
+        self.posts = []
+        self.history_calls = 0
+        self.requests = 0
+        self._failures = []
+        self._stalls = []
+        self._lock = threading.Lock()
+        self._ts = time.time()
+        self._httpd = _ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def inject(self, text, user='U000TEST'):
+        """Add a user message to the channel and return its ts."""
+        with self._lock:
+            # Slack ts values are unique and increasing within a channel.
+            self._ts = max(self._ts + 0.000100, time.time())
+            ts = "%.6f" % self._ts
+            self.messages.append({'type': 'message', 'user': user, 'text': text, 'ts': ts})
+        return ts
+
+    def fail_next(self, status, count=1, retry_after=None):
+        """Answer the next count requests with status (e.g. 429 or 503) instead of serving them."""
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * count)
+
+    def stall_next(self, seconds, count=1):
+        """Accept the next count webhook posts but wait seconds before answering, like a slow Slack."""
+        with self._lock:
+            self._stalls.extend([seconds] * count)
+
+    def _take_stall(self):
+        with self._lock:
+            return self._stalls.pop(0) if self._stalls else 0
+
+    def _take_failure(self):
+        with self._lock:
+            self.requests += 1
+            return self._failures.pop(0) if self._failures else None
+
+    def history(self, oldest, limit, cursor=0):
+        """Return (page, next_cursor) newest first; next_cursor is None on the last page."""
+        with self._lock:
+            self.history_calls += 1
+            matching = [m for m in self.messages if float(m['ts']) > oldest]
+        matching.reverse()
+        end = cursor + limit
+        return matching[cursor:end], (str(end) if end < len(matching) else None)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _reply(self, status, body, content_type='application/json'):
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _injected_failure(self):
+                failure = server._take_failure()
+                if failure is None:
+                    return False
+                status, retry_after = failure
+                data = json.dumps({'ok': False, 'error': 'injected'}).encode('utf-8')
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header('Retry-After', str(retry_after))
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return True
+
+            def do_GET(self):
+                if self._injected_failure():
+                    return
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == '/api/conversations.history':
+                    oldest = float(query.get('oldest', ['0'])[0])
+                    limit = int(query.get('limit', ['100'])[0])
+                    cursor = int(query.get('cursor', ['0'])[0] or 0)
+                    messages, next_cursor = server.history(oldest, limit, cursor)
+                    self._reply(200, json.dumps({
+                        'ok': True,
+                        'messages': messages,
+                        'has_more': next_cursor is not None,
+                        'response_metadata': {'next_cursor': next_cursor or ''},
+                    }))
+                else:
+                    self._reply(404, json.dumps({'ok': False, 'error': 'unknown_method'}))
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8') if length else ''
+                if url.path != '/inject' and self._injected_failure():
+                    return
+                if url.path == '/webhook':
+                    with server._lock:
+                        server.posts.append(json.loads(body or '{}'))
+                    time.sleep(server._take_stall())
+                    self._reply(200, 'ok', content_type='text/plain')
+                elif url.path == '/inject':
+                    query = parse_qs(url.query)
+                    ts = server.inject(query.get('text', [''])[0], query.get('user', ['U000TEST'])[0])
+                    self._reply(200, json.dumps({'ok': True, 'ts': ts}))
+                else:
+                    self._reply(404, json.dumps({'ok': False, 'error': 'not_found'}))
+
+            def log_message(self, fmt, *args):
+                logging.debug("fake slack: " + fmt, *args)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake Slack API/webhook server on localhost.')
+    parser.add_argument('--port', type=int, help='Port to listen on', default=8099)
+    args = parser.parse_args()
+    logging.getLogger().setLevel('INFO')
+    server = FakeSlackServer(port=args.port)
+    logging.info("Fake Slack listening on %s", server.base_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+'''
+Collector that gathers readings from many Pis into one indexed store.
+
+Shippers (fleet_shipper.py) POST gzip-compressed JSON batches of log lines to
+/ingest. Rows are keyed on (device, timestamp) and inserted with INSERT OR
+IGNORE, so a batch re-sent after a lost acknowledgement is harmless. The
+store is SQLite in WAL mode; the primary key doubles as the per-device time
+index used by the queries:
+
+    GET /devices                                   every device and its latest reading
+    GET /latest?device=pi-house                    newest reading for a device
+    GET /range?device=pi-house&start=...&end=...   readings with start <= ts < end
+
+Timestamps in queries use the log format, e.g. "2024-06-01 12:00:00".
+
+    python3 fleet_collector.py --port 8420 --db /var/lib/water_tank/fleet.db
+'''
+import argparse
+import json
+import logging
+import socketserver
+import sqlite3
+import threading
+import zlib
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from tank_message import parse_distance_in_inches
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS readings (
+    device TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    distance_in REAL NOT NULL,
+    line TEXT NOT NULL,
+    PRIMARY KEY (device, ts)
+) WITHOUT ROWID
+'''
+
+INSERT = 'INSERT OR IGNORE INTO readings (device, ts, distance_in, line) VALUES (?, ?, ?, ?)'
+
+DEFAULT_PORT = 8420
+# Decompressed request bodies larger than this are refused.
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+DEFAULT_RANGE_LIMIT = 10000
+
+
+class FleetStore:
+    def __init__(self, path):
+        self.path = path
+        # One connection shared by the handler threads; writes are serialised anyway.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def ingest(self, device, lines):
+        """Store log lines for device; return (accepted, duplicates, rejected)."""
+        rows = []
+        rejected = 0
+        for line in lines:
+            stamp, sep, _ = line.partition(': ')
+            try:
+                if not sep:
+                    raise ValueError(line)
+                rows.append((device, stamp, parse_distance_in_inches(line), line))
+            except ValueError:
+                rejected += 1
+        with self._lock:
+            before = self._conn.total_changes
+            with self._conn:
+                self._conn.executemany(INSERT, rows)
+            accepted = self._conn.total_changes - before
+        return accepted, len(rows) - accepted, rejected
+
+    def latest(self, device):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT ts, distance_in, line FROM readings WHERE device = ? ORDER BY ts DESC LIMIT 1',
+                (device,)).fetchone()
+        return _row_dict(row) if row else None
+
+    def range(self, device, start, end=None, limit=DEFAULT_RANGE_LIMIT):
+        query = 'SELECT ts, distance_in, line FROM readings WHERE device = ? AND ts >= ?'
+        params = [device, start]
+        if end is not None:
+            query += ' AND ts < ?'
+            params.append(end)
+        query += ' ORDER BY ts LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [_row_dict(row) for row in rows]
+
+    def devices(self):
+        with self._lock:
+            names = [row[0] for row in self._conn.execute('SELECT DISTINCT device FROM readings ORDER BY device')]
+        return dict((name, self.latest(name)) for name in names)
+
+    def count(self, device=None):
+        with self._lock:
+            if device is None:
+                return self._conn.execute('SELECT COUNT(*) FROM readings').fetchone()[0]
+            return self._conn.execute('SELECT COUNT(*) FROM readings WHERE device = ?', (device,)).fetchone()[0]
+
+
+def _row_dict(row):
+    return {'ts': row[0], 'distance_in': row[1], 'line': row[2]}
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FleetCollector:
+    def __init__(self, db_path, host='127.0.0.1', port=DEFAULT_PORT, token=None):
+        self.store = FleetStore(db_path)
+        self.token = token
+        self.batches = 0
+        self._httpd = _ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self.store.close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def _handler_class(self):
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _authorized(self):
+                if not collector.token:
+                    return True
+                if self.headers.get('Authorization') == 'Bearer ' + collector.token:
+                    return True
+                self._reply(401, {'ok': False, 'error': 'unauthorized'})
+                return False
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                url = urlparse(self.path)
+                query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+                if url.path == '/devices':
+                    self._reply(200, {'ok': True, 'devices': collector.store.devices()})
+                elif url.path in ('/latest', '/range') and not query.get('device'):
+                    self._reply(400, {'ok': False, 'error': 'missing device'})
+                elif url.path == '/latest':
+                    latest = collector.store.latest(query['device'])
+                    self._reply(200 if latest else 404, {'ok': latest is not None, 'reading': latest})
+                elif url.path == '/range':
+                    try:
+                        limit = int(query.get('limit', DEFAULT_RANGE_LIMIT))
+                    except ValueError:
+                        self._reply(400, {'ok': False, 'error': 'bad limit'})
+                        return
+                    readings = collector.store.range(query['device'], query.get('start', ''), query.get('end'), limit)
+                    self._reply(200, {'ok': True, 'readings': readings})
+                else:
+                    self._reply(404, {'ok': False, 'error': 'not_found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length > MAX_BATCH_BYTES:
+                    self.close_connection = True
+                    self._reply(413, {'ok': False, 'error': 'batch too large'})
+                    return
+                body = self.rfile.read(length) if length else b''
+                if not self._authorized():
+                    return
+                if urlparse(self.path).path != '/ingest':
+                    self._reply(404, {'ok': False, 'error': 'not_found'})
+                    return
+                try:
+                    if self.headers.get('Content-Encoding') == 'gzip':
+                        # Bounded, so a small request cannot inflate into gigabytes.
+                        body = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(body, MAX_BATCH_BYTES + 1)
+                    if len(body) > MAX_BATCH_BYTES:
+                        raise ValueError("batch too large")
+                    batch = json.loads(body.decode('utf-8'))
+                    device = batch['device']
+                    lines = batch['lines']
+                    if not isinstance(device, str) or not device or not isinstance(lines, list):
+                        raise ValueError("bad batch")
+                except (zlib.error, ValueError, KeyError, TypeError) as exc:
+                    self._reply(400, {'ok': False, 'error': str(exc)})
+                    return
+                accepted, duplicates, rejected = collector.store.ingest(device, lines)
+                collector.batches += 1
+                self._reply(200, {'ok': True, 'accepted': accepted, 'duplicates': duplicates, 'rejected': rejected})
+
+            def log_message(self, fmt, *args):
+                logging.debug("collector: " + fmt, *args)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect batched readings from many water tank Pis.')
+    parser.add_argument('--db', type=str, help='SQLite file to store readings in', required=True)
+    parser.add_argument('--host', type=str, help='Address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='Port to listen on', default=DEFAULT_PORT)
+    parser.add_argument('--token', type=str, help='Shared token shippers must send', default=None)
+    args = parser.parse_args()
+    logging.getLogger().setLevel('INFO')
+    collector = FleetCollector(args.db, host=args.host, port=args.port, token=args.token)
+    logging.info("Fleet collector listening on %s", collector.base_url)
+    try:
+        collector.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
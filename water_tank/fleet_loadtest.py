@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+'''
+Localhost load test for the fleet collector and shipper.
+
+Starts a FleetCollector on a free port with a scratch database, then runs one
+thread per simulated Pi: each appends readings to its own log with
+LogDistance and ships them with a FleetShipper while it writes. A fraction of
+acknowledgements is discarded after the collector has stored the batch, as if
+the reply were lost on flaky WiFi, so every device re-sends and the
+collector's deduplication is exercised. The run fails unless the collector
+ends up with exactly devices * readings rows and each device's latest
+reading matches its log.
+
+    python3 fleet_loadtest.py --devices 50 --readings 2000 --lost-acks 0.1
+'''
+import argparse
+import datetime
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from fleet_collector import FleetCollector
+from fleet_shipper import FleetShipper
+from log_distance import LogDistance
+
+
+class LossyShipper(FleetShipper):
+    '''Drops a fraction of acknowledgements after the collector stored the batch.'''
+
+    def __init__(self, collector_url, state_file, lost_acks, seed, **kwargs):
+        FleetShipper.__init__(self, collector_url, state_file, **kwargs)
+        self.lost_acks = lost_acks
+        self.random = random.Random(seed)
+        self.batches = 0
+        self.resent = 0
+
+    def post_batch(self, device, lines):
+        reply = FleetShipper.post_batch(self, device, lines)
+        self.batches += 1
+        if reply is not None and self.random.random() < self.lost_acks:
+            self.resent += len(lines)
+            return None
+        return reply
+
+
+def simulate_device(device, workdir, collector_url, readings, chunk, lost_acks, results):
+    log_path = os.path.join(workdir, device + '.txt')
+    logger = LogDistance(log_path, keep_open=True)
+    shipper = LossyShipper(collector_url, os.path.join(workdir, device + '.state.json'), lost_acks,
+                           seed=device, batch_size=chunk)
+    rng = random.Random(device)
+    stamp = datetime.datetime(2024, 6, 1) + datetime.timedelta(microseconds=rng.randrange(1000000))
+    distance = rng.uniform(10.0, 60.0)
+    written = 0
+    try:
+        while written < readings:
+            for _ in range(min(chunk, readings - written)):
+                stamp += datetime.timedelta(seconds=60)
+                distance = min(max(distance + rng.uniform(-0.3, 0.3), 5.0), 80.0)
+                logger.append_reading(distance, timestamp=stamp)
+                written += 1
+            shipper.ship(device, logger)
+        # Keep going until the lost acknowledgements have all been made good.
+        for _ in range(100):
+            if shipper.ship(device, logger)[1] and shipper.last_shipped(device) == str(stamp):
+                break
+        results[device] = (str(stamp), shipper.batches, shipper.resent)
+    finally:
+        logger.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the fleet collector with simulated devices on localhost.')
+    parser.add_argument('--devices', type=int, help='Simulated Pis shipping concurrently', default=20)
+    parser.add_argument('--readings', type=int, help='Readings per device', default=1000)
+    parser.add_argument('--batch', type=int, help='Readings written and shipped per round', default=100)
+    parser.add_argument('--lost-acks', type=float, help='Fraction of acknowledgements to drop', default=0.1)
+    parser.add_argument('--keep', help='Keep the scratch directory for inspection', action='store_true')
+    args = parser.parse_args()
+    logging.getLogger().setLevel('WARNING')
+
+    workdir = tempfile.mkdtemp(prefix='fleet_loadtest_')
+    collector = FleetCollector(os.path.join(workdir, 'fleet.db'), port=0).start()
+    results = {}
+    threads = [threading.Thread(target=simulate_device,
+                                args=("pi-%03d" % i, workdir, collector.base_url, args.readings, args.batch,
+                                      args.lost_acks, results))
+               for i in range(args.devices)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    failures = []
+    expected = args.devices * args.readings
+    stored = collector.store.count()
+    if stored != expected:
+        failures.append("collector holds %d rows, expected %d" % (stored, expected))
+    query_started = time.monotonic()
+    for device in sorted(results):
+        latest = collector.store.latest(device)
+        if latest is None or latest['ts'] != results[device][0]:
+            failures.append("%s: latest %r, expected %s" % (device, latest, results[device][0]))
+        collector.store.range(device, '2024-06-01 12:00:00', '2024-06-01 13:00:00')
+    query_ms = (time.monotonic() - query_started) * 1000.0 / max(1, len(results))
+    if len(results) != args.devices:
+        failures.append("%d of %d devices finished" % (len(results), args.devices))
+
+    batches = sum(r[1] for r in results.values())
+    resent = sum(r[2] for r in results.values())
+    print("%d devices x %d readings in %.2f s: %.0f readings/s, %d batches, %d readings re-sent after lost acks"
+          % (args.devices, args.readings, elapsed, expected / elapsed, batches, resent))
+    print("latest + 1 hour range query: %.2f ms per device" % query_ms)
+    collector.stop()
+    if args.keep:
+        print("Scratch files in " + workdir)
+    else:
+        shutil.rmtree(workdir)
+    for failure in failures:
+        print("FAIL: " + failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+'''
+Ships this Pi's readings to a fleet collector (fleet_collector.py).
+
+The log is tailed from a persisted offset: the timestamp of the last reading
+the collector acknowledged, kept per device in fleet.state_file. A timestamp
+rather than a byte offset survives segment rotation and the history database,
+and LogDistance.read_range finds it by binary search. Batches of up to
+fleet.batch_size lines are gzipped and POSTed to <collector_url>/ingest; the
+offset is saved (atomically) only after a 200, so delivery is at-least-once
+and the collector's (device, timestamp) key drops anything sent twice.
+
+    python3 fleet_shipper.py              # ship whatever is new, then exit (cron)
+    python3 fleet_shipper.py --daemon     # keep shipping every fleet.interval seconds
+'''
+import argparse
+import datetime
+import gzip
+import itertools
+import json
+import logging
+import os
+import socket
+
+from config_loader import ConfigLoader
+
+STATE_VERSION = 1
+
+
+class FleetShipper:
+    def __init__(self, collector_url, state_file, token=None, batch_size=500, timeout=10.0):
+        self.ingest_url = collector_url.rstrip('/') + '/ingest'
+        self.state_file = state_file
+        self.token = token
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.state = self.load_state()
+
+    def load_state(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+            if state.get('version') == STATE_VERSION:
+                return state
+            logging.warning("Ignoring fleet state %s with unknown version", self.state_file)
+        except FileNotFoundError:
+            pass
+        except Exception as exc:
+            logging.error("Error loading fleet state %s: %s", self.state_file, exc)
+        return {'version': STATE_VERSION, 'devices': {}}
+
+    def save_state(self):
+        """Atomic save; the offset must never point past what the collector has."""
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.state_file)
+
+    def last_shipped(self, device):
+        return (self.state['devices'].get(device) or {}).get('last_ts')
+
+    def pending_lines(self, device, reader):
+        """Iterator of log lines newer than the last acknowledged one."""
+        from tank_message import parse_timestamp
+        last_ts = self.last_shipped(device)
+        if last_ts is None:
+            start = datetime.datetime.min
+        else:
+            start = parse_timestamp(last_ts) + datetime.timedelta(microseconds=1)
+        return reader.read_range(start)
+
+    def post_batch(self, device, lines):
+        """Send one batch; return the collector's reply, or None if it was not acknowledged."""
+        # Imported here: urllib.request pulls in http.client, ssl and email.
+        import urllib.error
+        import urllib.request
+        body = gzip.compress(json.dumps({'device': device, 'lines': lines}).encode('utf-8'))
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = 'Bearer ' + self.token
+        request = urllib.request.Request(self.ingest_url, data=body, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as exc:
+            logging.error("Collector refused batch for %s: HTTP %s", device, exc.code)
+        except (urllib.error.URLError, socket.timeout, OSError, ValueError) as exc:
+            logging.error("Error shipping batch for %s: %s", device, exc)
+        return None
+
+    def ship(self, device, reader):
+        """Send everything new for device; return (lines sent, caught up)."""
+        sent = 0
+        lines = self.pending_lines(device, reader)
+        while True:
+            batch = list(itertools.islice(lines, self.batch_size))
+            if not batch:
+                return sent, True
+            reply = self.post_batch(device, batch)
+            if reply is None:
+                return sent, False
+            self.state['devices'][device] = {'last_ts': batch[-1].partition(': ')[0]}
+            try:
+                self.save_state()
+            except Exception as exc:
+                # The batch is on the collector; it will be re-sent and deduplicated.
+                logging.error("Error saving fleet state %s: %s", self.state_file, exc)
+                return sent, False
+            sent += len(batch)
+            logging.debug("Shipped %d lines for %s (%d new, %d duplicate, %d rejected)", len(batch), device,
+                          reply.get('accepted', 0), reply.get('duplicates', 0), reply.get('rejected', 0))
+
+
+def device_id_for(fleet, site):
+    """Collector device id: fleet.device_id (default: hostname), plus the tank name on multi-tank Pis."""
+    device = fleet.device_id or socket.gethostname()
+    return device if site.name is None else "%s:%s" % (device, site.name)
+
+
+def shipper_from_config(loader):
+    fleet = loader.fleet()
+    if not fleet.collector_url:
+        raise SystemExit("fleet.collector_url is not configured")
+    return FleetShipper(fleet.collector_url, fleet.state_file, token=fleet.token, batch_size=fleet.batch_size,
+                        timeout=fleet.timeout)
+
+
+def ship_all(shipper, loader, readers):
+    """One pass over every configured tank; readers caches a LogDistance per log file."""
+    # Imported here: log_distance loads the sensor and history modules on demand.
+    from log_distance import LogDistance
+    fleet = loader.fleet()
+    shipper.batch_size = fleet.batch_size
+    total = 0
+    for site in loader.tanks():
+        reader = readers.get(site.log_file)
+        if reader is None:
+            # Read-only: leave the rollup and flow state to the sampler.
+            reader = LogDistance.from_config(site.config, site.log_file, rollups=None, flow=None)
+            readers[site.log_file] = reader
+        sent, _ = shipper.ship(device_id_for(fleet, site), reader)
+        total += sent
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ship new readings to the fleet collector.')
+    parser.add_argument('--config', type=str, help='Path to config.json', required=False)
+    parser.add_argument('--daemon', help='Keep shipping instead of exiting after one pass', action='store_true')
+    parser.add_argument('--interval', type=float, help='Seconds between passes. Defaults to fleet.interval',
+                        default=None)
+    args = parser.parse_args()
+    logging.getLogger().setLevel('INFO')
+
+    loader = ConfigLoader(config_path=args.config or ConfigLoader.default_config_path())
+    shipper = shipper_from_config(loader)
+    readers = {}
+    if not args.daemon:
+        logging.info("Shipped %d lines", ship_all(shipper, loader, readers))
+        return
+
+    from sampling import stop_event_on_signals
+    stop_event = stop_event_on_signals()
+    while not stop_event.is_set():
+        sent = ship_all(shipper, loader, readers)
+        if sent:
+            logging.info("Shipped %d lines", sent)
+        stop_event.wait(args.interval or loader.fleet().interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+'''
+Streaming flow-rate and leak detection.
+
+Every appended reading updates a small persisted state in O(1): an EWMA of the
+fill/drain rate in gallons per minute, the net rate over a short sliding
+window, a time-to-empty estimate, and a leak flag raised when the tank keeps
+draining through the night when nobody should be using water. Commands and the
+hourly post read the state instead of scanning history.
+'''
+import datetime
+import json
+import logging
+import math
+import os
+
+from config_loader import file_signature
+from watertank import WaterTank
+
+DEFAULT_EWMA_MINUTES = 15.0
+DEFAULT_WINDOW_MINUTES = 30.0
+DEFAULT_LEAK_GPM = 0.2
+DEFAULT_LEAK_MINUTES = 120.0
+DEFAULT_NIGHT_START_HOUR = 0
+DEFAULT_NIGHT_END_HOUR = 5
+
+# Gaps longer than this restart the rate estimate instead of averaging across them.
+MAX_GAP_MINUTES = 60.0
+
+
+class FlowRateTracker:
+    def __init__(self, state_path, tank_config, flow_config=None):
+        flow_config = flow_config or {}
+        self.state_path = state_path
+        self.tank = WaterTank.from_config(tank_config)
+        self.ewma_minutes = float(flow_config.get('ewma_minutes', DEFAULT_EWMA_MINUTES))
+        self.window_minutes = float(flow_config.get('window_minutes', DEFAULT_WINDOW_MINUTES))
+        self.leak_gpm = float(flow_config.get('leak_gpm', DEFAULT_LEAK_GPM))
+        self.leak_minutes = float(flow_config.get('leak_minutes', DEFAULT_LEAK_MINUTES))
+        self.night_start_hour = int(flow_config.get('night_start_hour', DEFAULT_NIGHT_START_HOUR))
+        self.night_end_hour = int(flow_config.get('night_end_hour', DEFAULT_NIGHT_END_HOUR))
+        self._state = None
+        self._signature = None
+
+    @property
+    def state(self):
+        # The sampler rewrites the file on every reading; other processes reread it when it changes.
+        signature = file_signature(self.state_path)
+        if self._state is None or signature != self._signature:
+            self._state = self._load()
+            self._signature = signature
+        return self._state
+
+    def _load(self):
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r') as f:
+                    return json.load(f)
+            except Exception as exc:
+                logging.error("Error loading flow state %s: %s", self.state_path, exc)
+        return {}
+
+    def _save(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f)
+        os.rename(tmp_path, self.state_path)
+        self._signature = file_signature(self.state_path)
+
+    def _is_night(self, timestamp):
+        if self.night_start_hour <= self.night_end_hour:
+            return self.night_start_hour <= timestamp.hour < self.night_end_hour
+        return timestamp.hour >= self.night_start_hour or timestamp.hour < self.night_end_hour
+
+    def add(self, timestamp, distance_in_inches):
+        state = self.state
+        height = self.tank.height_at_distance(distance_in_inches)
+        gallons = self.tank.gallons_at_height(height)
+        ts = timestamp.timestamp()
+
+        last_ts = state.get('last_ts')
+        minutes = (ts - last_ts) / 60.0 if last_ts is not None else None
+        if minutes is None or minutes <= 0 or minutes > MAX_GAP_MINUTES:
+            state['ewma_gpm'] = None
+            state['window'] = []
+            state['night_drain_since'] = None
+        else:
+            rate = self.tank.rate_change(state['last_height'], height, minutes)
+            ewma = state.get('ewma_gpm')
+            if ewma is None:
+                state['ewma_gpm'] = rate
+            else:
+                # Time-aware smoothing so irregular sample spacing weighs correctly.
+                alpha = 1.0 - math.exp(-minutes / self.ewma_minutes)
+                state['ewma_gpm'] = ewma + alpha * (rate - ewma)
+
+        window = state.get('window') or []
+        window.append([ts, gallons])
+        cutoff = ts - self.window_minutes * 60.0
+        while len(window) > 2 and window[1][0] <= cutoff:
+            window.pop(0)
+        state['window'] = window
+
+        window_rate = self.window_rate()
+        if not self._is_night(timestamp):
+            # Each night's drain is judged on its own; daytime use must not carry over.
+            state['night_drain_since'] = None
+            state['leak'] = False
+        elif window_rate is not None and window_rate <= -self.leak_gpm:
+            if state.get('night_drain_since') is None:
+                state['night_drain_since'] = ts
+            if (ts - state['night_drain_since']) / 60.0 >= self.leak_minutes:
+                if not state.get('leak'):
+                    logging.warning("Probable leak: draining %.2f gal/min overnight", -window_rate)
+                state['leak'] = True
+        elif window_rate is not None:
+            state['night_drain_since'] = None
+            state['leak'] = False
+
+        state['last_ts'] = ts
+        state['last_height'] = height
+        state['last_gallons'] = gallons
+        self._save()
+
+    def window_rate(self):
+        '''Net gallons per minute across the sliding window, or None if too few samples'''
+        window = self.state.get('window') or []
+        if len(window) < 2 or window[-1][0] <= window[0][0]:
+            return None
+        return (window[-1][1] - window[0][1]) / ((window[-1][0] - window[0][0]) / 60.0)
+
+    def minutes_to_empty(self):
+        '''Minutes until empty at the smoothed drain rate, or None when not draining'''
+        ewma = self.state.get('ewma_gpm')
+        gallons = self.state.get('last_gallons')
+        if ewma is None or gallons is None or ewma >= 0:
+            return None
+        return gallons / -ewma
+
+    def summary(self):
+        '''One-paragraph human readable rate report'''
+        ewma = self.state.get('ewma_gpm')
+        if ewma is None:
+            return "Rate: not enough recent readings"
+        window_rate = self.window_rate()
+        lines = ["Rate: {:+.2f} gal/min (last {:.0f} min: {})".format(
+            ewma, self.window_minutes, "n/a" if window_rate is None else "{:+.2f}".format(window_rate))]
+        minutes = self.minutes_to_empty()
+        if minutes is not None:
+            empty_at = datetime.datetime.fromtimestamp(self.state['last_ts'] + minutes * 60.0)
+            lines.append("    Empty in ~{:.1f} h ({:%a %H:%M})".format(minutes / 60.0, empty_at))
+        if self.state.get('leak'):
+            lines.append("    WARNING: sustained overnight drain, probable leak")
+        return "\n".join(lines)
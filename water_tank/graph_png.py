@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+'''
+Pure-Python PNG line chart of gallons over time, for posting as an image.
+
+The points are streamed through graph_utils.lttb_downsample to one per pixel
+column, so rendering a month of readings costs one pass over the log and
+O(width) memory. Only zlib and struct are needed; no imaging library.
+
+    python3 graph_png.py --hours 168 --out /tmp/tank_week.png
+'''
+import argparse
+import datetime
+import logging
+import os
+import struct
+import zlib
+
+from config_loader import ConfigLoader
+from graph_utils import lttb_downsample
+
+BACKGROUND = (255, 255, 255)
+GRID = (225, 225, 225)
+FILL = (200, 222, 245)
+LINE = (31, 97, 171)
+
+DEFAULT_WIDTH = 480
+DEFAULT_HEIGHT = 160
+MARGIN = 4
+GRID_LINES = 4
+
+
+def _chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def encode_png(pixels, width, height):
+    '''PNG bytes for an RGB bytearray of width*height*3'''
+    stride = width * 3
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)  # filter type: none
+        raw.extend(pixels[y * stride:(y + 1) * stride])
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _chunk(b'IHDR', header) + _chunk(b'IDAT', zlib.compress(bytes(raw), 9))
+            + _chunk(b'IEND', b''))
+
+
+def render_png(points, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, low=None, high=None):
+    '''PNG bytes charting an iterable of (timestamp, value), or None if it is empty.
+
+    low/high fix the value axis (e.g. 0 and tank capacity); by default it
+    spans the data.
+    '''
+    sampled = lttb_downsample(points, width - 2 * MARGIN)
+    if not sampled:
+        return None
+    t0, t1 = sampled[0][0], sampled[-1][0]
+    v0 = min(v for _, v in sampled) if low is None else low
+    v1 = max(v for _, v in sampled) if high is None else high
+    if v1 <= v0:
+        v0, v1 = v0 - 1.0, v1 + 1.0
+    plot_w = width - 2 * MARGIN - 1
+    plot_h = height - 2 * MARGIN - 1
+
+    pixels = bytearray(BACKGROUND * (width * height))
+
+    def put(x, y, color):
+        if 0 <= x < width and 0 <= y < height:
+            i = (y * width + x) * 3
+            pixels[i:i + 3] = bytes(color)
+
+    for g in range(GRID_LINES + 1):
+        y = MARGIN + int(round(plot_h * g / float(GRID_LINES)))
+        for x in range(MARGIN, width - MARGIN):
+            put(x, y, GRID)
+
+    def to_xy(t, v):
+        x = MARGIN + (int(round((t - t0) / float(t1 - t0) * plot_w)) if t1 > t0 else 0)
+        v = min(max(v, v0), v1)
+        return x, MARGIN + int(round((v1 - v) / (v1 - v0) * plot_h))
+
+    coords = [to_xy(t, v) for t, v in sampled]
+    bottom = MARGIN + plot_h
+    # Bresenham between consecutive points, shading down to the axis as we go.
+    line = []
+    for (x0, y0), (x1, y1) in zip(coords, coords[1:] or coords):
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        err = dx + dy
+        while True:
+            line.append((x0, y0))
+            if x0 == x1 and y0 == y1:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+    for x, y in line:
+        for fill_y in range(y + 1, bottom + 1):
+            put(x, fill_y, FILL)
+    for x, y in line:
+        put(x, y, LINE)
+        put(x, y + 1, LINE)
+    return encode_png(pixels, width, height)
+
+
+def write_png(path, png):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(png)
+    os.rename(tmp_path, path)
+
+
+def gallon_points(lines, tank):
+    '''(unix seconds, gallons) for each parseable log line'''
+    from tank_message import parse_distance_in_inches, parse_timestamp
+    for line in lines:
+        try:
+            stamp = parse_timestamp(line)
+            distance = parse_distance_in_inches(line)
+        except ValueError:
+            continue
+        yield stamp.timestamp(), tank.gallons_at_height(tank.height_at_distance(distance))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a PNG chart of gallons over a recent window.')
+    parser.add_argument('--config', type=str, help='Path to config.json', required=False)
+    parser.add_argument('--hours', type=float, help='Window to chart, ending now', default=24.0)
+    parser.add_argument('--out', type=str, help='PNG file to write', required=True)
+    parser.add_argument('--width', type=int, help='Image width in pixels', default=DEFAULT_WIDTH)
+    parser.add_argument('--height', type=int, help='Image height in pixels', default=DEFAULT_HEIGHT)
+    args = parser.parse_args()
+    logging.getLogger().setLevel('INFO')
+
+    from log_distance import LogDistance
+
+    loader = ConfigLoader(config_path=args.config or ConfigLoader.default_config_path())
+    tank = loader.tank().water_tank()
+    reader = LogDistance.from_config(loader.load_config())
+    start = datetime.datetime.now() - datetime.timedelta(hours=args.hours)
+    png = render_png(gallon_points(reader.read_range(start), tank), args.width, args.height,
+                     low=0.0, high=tank.volume_in_gallons)
+    if png is None:
+        raise SystemExit("No readings in the last {:g} hours".format(args.hours))
+    write_png(args.out, png)
+    logging.info("Wrote %s (%d bytes)", args.out, len(png))
+
+
+if __name__ == "__main__":
+    main()
@@ -20,3 +20,160 @@ def sparkline(values):
             idx = len(SPARK_CHARS) - 1
         pieces.append(SPARK_CHARS[idx])
     return "".join(pieces)
+
+
+DEFAULT_WIDTH = 40
+
+
+class _Bucket:
+    __slots__ = ('count', 'sum_t', 'sum_v', 'min_t', 'min_v', 'max_t', 'max_v')
+
+    def __init__(self, t, v):
+        self.count = 1
+        self.sum_t = t
+        self.sum_v = v
+        self.min_t = self.max_t = t
+        self.min_v = self.max_v = v
+
+    def add(self, t, v):
+        self.count += 1
+        self.sum_t += t
+        self.sum_v += v
+        if v < self.min_v:
+            self.min_t, self.min_v = t, v
+        if v > self.max_v:
+            self.max_t, self.max_v = t, v
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum_t += other.sum_t
+        self.sum_v += other.sum_v
+        if other.min_v < self.min_v:
+            self.min_t, self.min_v = other.min_t, other.min_v
+        if other.max_v > self.max_v:
+            self.max_t, self.max_v = other.max_t, other.max_v
+
+    def extremes(self):
+        '''The bucket's min and max points in time order (one point if they coincide)'''
+        low = (self.min_t, self.min_v)
+        high = (self.max_t, self.max_v)
+        if low == high:
+            return [low]
+        return [low, high] if low[0] <= high[0] else [high, low]
+
+
+def stream_buckets(points, max_buckets):
+    '''Summarise an iterable of (t, v) in one pass into at most max_buckets equal-count buckets.
+
+    Memory is O(max_buckets): whenever the buckets fill up, neighbours are
+    merged pairwise and each bucket covers twice as many points from then on.
+    Returns (buckets, first_point, last_point).
+    '''
+    max_buckets = max(2, max_buckets - max_buckets % 2)
+    buckets = []
+    span = 1
+    first = last = None
+    for t, v in points:
+        if first is None:
+            first = (t, v)
+        last = (t, v)
+        if buckets and buckets[-1].count < span:
+            buckets[-1].add(t, v)
+            continue
+        if len(buckets) == max_buckets:
+            merged = []
+            for i in range(0, len(buckets), 2):
+                buckets[i].merge(buckets[i + 1])
+                merged.append(buckets[i])
+            buckets = merged
+            span *= 2
+            if buckets[-1].count < span:
+                buckets[-1].add(t, v)
+                continue
+        buckets.append(_Bucket(t, v))
+    return buckets, first, last
+
+
+def minmax_downsample(points, width=DEFAULT_WIDTH):
+    '''At most width (t, v) points: the min and max of width/2 buckets, so peaks and troughs survive'''
+    if width < 1:
+        raise ValueError("Downsample width must be at least 1, got %r" % width)
+    buckets, _, last = stream_buckets(points, width // 2)
+    if width == 1:
+        return [last] if last is not None else []
+    if width < 4 and buckets:
+        # stream_buckets keeps at least two buckets; fold them into one.
+        for bucket in buckets[1:]:
+            buckets[0].merge(bucket)
+        buckets = buckets[:1]
+    result = []
+    for bucket in buckets:
+        result.extend(bucket.extremes())
+    return result
+
+
+def _lttb(points, width):
+    n = len(points)
+    if width >= n:
+        return list(points)
+    if width < 3:
+        # No middle buckets; keep the ends, the newest point alone at width 1.
+        return [points[0], points[-1]] if width == 2 else [points[-1]]
+    sampled = [points[0]]
+    every = float(n - 2) / (width - 2)
+    a = 0
+    for i in range(width - 2):
+        # Average of the next bucket is the third corner of the triangle.
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        next_points = points[next_start:next_end] or [points[-1]]
+        avg_t = sum(p[0] for p in next_points) / len(next_points)
+        avg_v = sum(p[1] for p in next_points) / len(next_points)
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        at, av = points[a]
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            t, v = points[j]
+            area = abs((at - avg_t) * (v - av) - (at - t) * (avg_v - av))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def lttb_downsample(points, width=DEFAULT_WIDTH):
+    '''At most width (t, v) points chosen by Largest-Triangle-Three-Buckets.
+
+    Single pass with O(width) memory: the stream is first reduced to the
+    min/max points of 4*width buckets, then LTTB picks width of those.
+    '''
+    if width < 1:
+        raise ValueError("Downsample width must be at least 1, got %r" % width)
+    buckets, first, last = stream_buckets(points, 4 * width)
+    if first is None:
+        return []
+    candidates = [first]
+    for bucket in buckets:
+        for point in bucket.extremes():
+            if candidates[-1][0] < point[0] < last[0]:
+                candidates.append(point)
+    if last != first:
+        candidates.append(last)
+    return _lttb(candidates, width)
+
+
+DOWNSAMPLERS = {
+    'lttb': lttb_downsample,
+    'minmax': minmax_downsample,
+}
+
+
+def fixed_width_sparkline(points, width=DEFAULT_WIDTH, method='lttb'):
+    '''Sparkline no wider than width characters from an iterable of (timestamp, value)'''
+    return sparkline([v for _, v in DOWNSAMPLERS[method](points, width)])
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+'''
+Import-time report and cold-start budget check for the entry points.
+
+Each entry point is imported in a fresh interpreter with `-X importtime` and
+the per-module timings are summarised. With --check the exit status is
+non-zero if an entry point goes over its budget or imports a module that
+should only be loaded on first use (requests, numpy, RPi.GPIO, sqlite3), so
+a stray top-level import is caught before it costs a second per cron run on
+a Pi Zero.
+
+    python3 import_profile.py
+    python3 import_profile.py --check --budget-ms 400
+'''
+import argparse
+import os
+import subprocess
+import sys
+
+ENTRY_POINTS = ('check_slack_commands', 'send_to_slack', 'log_distance', 'sampling', 'fleet_shipper')
+
+# Loaded lazily by every entry point; importing one at module level is a regression.
+DEFERRED_MODULES = ('requests', 'numpy', 'RPi', 'sqlite3')
+
+# Milliseconds on a Pi Zero; a desktop is roughly ten times faster.
+DEFAULT_BUDGET_MS = 500.0
+
+
+def profile_import(module, script_dir=None):
+    """Import module in a fresh interpreter; return [(self_us, cumulative_us, depth, name)]."""
+    script_dir = script_dir or os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (script_dir, env.get('PYTHONPATH')) if p)
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=script_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    _, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError("import %s failed:\n%s" % (module, stderr))
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the header line
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        rows.append((int(fields[0]), int(fields[1]), depth, stripped))
+    return rows
+
+
+def cumulative_ms(rows, module):
+    for self_us, cumulative_us, depth, name in rows:
+        if name == module and depth == 0:
+            return cumulative_us / 1000.0
+    return None
+
+
+def deferred_imports(rows):
+    loaded = set(name.split('.')[0] for _, _, _, name in rows)
+    return [name for name in DEFERRED_MODULES if name in loaded]
+
+
+def report(module, rows, top):
+    total = cumulative_ms(rows, module)
+    print("%s: %.1f ms cumulative, %d modules" % (module, total or 0.0, len(rows)))
+    for self_us, cumulative_us, depth, name in sorted(rows, reverse=True)[:top]:
+        print("    %8.1f ms self %8.1f ms cumulative  %s" % (self_us / 1000.0, cumulative_us / 1000.0, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report entry-point import times and enforce a cold-start budget.')
+    parser.add_argument('modules', nargs='*', help='Modules to profile. Defaults to the entry points')
+    parser.add_argument('--top', type=int, help='Slowest modules to list per entry point', default=10)
+    parser.add_argument('--repeat', type=int, help='Imports per module; the fastest is kept', default=3)
+    parser.add_argument('--check', help='Exit non-zero on a budget overrun or an eager heavy import',
+                        action='store_true')
+    parser.add_argument('--budget-ms', type=float, help='Cold-start budget per entry point', default=DEFAULT_BUDGET_MS)
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules or ENTRY_POINTS:
+        runs = [profile_import(module) for _ in range(max(1, args.repeat))]
+        # The fastest run is the least disturbed by other load on the machine.
+        rows = min(runs, key=lambda r: cumulative_ms(r, module) or 0.0)
+        report(module, rows, args.top)
+        total = cumulative_ms(rows, module) or 0.0
+        if total > args.budget_ms:
+            failures.append("%s took %.1f ms (budget %.1f ms)" % (module, total, args.budget_ms))
+        eager = deferred_imports(rows)
+        if eager:
+            failures.append("%s imports %s at startup" % (module, ", ".join(eager)))
+
+    for failure in failures:
+        print("FAIL: " + failure)
+    if args.check and failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,254 @@
 #!/usr/bin/env python3
-import argparse
+import bisect
 import datetime
+import itertools
 import logging
 import os
 
-from config_loader import ConfigLoader
-from distance_sensor import DistanceSensor
+import metrics
+from tank_message import parse_distance_in_inches, parse_timestamp
+
+
+INDEX_SUFFIX = '.idx'
+DEFAULT_INDEX_INTERVAL = 64 * 1024
+
+LOG_BYTES = metrics.gauge('water_tank_log_bytes', 'Size of the active log file after the last append', ('log',))
+LOG_APPENDED_BYTES = metrics.counter('water_tank_log_appended_bytes_total', 'Bytes appended to the log', ('log',))
+
+
+def format_entry(timestamp, distance_in_inches):
+    return "%s: %5.2f in" % (timestamp, distance_in_inches)
 
 
 class LogDistance:
-    def __init__(self, path, append=True):
+    def __init__(self, path, append=True, keep_open=False, index_interval=None, ring_buffer=None, database=None,
+                 rollups=None, flow=None, alerts=None):
         self.path = path
         self.append = append
+        self.keep_open = keep_open
+        # Optional ReadingRingBuffer mirroring recent readings in binary form.
+        self.ring_buffer = ring_buffer
+        # Optional ReadingDatabase; when set, range and aggregate queries use SQL.
+        self.database = database
+        # Optional GallonRollups updated with every appended reading.
+        self.rollups = rollups
+        # Optional FlowRateTracker updated with every appended reading.
+        self.flow = flow
+        # Optional AlertEngine evaluated after every appended reading.
+        self.alerts = alerts
+        # Bytes of log between sparse index entries; None disables the index.
+        self.index_interval = index_interval
+        self.index_path = path + INDEX_SUFFIX
+        self._handle = None
+        self._last_indexed_offset = None
+        self._log_metrics = None
+
+    @classmethod
+    def from_config(cls, config, path=None, **kwargs):
+        """Build the log store described by config's paths/log sections."""
+        log_config = config.get('log') or {}
+        path = path or (config.get('paths') or {}).get('log_file') or 'out.txt'
+        kwargs.setdefault('index_interval', int(log_config.get('index_interval_bytes', DEFAULT_INDEX_INTERVAL)))
+        ring_path = log_config.get('ring_buffer_file')
+        if ring_path and 'ring_buffer' not in kwargs:
+            from ring_buffer import DEFAULT_CAPACITY, ReadingRingBuffer
+            kwargs['ring_buffer'] = ReadingRingBuffer(
+                ring_path, capacity=int(log_config.get('ring_buffer_capacity', DEFAULT_CAPACITY)))
+        db_path = log_config.get('sqlite_file')
+        if db_path and 'database' not in kwargs:
+            from reading_db import DEFAULT_BATCH_SIZE, ReadingDatabase
+            kwargs['database'] = ReadingDatabase(
+                db_path, batch_size=int(log_config.get('sqlite_batch_size', DEFAULT_BATCH_SIZE)))
+        rollup_path = log_config.get('rollup_file')
+        if rollup_path and 'rollups' not in kwargs:
+            from rollups import GallonRollups
+            kwargs['rollups'] = GallonRollups(rollup_path, config.get('tank') or {})
+        flow_config = config.get('flow') or {}
+        if flow_config.get('state_file') and 'flow' not in kwargs:
+            from flow_rate import FlowRateTracker
+            kwargs['flow'] = FlowRateTracker(flow_config['state_file'], config.get('tank') or {}, flow_config)
+        max_bytes = log_config.get('segment_max_bytes')
+        max_age_hours = log_config.get('segment_max_age_hours')
+        if max_bytes or max_age_hours:
+            # Imported here: log_segments subclasses LogDistance.
+            from log_segments import SegmentedLogDistance
+            return SegmentedLogDistance(
+                path,
+                max_bytes=int(max_bytes) if max_bytes else None,
+                max_age=datetime.timedelta(hours=float(max_age_hours)) if max_age_hours else None,
+                compression=log_config.get('segment_compression', 'gzip'),
+                **kwargs)
+        return cls(path, **kwargs)
 
-    def append_reading(self, distance_in_inches, timestamp=None):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        if self.ring_buffer is not None:
+            self.ring_buffer.close()
+        if self.database is not None:
+            try:
+                self.database.close()
+            except Exception as exc:
+                logging.error("Error closing history database %s: %s", self.database.path, exc)
+
+    def _open_for_write(self):
+        if self._handle is not None:
+            return self._handle
+        # Only the first open honours append=False when keep_open is set;
+        # later writes go to the same handle so the daemon never truncates.
+        mode = "a" if self.append else "w+"
+        handle = open(self.path, mode)
+        if not self.append and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+            self._last_indexed_offset = None
+        if self.keep_open:
+            self._handle = handle
+        return handle
+
+    def append_reading(self, distance_in_inches, timestamp=None, quality=None):
         if timestamp is None:
             timestamp = datetime.datetime.now()
-        entry = ("%s: %5.2f in" % (timestamp, distance_in_inches))
-        mode = "a" if self.append else "w+"
-        f = open(self.path, mode)
+        entry = format_entry(timestamp, distance_in_inches)
+        if quality is not None:
+            entry = "%s (sd %.2f, rejected %d/%d)" % (entry, quality.stddev, quality.rejected, quality.samples)
+        f = self._open_for_write()
+        offset = os.fstat(f.fileno()).st_size
         f.write(entry)
         f.write("\n")
-        f.close()
+        if self.keep_open:
+            f.flush()
+        else:
+            f.close()
+        if self._log_metrics is None:
+            name = os.path.basename(self.path)
+            self._log_metrics = (LOG_BYTES.labels(name), LOG_APPENDED_BYTES.labels(name))
+        self._log_metrics[0].set(offset + len(entry) + 1)
+        self._log_metrics[1].inc(len(entry) + 1)
+        if self.index_interval:
+            self._maybe_index(timestamp, offset)
+        if self.ring_buffer is not None:
+            try:
+                self.ring_buffer.append(timestamp, distance_in_inches)
+            except Exception as exc:
+                logging.error("Error writing ring buffer %s: %s", self.ring_buffer.path, exc)
+        if self.database is not None:
+            try:
+                self.database.add(entry, distance_in_inches)
+            except Exception as exc:
+                logging.error("Error writing history database %s: %s", self.database.path, exc)
+        if self.rollups is not None:
+            try:
+                self.rollups.add(timestamp, distance_in_inches)
+            except Exception as exc:
+                logging.error("Error updating rollups %s: %s", self.rollups.base_path, exc)
+        if self.flow is not None:
+            try:
+                self.flow.add(timestamp, distance_in_inches)
+            except Exception as exc:
+                logging.error("Error updating flow rate %s: %s", self.flow.state_path, exc)
+        if self.alerts is not None:
+            try:
+                self.alerts.on_reading(timestamp, distance_in_inches, flow=self.flow)
+            except Exception as exc:
+                logging.error("Error evaluating alerts: %s", exc)
         return entry
 
+    def _maybe_index(self, timestamp, offset):
+        if self._last_indexed_offset is None:
+            index = self.load_index()
+            self._last_indexed_offset = index[-1][1] if index else -self.index_interval
+        if offset - self._last_indexed_offset < self.index_interval:
+            return
+        try:
+            with open(self.index_path, 'a') as f:
+                f.write("%s\t%d\n" % (timestamp, offset))
+            self._last_indexed_offset = offset
+        except Exception as exc:
+            logging.error("Error updating log index %s: %s", self.index_path, exc)
+
+    def load_index(self):
+        """Return the sparse index as a list of (timestamp, byte offset) pairs."""
+        index = []
+        if not os.path.exists(self.index_path):
+            return index
+        try:
+            with open(self.index_path, 'r') as f:
+                for line in f:
+                    ts, _, offset = line.strip().partition("\t")
+                    try:
+                        index.append((parse_timestamp(ts), int(offset)))
+                    except ValueError:
+                        continue
+        except Exception as exc:
+            logging.error("Error reading log index %s: %s", self.index_path, exc)
+            return []
+        return index
+
+    def rebuild_index(self, index_interval=None):
+        """Regenerate the sparse index with one full pass over the log."""
+        interval = index_interval or self.index_interval or DEFAULT_INDEX_INTERVAL
+        tmp_path = self.index_path + ".tmp"
+        last_offset = -interval
+        with open(self.path, 'rb') as log, open(tmp_path, 'w') as out:
+            offset = 0
+            for raw in log:
+                if offset - last_offset >= interval:
+                    try:
+                        ts = parse_timestamp(raw.decode('utf-8', 'replace'))
+                    except ValueError:
+                        ts = None
+                    if ts is not None:
+                        out.write("%s\t%d\n" % (ts, offset))
+                        last_offset = offset
+                offset += len(raw)
+        os.rename(tmp_path, self.index_path)
+        self._last_indexed_offset = None
+
+    def iter_lines_reverse(self, chunk_size=8192):
+        """Yield decoded, stripped log lines from newest to oldest.
+
+        The file is read backwards in fixed chunk_size blocks, each exactly once;
+        a line split across a block boundary is carried into the next block.
+        Blank lines are skipped. Memory use is bounded by chunk_size plus the
+        longest line, however far the caller iterates.
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            remainder = b""
+            while position > 0:
+                read_size = min(chunk_size, position)
+                position -= read_size
+                f.seek(position)
+                pieces = (f.read(read_size) + remainder).split(b"\n")
+                # pieces[0] may be the tail end of a line that starts in an
+                # earlier block; hold it back until that block is read.
+                remainder = pieces[0]
+                for piece in reversed(pieces[1:]):
+                    line = piece.strip()
+                    if line:
+                        yield line.decode('utf-8', 'replace')
+            line = remainder.strip()
+            if line:
+                yield line.decode('utf-8', 'replace')
+
+    def _has_log(self):
+        return os.path.exists(self.path)
+
     def read_last_line(self):
-        if not os.path.exists(self.path):
+        if not self._has_log():
             return None
         try:
-            f = open(self.path, 'rb')
-            f.seek(0, os.SEEK_END)
-            size = f.tell()
-            if size == 0:
-                f.close()
-                return ""
-            read_size = 4096 if size > 4096 else size
-            f.seek(-read_size, os.SEEK_END)
-            chunk = f.read(read_size)
-            f.close()
-            lines = chunk.splitlines()
-            if not lines:
-                return ""
-            return lines[-1].decode('utf-8', 'replace').strip()
+            for line in self.iter_lines_reverse(chunk_size=4096):
+                return line
+            return ""
         except Exception as exc:
             logging.error("Error reading last log line: %s", exc)
             return None
@@ -49,67 +256,157 @@ class LogDistance:
     def read_last_lines(self, count):
         if count <= 0:
             return []
-        if not os.path.exists(self.path):
+        if not self._has_log():
             return []
         try:
-            f = open(self.path, 'rb')
-            f.seek(0, os.SEEK_END)
-            file_size = f.tell()
-            if file_size == 0:
-                f.close()
-                return []
-
-            buffer_size = 8192
-            data = b""
-            offset = 0
-            while len(data.splitlines()) <= count and file_size > offset:
-                offset = min(file_size, offset + buffer_size)
-                f.seek(-offset, os.SEEK_END)
-                data = f.read(offset)
-                if offset == file_size:
-                    break
-
-            f.close()
-            lines = data.splitlines()
-            tail = lines[-count:] if len(lines) >= count else lines
-            return [line.decode('utf-8', 'replace').strip() for line in tail]
+            lines = list(itertools.islice(self.iter_lines_reverse(), count))
+            lines.reverse()
+            return lines
         except Exception as exc:
             logging.error("Error reading last log lines: %s", exc)
             return []
 
+    def read_last_readings(self, count):
+        """Return up to count newest readings as (datetime, distance) pairs, oldest first.
 
-def main():
-    parser = argparse.ArgumentParser(description='Logs the distance in inches from the distance sensor to input file.')
-    parser.add_argument('--output', help='Path to file to write to. Defaults to config.json log_file', default=None)
-    parser.add_argument('--config', help='Path to config.json', default=None)
-    parser.add_argument('--append', type=bool, help='True = append to file, False = overwrite file, Defaults to True', default=True)
-    parser.add_argument('--verbose', type=bool, help='verbose output will also go to log file', default=False)
-    args = parser.parse_args()
+        Served from the ring buffer or history database when either holds
+        enough records, otherwise parsed from the text log.
+        """
+        if count <= 0:
+            return []
+        if self.ring_buffer is not None:
+            try:
+                if len(self.ring_buffer) >= count:
+                    return self.ring_buffer.last(count)
+            except Exception as exc:
+                logging.error("Error reading ring buffer %s: %s", self.ring_buffer.path, exc)
+        if self.database is not None:
+            try:
+                readings = []
+                for line in self.database.last_lines(count):
+                    readings.append((parse_timestamp(line), parse_distance_in_inches(line)))
+                if len(readings) >= count:
+                    return (readings + self._readings_after(readings[-1][0], count))[-count:]
+            except Exception as exc:
+                logging.error("Error reading history database %s: %s", self.database.path, exc)
+        readings = []
+        try:
+            for line in self.iter_lines_reverse():
+                try:
+                    readings.append((parse_timestamp(line), parse_distance_in_inches(line)))
+                except ValueError:
+                    continue
+                if len(readings) >= count:
+                    break
+        except Exception as exc:
+            logging.error("Error reading last log readings: %s", exc)
+        readings.reverse()
+        return readings
+
+    def _timestamp_at(self, f, offset):
+        """Timestamp of the first parseable line starting at offset, or None at EOF."""
+        f.seek(offset)
+        for raw in iter(f.readline, b""):
+            try:
+                return parse_timestamp(raw.decode('utf-8', 'replace'))
+            except ValueError:
+                continue
+        return None
 
-    config_path = args.config or ConfigLoader.default_config_path()
-    loader = ConfigLoader(config_path=config_path)
-    config = loader.load_config()
+    @staticmethod
+    def _line_start(f, offset):
+        """Offset of the first line that starts at or after offset."""
+        if offset == 0:
+            return 0
+        f.seek(offset - 1)
+        f.readline()
+        return f.tell()
 
-    paths_config = config.get('paths') or {}
-    sensor_config = config.get('sensor') or {}
+    def _find_offset(self, f, start, lo, hi):
+        """Binary search [lo, hi) for the first line with timestamp >= start."""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            ts = self._timestamp_at(f, self._line_start(f, mid))
+            if ts is None or ts >= start:
+                hi = mid
+            else:
+                lo = mid + 1
+        return self._line_start(f, lo)
 
-    output_path = args.output or paths_config.get('log_file') or 'out.txt'
-    pin_trigger = int(sensor_config.get('pin_trigger', 7))
-    pin_echo = int(sensor_config.get('pin_echo', 11))
-    sleep_time = float(sensor_config.get('sleep_time', 5))
+    def read_range(self, start, end=None):
+        """Return an iterator of log lines with start <= timestamp < end, oldest first."""
+        if self.database is not None:
+            return self._read_range_database(start, end)
+        return self._read_range_text(start, end)
 
-    if args.verbose:
-        logging.getLogger().setLevel('DEBUG')
-        logging.debug("Distance Read...")
-        logging.debug("Output: %s" % output_path)
-        logging.debug("Append: %r" % args.append)
-        logging.debug("Verbose: %r" % args.verbose)
+    def _read_range_database(self, start, end=None):
+        last_line = None
+        for line in self.database.iter_range(start, end):
+            last_line = line
+            yield line
+        # Rows another process has not committed yet are already in the text log.
+        if last_line is not None:
+            start = parse_timestamp(last_line) + datetime.timedelta(microseconds=1)
+        for line in self._read_range_text(start, end):
+            yield line
 
-    with DistanceSensor(pin_trigger=pin_trigger, pin_echo=pin_echo, sleep_time=sleep_time) as sensor:
-        distance = sensor.distance_in_inches()
-        logger = LogDistance(output_path, append=args.append)
-        logger.append_reading(distance)
+    def _readings_after(self, timestamp, count):
+        """Up to count newest text-log readings later than timestamp, oldest first."""
+        readings = []
+        for line in self.iter_lines_reverse():
+            try:
+                stamp = parse_timestamp(line)
+                if stamp <= timestamp:
+                    break
+                readings.append((stamp, parse_distance_in_inches(line)))
+            except ValueError:
+                continue
+            if len(readings) >= count:
+                break
+        readings.reverse()
+        return readings
+
+    def aggregate(self, start, end=None, bucket='hour'):
+        """Per-bucket (bucket, count, min, max, mean) distances; needs the history database."""
+        if self.database is None:
+            raise ValueError("Aggregate queries need log.sqlite_file to be configured")
+        return self.database.aggregate(start, end, bucket)
+
+    def _read_range_text(self, start, end=None):
+        """Yield log lines with start <= timestamp < end from the text log.
+
+        Relies on the log being append-only and time-ordered: the first line
+        is found by binary search over byte offsets (narrowed by the sparse
+        index when one exists) and reading stops at the first line past end,
+        so only the returned bytes plus O(log n) probes are read.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            lo, hi = 0, f.tell()
+            index = self.load_index()
+            if index:
+                i = bisect.bisect_left([ts for ts, _ in index], start)
+                if i > 0:
+                    lo = index[i - 1][1]
+                if i < len(index):
+                    hi = min(hi, index[i][1])
+            f.seek(self._find_offset(f, start, lo, hi))
+            # str(datetime) sorts lexically in time order, so the stop check
+            # is a string compare rather than a strptime per line.
+            end_key = str(end) if end is not None else None
+            for raw in iter(f.readline, b""):
+                line = raw.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                if end_key is not None and line.partition(': ')[0] >= end_key:
+                    return
+                yield line
 
 
 if __name__ == "__main__":
+    # Imported here: the sampler lives in sampling.py, so it and the modules it
+    # loads share the imported log_distance rather than this __main__ copy.
+    from sampling import main
     main()
@@ -0,0 +1,212 @@
+'''
+Segmented distance log: an active text segment plus rotated, compressed segments.
+
+The active segment lives at the configured log path so single-file readers keep
+working. When it grows past max_bytes or its first reading is older than
+max_age, it is renamed, compressed and recorded in a JSON manifest together with
+the time span it covers. Readers consult the manifest to skip segments that
+cannot match a query.
+'''
+import datetime
+import gzip
+import json
+import logging
+import lzma
+import os
+import shutil
+
+from log_distance import LogDistance
+from tank_message import parse_timestamp
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+COMPRESSORS = {
+    'gzip': ('.gz', gzip.open),
+    'lzma': ('.xz', lzma.open),
+    'none': ('', open),
+}
+
+
+def _open_segment(path, mode='rb'):
+    for suffix, opener in COMPRESSORS.values():
+        if suffix and path.endswith(suffix):
+            return opener(path, mode)
+    return open(path, mode)
+
+
+class SegmentedLogDistance(LogDistance):
+    def __init__(self, path, max_bytes=None, max_age=None, compression='gzip', **kwargs):
+        LogDistance.__init__(self, path, **kwargs)
+        if compression not in COMPRESSORS:
+            raise ValueError("Unknown segment compression: %r" % compression)
+        self.max_bytes = max_bytes
+        # datetime.timedelta or None
+        self.max_age = max_age
+        self.compression = compression
+        self.manifest_path = path + MANIFEST_SUFFIX
+        self._active_start = None
+
+    def load_manifest(self):
+        """Return rotated segments, oldest first, as dicts with file/start/end.
+
+        A segment still marked pending was recorded by a rotation that may not
+        have renamed the active log yet; it only counts once its file exists.
+        """
+        if not os.path.exists(self.manifest_path):
+            return []
+        try:
+            with open(self.manifest_path, 'r') as f:
+                segments = json.load(f).get('segments', [])
+        except Exception as exc:
+            logging.error("Error reading segment manifest %s: %s", self.manifest_path, exc)
+            return []
+        return [segment for segment in segments
+                if not segment.get('pending') or os.path.exists(self._segment_path(segment['file']))]
+
+    def _save_manifest(self, segments):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'segments': segments}, f, indent=1)
+        os.rename(tmp_path, self.manifest_path)
+
+    def _segment_path(self, name):
+        return os.path.join(os.path.dirname(self.path), name)
+
+    def _active_start_time(self):
+        if self._active_start is None and os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for raw in f:
+                    try:
+                        self._active_start = parse_timestamp(raw.decode('utf-8', 'replace'))
+                        break
+                    except ValueError:
+                        continue
+        return self._active_start
+
+    def _needs_rotation(self, timestamp):
+        if not os.path.exists(self.path):
+            return False
+        if self.max_bytes and os.path.getsize(self.path) >= self.max_bytes:
+            return True
+        if self.max_age:
+            start = self._active_start_time()
+            if start is not None and timestamp - start >= self.max_age:
+                return True
+        return False
+
+    def append_reading(self, distance_in_inches, timestamp=None, quality=None):
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        if self._needs_rotation(timestamp):
+            try:
+                self.rotate()
+            except Exception as exc:
+                # Keep logging into the oversized segment rather than lose readings.
+                logging.error("Error rotating log segment %s: %s", self.path, exc)
+        if self._active_start is None:
+            self._active_start = timestamp
+        return LogDistance.append_reading(self, distance_in_inches, timestamp=timestamp, quality=quality)
+
+    def rotate(self):
+        """Close the active segment, compress it and record it in the manifest."""
+        self.close()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return None
+        start = self._active_start_time()
+        end = None
+        for line in LogDistance.iter_lines_reverse(self):
+            try:
+                end = parse_timestamp(line)
+                break
+            except ValueError:
+                continue
+        stamp = (start or datetime.datetime.now()).strftime('%Y%m%dT%H%M%S')
+        base_name = "%s.%s" % (os.path.basename(self.path), stamp)
+        plain_path = self._segment_path(base_name)
+        segment = {
+            'file': base_name,
+            'start': str(start) if start else None,
+            'end': str(end) if end else None,
+            'pending': True,
+        }
+        # Record the segment before moving the active log into it: after a
+        # crash between the two steps, load_manifest either finds the renamed
+        # file or drops the pending entry while the lines are still active.
+        segments = self.load_manifest()
+        segments.append(segment)
+        self._save_manifest(segments)
+        os.rename(self.path, plain_path)
+        self._active_start = None
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        self._last_indexed_offset = None
+        del segment['pending']
+        self._save_manifest(segments)
+
+        suffix, opener = COMPRESSORS[self.compression]
+        if suffix:
+            tmp_path = plain_path + suffix + ".tmp"
+            with open(plain_path, 'rb') as src, opener(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.rename(tmp_path, plain_path + suffix)
+            segment['file'] = base_name + suffix
+            self._save_manifest(segments)
+            os.remove(plain_path)
+        logging.info("Rotated log segment %s", segment['file'])
+        return segment
+
+    def _segments_overlapping(self, start, end):
+        for segment in self.load_manifest():
+            if segment.get('end') and start is not None and parse_timestamp(segment['end']) < start:
+                continue
+            if segment.get('start') and end is not None and parse_timestamp(segment['start']) >= end:
+                continue
+            yield segment
+
+    def _iter_segment_lines(self, segment):
+        path = self._segment_path(segment['file'])
+        if not os.path.exists(path):
+            logging.error("Missing log segment %s", path)
+            return
+        with _open_segment(path) as f:
+            for raw in f:
+                line = raw.decode('utf-8', 'replace').strip()
+                if line:
+                    yield line
+
+    def iter_lines_reverse(self, chunk_size=8192):
+        """Yield lines newest first across the active and rotated segments.
+
+        Compressed segments cannot be read backwards, so each one is
+        decompressed into memory as it is reached; memory is bounded by the
+        largest segment rather than the whole history.
+        """
+        if os.path.exists(self.path):
+            for line in LogDistance.iter_lines_reverse(self, chunk_size):
+                yield line
+        for segment in reversed(self.load_manifest()):
+            lines = list(self._iter_segment_lines(segment))
+            while lines:
+                yield lines.pop()
+
+    def _has_log(self):
+        return os.path.exists(self.path) or bool(self.load_manifest())
+
+    def _read_range_text(self, start, end=None):
+        """Yield lines with start <= timestamp < end across all segments.
+
+        Rotated segments whose manifest time span lies outside the query are
+        never opened; the active segment uses the binary-searched reader.
+        """
+        start_key = str(start)
+        end_key = str(end) if end is not None else None
+        for segment in self._segments_overlapping(start, end):
+            for line in self._iter_segment_lines(segment):
+                stamp = line.partition(': ')[0]
+                if stamp < start_key:
+                    continue
+                if end_key is not None and stamp >= end_key:
+                    break
+                yield line
+        for line in LogDistance._read_range_text(self, start, end):
+            yield line
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+'''
+Counters, gauges and fixed-bucket histograms for the hot paths.
+
+Instrumented modules declare their metrics at import time with counter(),
+gauge() and histogram(); recording a value is a lock and an add (plus a
+bisect for histograms), cheap enough for every echo wait. With
+metrics.textfile_dir configured, each script writes its metrics to
+water_tank_<service>.prom in Prometheus text format for node_exporter's
+textfile collector, atomically via temp-file-and-rename: daemons every
+metrics.write_interval seconds, cron runs once on exit. Counters and
+histograms are restored from that file at startup, so a cron job's counts
+keep accumulating across runs.
+
+Run as a script to print (or with --serve, serve over local HTTP) the merged
+contents of every .prom file in the directory:
+
+    python3 metrics.py --serve --port 9101
+'''
+import argparse
+import bisect
+import contextlib
+import logging
+import os
+import re
+import threading
+import time
+
+# Seconds; spans a fast echo wait up to a Slack call on bad WiFi.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+DEFAULT_HTTP_PORT = 9101
+FILE_PREFIX = 'water_tank_'
+FILE_SUFFIX = '.prom'
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+_LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _unescape(value):
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), value)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self, lock, value=0.0):
+        self._lock = lock
+        self.value = value
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = float(value)
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+
+class _Timer:
+    __slots__ = ('_child', '_started')
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._child.observe(time.perf_counter() - self._started)
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, lock, bounds):
+        self._lock = lock
+        self.bounds = bounds
+        # Per-bucket (not cumulative) counts; the last one is +Inf.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        '''Context manager observing the seconds spent inside it'''
+        return _Timer(self)
+
+
+class Metric:
+    TYPE = None
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        # Re-entrant: a child is seeded with restored values while being created.
+        self._lock = threading.RLock()
+        self._children = {}
+        self._default = None if self.labelnames else self.labels()
+
+    def labels(self, *values):
+        '''Child for one combination of label values; cache it on hot paths'''
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError("%s takes labels %s" % (self.name, ", ".join(self.labelnames)))
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child(tuple(zip(self.labelnames, values)))
+        return child
+
+    def _new_child(self, pairs):
+        raise NotImplementedError
+
+    def _seed(self, child, pairs):
+        '''Add the values restored from the last run to child'''
+
+    def children(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+    def seed_existing(self):
+        for values, child in self.children():
+            self._seed(child, tuple(zip(self.labelnames, values)))
+
+    def samples(self):
+        '''(sample name, label pairs, value) for every child'''
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def _new_child(self, pairs):
+        child = _CounterChild(self._lock)
+        self._seed(child, pairs)
+        return child
+
+    def _seed(self, child, pairs):
+        child.inc(self.registry.restored(self.name, pairs) or 0.0)
+
+    def inc(self, amount=1.0):
+        self._default.inc(amount)
+
+    def samples(self):
+        for values, child in self.children():
+            yield self.name, tuple(zip(self.labelnames, values)), child.value
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def _new_child(self, pairs):
+        # A gauge describes this process; it is not carried over from the last run.
+        return _GaugeChild(self._lock)
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount=1.0):
+        self._default.dec(amount)
+
+    samples = Counter.samples
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(float(b) for b in buckets))
+        Metric.__init__(self, registry, name, help_text, labelnames)
+
+    def _new_child(self, pairs):
+        child = _HistogramChild(self._lock, self.bounds)
+        self._seed(child, pairs)
+        return child
+
+    def _seed(self, child, pairs):
+        previous = 0.0
+        counts = []
+        for bound in self.bounds + (float('inf'),):
+            cumulative = self.registry.restored(self.name + '_bucket', pairs + (('le', _format_value(bound)),))
+            if cumulative is None:
+                # Not in the file, or written with different buckets.
+                return
+            counts.append(cumulative - previous)
+            previous = cumulative
+        if all(count >= 0 for count in counts):
+            with self._lock:
+                child.counts = [a + int(b) for a, b in zip(child.counts, counts)]
+                child.sum += self.registry.restored(self.name + '_sum', pairs) or 0.0
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def samples(self):
+        for values, child in self.children():
+            pairs = tuple(zip(self.labelnames, values))
+            with self._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', pairs + (('le', _format_value(bound)),), cumulative
+            yield self.name + '_sum', pairs, total
+            yield self.name + '_count', pairs, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        # Label added to every sample, naming the script that wrote the file.
+        self.service = None
+        self._restored = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, help_text, labelnames, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(self, name, help_text, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError("Metric %s is already registered differently" % name)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def restored(self, sample_name, pairs):
+        return self._restored.get((sample_name, tuple(sorted(pairs))))
+
+    def restore(self, path):
+        """Add the counters and histograms in a file this registry wrote earlier; call once.
+
+        Children created later (e.g. by a lazily imported module) are seeded
+        as they appear.
+        """
+        restored = {}
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    match = _SAMPLE_RE.match(line.strip())
+                    if match is None:
+                        continue
+                    name, labels, value = match.groups()
+                    pairs = tuple(sorted((k, _unescape(v)) for k, v in _LABEL_RE.findall(labels or '')
+                                         if k != 'service'))
+                    restored[(name, pairs)] = float(value)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            logging.error("Error restoring metrics from %s: %s", path, exc)
+            return
+        self._restored = restored
+        for metric in list(self.metrics.values()):
+            metric.seed_existing()
+
+    def render(self):
+        '''Prometheus text exposition format'''
+        service = (('service', self.service),) if self.service else ()
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.help.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (name, metric.TYPE))
+            for sample_name, pairs, value in metric.samples():
+                lines.append('%s%s %s' % (sample_name, _format_labels(service + pairs), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Atomic write, so the collector never scrapes a half-written file."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.rename(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labelnames=()):
+    return REGISTRY.counter(name, help_text, labelnames)
+
+
+def gauge(name, help_text, labelnames=()):
+    return REGISTRY.gauge(name, help_text, labelnames)
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help_text, labelnames, buckets)
+
+
+class MetricsExporter:
+    def __init__(self, path, interval, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self):
+        try:
+            self.registry.write_textfile(self.path)
+        except Exception as exc:
+            logging.error("Error writing metrics %s: %s", self.path, exc)
+
+    def start(self):
+        """Write every interval seconds from a background thread (for daemons)."""
+        self._thread = threading.Thread(target=self._run, name='metrics')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+
+def textfile_path(directory, service):
+    return os.path.join(directory, FILE_PREFIX + service + FILE_SUFFIX)
+
+
+def exporter_from_config(loader, service):
+    """A MetricsExporter for service if metrics.textfile_dir is configured, else None."""
+    metrics_config = loader.metrics()
+    if not metrics_config.textfile_dir:
+        return None
+    if not os.path.isdir(metrics_config.textfile_dir):
+        os.makedirs(metrics_config.textfile_dir)
+    path = textfile_path(metrics_config.textfile_dir, service)
+    REGISTRY.service = service
+    REGISTRY.restore(path)
+    return MetricsExporter(path, metrics_config.write_interval)
+
+
+@contextlib.contextmanager
+def exporting(loader, service, periodic=False):
+    """Export metrics while the block runs; periodic for daemons, and always once on exit."""
+    try:
+        exporter = exporter_from_config(loader, service)
+    except Exception as exc:
+        logging.error("Metrics disabled: %s", exc)
+        exporter = None
+    if exporter is not None and periodic:
+        exporter.start()
+    try:
+        yield exporter
+    finally:
+        if exporter is not None:
+            exporter.close()
+
+
+def merge_textfiles(directory):
+    """Contents of every .prom file in directory, with each metric's HELP/TYPE given once."""
+    families = {}
+    order = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(FILE_SUFFIX):
+            continue
+        try:
+            with open(os.path.join(directory, name), 'r') as f:
+                text = f.read()
+        except OSError as exc:
+            logging.error("Error reading %s: %s", name, exc)
+            continue
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                family = line.split(' ', 3)[2]
+                if family not in families:
+                    families[family] = ([], [])
+                    order.append(family)
+                headers = families[family][0]
+                if len(headers) < 2 and line not in headers:
+                    headers.append(line)
+            elif line and family is not None:
+                families[family][1].append(line)
+    lines = []
+    for family in order:
+        headers, samples = families[family]
+        lines.extend(headers)
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def serve(directory, host='127.0.0.1', port=DEFAULT_HTTP_PORT):
+    # Imported here: only the --serve mode needs an HTTP server.
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = merge_textfiles(directory).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            logging.debug("metrics: " + fmt, *args)
+
+    httpd = HTTPServer((host, port), Handler)
+    logging.info("Serving %s on http://%s:%d/metrics", directory, host, httpd.server_address[1])
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print or serve the metrics written by the water tank scripts.')
+    parser.add_argument('--config', type=str, help='Path to config.json', required=False)
+    parser.add_argument('--dir', type=str, help='Directory of .prom files. Defaults to metrics.textfile_dir',
+                        default=None)
+    parser.add_argument('--serve', help='Serve /metrics over HTTP instead of printing', action='store_true')
+    parser.add_argument('--host', type=str, help='Address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='Port to listen on', default=DEFAULT_HTTP_PORT)
+    args = parser.parse_args()
+    logging.getLogger().setLevel('INFO')
+
+    directory = args.dir
+    if directory is None:
+        from config_loader import ConfigLoader
+        loader = ConfigLoader(config_path=args.config or ConfigLoader.default_config_path())
+        directory = loader.metrics().textfile_dir
+    if not directory:
+        raise SystemExit("Missing metrics directory. Set metrics.textfile_dir in config.json or pass --dir.")
+    if args.serve:
+        serve(directory, args.host, args.port)
+    else:
+        print(merge_textfiles(directory), end='')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+'''
+Sampling several tanks from one process.
+
+Each entry of the config's `tanks` list has its own sensor pins, geometry
+and log. All sensors share one TriggerGate, so trigger pulses are staggered
+at least sensor.stagger_seconds apart and no sensor hears another's ping,
+while the echo waits run concurrently on a small thread pool. Every tank
+keeps its own schedule (fixed or adaptive); readings are appended from the
+main thread once a round of pings has finished.
+'''
+import datetime
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from distance_sensor import MIN_RETRIGGER_GAP, DistanceSensor, EchoTimeoutError, TriggerGate
+from log_distance import LogDistance
+from sampling import AdaptiveSampler, read_sensor
+
+
+class TankChannel:
+    __slots__ = ('site', 'sensor', 'logger', 'interval', 'burst_count', 'sampler', 'next_at')
+
+    def __init__(self, site, sensor, logger):
+        self.site = site
+        self.sensor = sensor
+        self.logger = logger
+        self.sampler = None
+        self.next_at = time.monotonic()
+        self.configure(site)
+
+    def configure(self, site):
+        '''Apply (possibly reloaded) schedule settings; pins and log path are fixed at start'''
+        self.site = site
+        self.interval = site.sensor.sample_interval
+        self.burst_count = site.sensor.burst_count
+        if not site.sensor.adaptive:
+            self.sampler = None
+        elif self.sampler is None:
+            self.sampler = AdaptiveSampler.from_config(site.sensor)
+        else:
+            self.sampler.configure(site.sensor)
+
+
+class MultiTankSampler:
+    def __init__(self, channels):
+        self.channels = channels
+        self._pool = ThreadPoolExecutor(max_workers=len(channels))
+
+    def close(self):
+        self._pool.shutdown()
+
+    @staticmethod
+    def _read(channel):
+        distance, quality = read_sensor(channel.sensor, channel.burst_count)
+        return distance, quality, datetime.datetime.now()
+
+    def sample(self, channels):
+        """Ping channels concurrently; return [(channel, distance, quality, timestamp)] for the echoes heard."""
+        futures = [(channel, self._pool.submit(self._read, channel)) for channel in channels]
+        results = []
+        for channel, future in futures:
+            try:
+                distance, quality, timestamp = future.result()
+            except EchoTimeoutError as exc:
+                logging.warning("Missed echo on %s: %s", channel.site.name, exc)
+                continue
+            except Exception as exc:
+                logging.error("Failed to read %s: %s", channel.site.name, exc)
+                continue
+            results.append((channel, distance, quality, timestamp))
+        return results
+
+    def record(self, results):
+        now = time.monotonic()
+        for channel, distance, quality, timestamp in results:
+            if channel.sampler is not None and not channel.sampler.observe(now, distance):
+                continue
+            try:
+                channel.logger.append_reading(distance, timestamp=timestamp, quality=quality)
+            except Exception as exc:
+                logging.error("Failed to record reading for %s: %s", channel.site.name, exc)
+
+    def take_readings(self):
+        self.record(self.sample(self.channels))
+
+    def run(self, stop_event, loader=None):
+        """Sample each tank on its own schedule until stop_event is set."""
+        while not stop_event.is_set():
+            if loader is not None:
+                sites = dict((site.name, site) for site in loader.tanks())
+                for channel in self.channels:
+                    if channel.site.name in sites:
+                        channel.configure(sites[channel.site.name])
+            now = time.monotonic()
+            due = [channel for channel in self.channels if channel.next_at <= now]
+            if due:
+                self.record(self.sample(due))
+            now = time.monotonic()
+            for channel in due:
+                interval = channel.sampler.next_interval(now) if channel.sampler is not None else channel.interval
+                channel.next_at += interval
+                if channel.next_at < now:
+                    # Missed one or more slots (e.g. after a long stall); skip ahead.
+                    channel.next_at = now + interval
+            stop_event.wait(max(0.0, min(channel.next_at for channel in self.channels) - now))
+
+
+def open_channels(sites, alerts_for, append=True, keep_open=True):
+    """Set up a sensor and log per site; the caller closes them with close_channels."""
+    stagger = max(site.sensor.stagger_seconds for site in sites)
+    gate = TriggerGate(max(stagger, MIN_RETRIGGER_GAP))
+    channels = []
+    try:
+        for site in sites:
+            # Settle all sensors together below instead of one after another.
+            sensor = DistanceSensor(pin_trigger=site.sensor.pin_trigger, pin_echo=site.sensor.pin_echo,
+                                    sleep_time=0, timing=site.sensor.timing,
+                                    echo_timeout=site.sensor.echo_timeout, trigger_gate=gate)
+            try:
+                logger = LogDistance.from_config(site.config, site.log_file, append=append, keep_open=keep_open,
+                                                 alerts=alerts_for(site))
+            except Exception:
+                sensor.__exit__(None, None, None)
+                raise
+            channels.append(TankChannel(site, sensor, logger))
+    except Exception:
+        close_channels(channels)
+        raise
+    time.sleep(max(site.sensor.sleep_time for site in sites))
+    return channels
+
+
+def close_channels(channels):
+    for channel in channels:
+        channel.logger.close()
+        channel.sensor.__exit__(None, None, None)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+'''
+Durable on-disk outbox for Slack posts.
+
+Writers enqueue a message as one small JSON file in a spool directory and return
+at once; nothing on the reading or command path waits for the network. Each
+file is written to a temporary name and renamed into place, the same discipline
+as save_state_atomic, so a power cut leaves either a complete message or none.
+A flusher drains the queue oldest first, deleting each file only after Slack
+accepted it, and stops at the first failure so order is kept until
+connectivity returns. Only the newest queued hourly status message is sent;
+older ones are dropped as stale.
+
+Run as a script (e.g. every minute from cron) to flush the queue.
+'''
+import argparse
+import fcntl
+import json
+import logging
+import os
+import time
+
+from config_loader import ConfigLoader
+
+KIND_STATUS = 'status'
+KIND_REPLY = 'reply'
+KIND_ALERT = 'alert'
+
+DEFAULT_BATCH_SIZE = 20
+LOCK_NAME = '.lock'
+
+
+class Outbox:
+    def __init__(self, directory, kind=KIND_REPLY):
+        self.directory = directory
+        # Default kind for post_message, so an Outbox can stand in for a SlackClient.
+        self.kind = kind
+        self._seq = 0
+
+    def enqueue(self, message, kind=None):
+        """Durably queue message; returns the spool file name."""
+        kind = kind or self.kind
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._seq += 1
+        # Zero-padded so lexical order is enqueue order.
+        name = "%017d-%06d-%03d-%s.json" % (int(time.time() * 1e6), os.getpid() % 1000000, self._seq % 1000, kind)
+        path = os.path.join(self.directory, name)
+        tmp_path = os.path.join(self.directory, "." + name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({'kind': kind, 'text': message, 'queued_at': time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+        return name
+
+    def post_message(self, message, endpoint=None, dryrun=False, kind=None):
+        """SlackClient-compatible: queue instead of sending; True once safely on disk."""
+        if dryrun:
+            logging.info({'text': message})
+            return True
+        try:
+            self.enqueue(message, kind=kind)
+            return True
+        except Exception as exc:
+            logging.error("Failed to queue Slack message: %s", exc)
+            return False
+
+    def pending(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.json') and not name.startswith('.'))
+
+    def _load(self, name):
+        with open(os.path.join(self.directory, name), 'r') as f:
+            return json.load(f)
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError as exc:
+            logging.error("Failed to remove sent outbox entry %s: %s", name, exc)
+
+    def flush(self, client, endpoint=None, batch_size=DEFAULT_BATCH_SIZE):
+        """Send up to batch_size queued messages; return (sent, remaining)."""
+        if not os.path.isdir(self.directory):
+            return 0, 0
+        lock_file = open(os.path.join(self.directory, LOCK_NAME), 'a')
+        try:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                logging.info("Outbox is being flushed by another process")
+                return 0, len(self.pending())
+            return self._flush_locked(client, endpoint, batch_size)
+        finally:
+            lock_file.close()
+
+    def _flush_locked(self, client, endpoint, batch_size):
+        names = self.pending()
+        status_names = [name for name in names if name.endswith('-%s.json' % KIND_STATUS)]
+        for name in status_names[:-1]:
+            logging.info("Dropping stale status message %s", name)
+            self._remove(name)
+        stale = set(status_names[:-1])
+        names = [name for name in names if name not in stale]
+
+        sent = 0
+        for name in names[:batch_size]:
+            try:
+                entry = self._load(name)
+            except Exception as exc:
+                logging.error("Discarding unreadable outbox entry %s: %s", name, exc)
+                self._remove(name)
+                continue
+            if not client.post_message(entry.get('text', ''), endpoint=endpoint):
+                logging.warning("Slack unreachable; %d message(s) left in outbox", len(names) - sent)
+                break
+            self._remove(name)
+            sent += 1
+        return sent, len(names) - sent
+
+
+def outbox_from_config(config, kind=KIND_REPLY):
+    """Outbox for paths.outbox_dir, or None if the outbox is not configured."""
+    directory = (config.get('paths') or {}).get('outbox_dir')
+    if not directory:
+        return None
+    return Outbox(directory, kind=kind)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send queued Slack messages from the outbox.')
+    parser.add_argument('--config', type=str, help='Path to config.json', required=False)
+    parser.add_argument('--secrets', type=str, help='Path to secrets.json', required=False)
+    parser.add_argument('--batch', type=int, help='Maximum messages to send', default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    logging.getLogger().setLevel('INFO')
+
+    loader = ConfigLoader(config_path=args.config, secrets_path=args.secrets)
+    config = loader.load_config()
+    secrets = loader.load_secrets()
+    outbox = outbox_from_config(config)
+    if outbox is None:
+        raise SystemExit("Missing outbox directory. Set paths.outbox_dir in config.json.")
+    endpoint = (secrets.get('slack') or {}).get('webhook_endpoint')
+    if not endpoint:
+        raise SystemExit("Missing Slack webhook endpoint in secrets.json.")
+    if not outbox.pending():
+        return
+
+    # Imported here: requests is only needed when there is something to send.
+    from slack_client import SlackClient
+    sent, remaining = outbox.flush(SlackClient(webhook_endpoint=endpoint), batch_size=args.batch)
+    logging.info("Sent %d queued message(s); %d remaining", sent, remaining)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 import argparse
 import logging
 import time
-from distance_sensor import DistanceSensor
+from distance_sensor import DistanceSensor, EchoTimeoutError
 from config_loader import ConfigLoader
 
 # Parse Inputs
@@ -18,18 +18,19 @@ logging.getLogger().setLevel('DEBUG')
 # Begin
 config_path = args.config or ConfigLoader.default_config_path()
 loader = ConfigLoader(config_path=config_path)
-config = loader.load_config()
-sensor_config = config.get('sensor') or {}
-pin_trigger = int(sensor_config.get('pin_trigger', 7))
-pin_echo = int(sensor_config.get('pin_echo', 11))
-sleep_time = float(sensor_config.get('sleep_time', 5))
+sensor_config = loader.sensor()
 
 logging.info("Distance Read...")
 logging.info("Interval: %5.2f" % read_interval )
-with DistanceSensor(pin_trigger=pin_trigger, pin_echo=pin_echo, sleep_time=sleep_time) as distance_sensor:
+with DistanceSensor(pin_trigger=sensor_config.pin_trigger, pin_echo=sensor_config.pin_echo,
+                    sleep_time=sensor_config.sleep_time, timing=sensor_config.timing,
+                    echo_timeout=sensor_config.echo_timeout) as distance_sensor:
     try:
         while(True):
-            logging.info("Distance: %5.2f in" % distance_sensor.distance_in_inches())
+            try:
+                logging.info("Distance: %5.2f in" % distance_sensor.distance_in_inches())
+            except EchoTimeoutError as exc:
+                logging.warning("Missed echo: %s" % exc)
             time.sleep(read_interval)
     except KeyboardInterrupt:
         logging.info("Exiting")
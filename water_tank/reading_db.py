@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+'''
+SQLite history of distance readings.
+
+Mirrors the text log into an indexed table so range, last-N and aggregate
+queries run in SQL instead of re-parsing every line. Timestamps are stored as
+the same text the log uses, which sorts in time order, so log lines can be
+reproduced exactly and imports are idempotent.
+
+Run as a script to bulk-import an existing text log.
+'''
+import argparse
+import datetime
+import logging
+import sqlite3
+
+from config_loader import ConfigLoader
+from tank_message import parse_distance_in_inches
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS readings (
+    ts TEXT PRIMARY KEY,
+    distance_in REAL NOT NULL,
+    line TEXT NOT NULL
+) WITHOUT ROWID
+'''
+
+INSERT = 'INSERT OR IGNORE INTO readings (ts, distance_in, line) VALUES (?, ?, ?)'
+
+# Prefix lengths of "YYYY-MM-DD HH:MM:SS" identifying each bucket size.
+BUCKET_PREFIX = {
+    'minute': 16,
+    'hour': 13,
+    'day': 10,
+    'month': 7,
+}
+
+# Other processes (the command checker, the fleet shipper) read the database, so
+# commit every reading by default; in WAL mode with synchronous=NORMAL a commit
+# does not fsync. Readers fill in anything uncommitted from the text log.
+DEFAULT_BATCH_SIZE = 1
+IMPORT_BATCH_SIZE = 50000
+
+
+class ReadingDatabase:
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._conn = None
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # WAL keeps the database consistent on power loss; NORMAL only
+            # risks the last few commits, which the text log still holds.
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(SCHEMA)
+            self._conn.commit()
+        return self._conn
+
+    def close(self):
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def add(self, entry, distance_in_inches):
+        """Queue a log entry; rows are committed in batches of batch_size."""
+        self._pending.append((entry.partition(': ')[0], distance_in_inches, entry))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany(INSERT, self._pending)
+        self._pending = []
+
+    def import_lines(self, lines, batch_size=IMPORT_BATCH_SIZE):
+        """Bulk-load log lines using large executemany transactions.
+
+        Returns the number of lines parsed; lines already present are skipped.
+        """
+        self.flush()
+        conn = self._connect()
+        total = 0
+        batch = []
+        for line in lines:
+            stamp, sep, _ = line.partition(': ')
+            if not sep:
+                continue
+            try:
+                batch.append((stamp, parse_distance_in_inches(line), line))
+            except ValueError:
+                continue
+            if len(batch) >= batch_size:
+                with conn:
+                    conn.executemany(INSERT, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            with conn:
+                conn.executemany(INSERT, batch)
+            total += len(batch)
+        return total
+
+    def __len__(self):
+        self.flush()
+        return self._connect().execute('SELECT COUNT(*) FROM readings').fetchone()[0]
+
+    def iter_range(self, start, end=None):
+        """Yield log lines with start <= timestamp < end, oldest first."""
+        self.flush()
+        if end is None:
+            cursor = self._connect().execute(
+                'SELECT line FROM readings WHERE ts >= ? ORDER BY ts', (str(start),))
+        else:
+            cursor = self._connect().execute(
+                'SELECT line FROM readings WHERE ts >= ? AND ts < ? ORDER BY ts', (str(start), str(end)))
+        for row in cursor:
+            yield row[0]
+
+    def last_lines(self, count):
+        """Return up to count newest log lines, oldest first."""
+        self.flush()
+        rows = self._connect().execute(
+            'SELECT line FROM readings ORDER BY ts DESC LIMIT ?', (count,)).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def aggregate(self, start, end=None, bucket='hour'):
+        """Return (bucket, count, min, max, mean) distance rows grouped by time bucket."""
+        if bucket not in BUCKET_PREFIX:
+            raise ValueError("Unknown bucket: %r" % bucket)
+        self.flush()
+        end = end or datetime.datetime.max
+        return self._connect().execute(
+            'SELECT substr(ts, 1, ?) AS bucket, COUNT(*), MIN(distance_in), MAX(distance_in), AVG(distance_in) '
+            'FROM readings WHERE ts >= ? AND ts < ? GROUP BY bucket ORDER BY bucket',
+            (BUCKET_PREFIX[bucket], str(start), str(end))).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import the text distance log into the SQLite history database.')
+    parser.add_argument('--config', type=str, help='Path to config.json', required=False)
+    parser.add_argument('--data_file', type=str, help='Text log to import. Defaults to config.json log_file', default=None)
+    parser.add_argument('--db', type=str, help='Database to write. Defaults to config.json log.sqlite_file', default=None)
+    args = parser.parse_args()
+    logging.getLogger().setLevel('INFO')
+
+    # Imported here: log_distance attaches ReadingDatabase to LogDistance.
+    from log_distance import LogDistance
+
+    loader = ConfigLoader(config_path=args.config or ConfigLoader.default_config_path())
+    config = loader.load_config()
+    db_path = args.db or (config.get('log') or {}).get('sqlite_file')
+    if not db_path:
+        raise SystemExit("Missing database path. Use --db or set log.sqlite_file in config.json.")
+
+    reader = LogDistance.from_config(config, args.data_file, database=None)
+    with ReadingDatabase(db_path) as db:
+        count = db.import_lines(reader.read_range(datetime.datetime.min))
+        logging.info("Imported %d lines into %s (%d rows total)", count, db_path, len(db))
+
+
+if __name__ == "__main__":
+    main()
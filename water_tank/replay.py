@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+'''
+Recompute gallons for the whole distance history with the current tank config.
+
+Lines are parsed and converted in blocks through the batch WaterTank APIs
+(NumPy when installed), so a multi-year log replays in seconds. Writes a CSV of
+timestamp, distance and gallons, and can rebuild the gallon rollups as well.
+'''
+import argparse
+import datetime
+import gzip
+import itertools
+import logging
+import sys
+
+from config_loader import ConfigLoader
+from log_distance import LogDistance
+from tank_message import parse_log_block
+from watertank import WaterTank
+
+BLOCK_SIZE = 20000
+
+
+def replay(lines, tank, out, block_size=BLOCK_SIZE):
+    """Write "timestamp,distance_in,gallons" rows for every parseable line; return the row count."""
+    count = 0
+    lines = iter(lines)
+    while True:
+        block = list(itertools.islice(lines, block_size))
+        if not block:
+            break
+        timestamps, distances, gallons = parse_log_block(block, tank)
+        rows = ["%s,%.2f,%.1f\n" % (datetime.datetime.fromtimestamp(ts), d, g)
+                for ts, d, g in zip(timestamps, distances, gallons)]
+        out.write("".join(rows))
+        count += len(rows)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute gallons for the full log using the current tank config.')
+    parser.add_argument('--config', type=str, help='Path to config.json', required=False)
+    parser.add_argument('--data_file', type=str, help='Log file to replay. Defaults to config.json log_file', default=None)
+    parser.add_argument('--out_file', '-o', type=str, help='CSV file to write. Defaults to stdout', default=None)
+    parser.add_argument('--gzip', help='gzip-compress the output', action='store_true')
+    parser.add_argument('--rollups', help='Also rebuild the hourly/daily rollups (log.rollup_file)', action='store_true')
+    args = parser.parse_args()
+    logging.getLogger().setLevel('INFO')
+
+    loader = ConfigLoader(config_path=args.config or ConfigLoader.default_config_path())
+    config = loader.load_config()
+    tank_config = config.get('tank') or {}
+    tank = WaterTank.from_config(tank_config)
+    reader = LogDistance.from_config(config, args.data_file, rollups=None)
+
+    if args.out_file:
+        out = gzip.open(args.out_file, 'wt') if args.gzip else open(args.out_file, 'w')
+    elif args.gzip:
+        out = gzip.open(sys.stdout.buffer, 'wt')
+    else:
+        out = sys.stdout
+
+    try:
+        out.write("timestamp,distance_in,gallons\n")
+        count = replay(reader.read_range(datetime.datetime.min), tank, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logging.info("Replayed %d readings", count)
+
+    if args.rollups:
+        rollup_path = (config.get('log') or {}).get('rollup_file')
+        if not rollup_path:
+            raise SystemExit("Missing rollup path. Set log.rollup_file in config.json.")
+        # Imported here: only needed when rebuilding rollups.
+        from rollups import GallonRollups
+        rollups = GallonRollups(rollup_path, tank_config)
+        rollups.rebuild(reader.read_range(datetime.datetime.min))
+        logging.info("Rebuilt rollups in %s", rollup_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+'''
+Memoized command responses keyed on the state of the tank log.
+
+A reply to tank:level or tank:graph only changes when a reading is appended,
+so the rendered text is cached under the log's (inode, size, mtime) plus the
+command and its parameters. A repeat query between readings costs one stat()
+of the log. Entries are evicted least recently used first; with a file path
+the cache is persisted (temp file and rename) so cron-started runs share it.
+'''
+import collections
+import json
+import logging
+import os
+
+DEFAULT_CAPACITY = 16
+
+
+def log_signature(log_path):
+    """(inode, size, mtime_ns) of the log, or None if it cannot be stat'ed."""
+    try:
+        st = os.stat(log_path)
+    except OSError as exc:
+        logging.error("Cannot stat log %s: %s", log_path, exc)
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class ResponseCache:
+    def __init__(self, capacity=DEFAULT_CAPACITY, path=None):
+        self.capacity = max(1, int(capacity))
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+
+    @classmethod
+    def from_config(cls, config):
+        cache_config = config.get('response_cache') or {}
+        return cls(capacity=cache_config.get('capacity', DEFAULT_CAPACITY), path=cache_config.get('file'))
+
+    @staticmethod
+    def make_key(signature, command, params=None):
+        # A string, so keys survive a round trip through the JSON file.
+        return json.dumps([list(signature), command, params], sort_keys=True)
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = collections.OrderedDict()
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r') as f:
+                        for key, value in json.load(f):
+                            self._entries[key] = value
+                except Exception as exc:
+                    logging.error("Error loading response cache %s: %s", self.path, exc)
+        return self._entries
+
+    def get(self, key):
+        entries = self.entries
+        if key not in entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entries.move_to_end(key)
+        return entries[key]
+
+    def put(self, key, response):
+        entries = self.entries
+        entries[key] = response
+        entries.move_to_end(key)
+        while len(entries) > self.capacity:
+            entries.popitem(last=False)
+        self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(list(self._entries.items()), f)
+            os.rename(tmp_path, self.path)
+        except Exception as exc:
+            logging.error("Error saving response cache %s: %s", self.path, exc)
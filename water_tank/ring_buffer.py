@@ -0,0 +1,120 @@
+'''
+Fixed-size binary ring buffer of recent readings, accessed through mmap.
+
+The file is preallocated once to hold `capacity` fixed-width records, so
+appends overwrite in place: the file never grows and every write touches the
+same small, predictable set of flash pages. Reading the newest N records is a
+slice of the map plus struct unpacking, with no text parsing.
+'''
+import datetime
+import logging
+import mmap
+import os
+import struct
+
+MAGIC = b'WTRB'
+VERSION = 1
+# magic, version, capacity, count, head (index of the next slot to write)
+HEADER = struct.Struct('<4sIIII')
+# unix timestamp (seconds), distance in inches
+RECORD = struct.Struct('<dd')
+
+DEFAULT_CAPACITY = 10080  # one week of one-minute readings
+
+
+class ReadingRingBuffer:
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self._file = None
+        self._map = None
+        self._writable = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _size(self):
+        return HEADER.size + self.capacity * RECORD.size
+
+    def _create(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.capacity, 0, 0))
+            f.truncate(self._size())
+        os.rename(tmp_path, self.path)
+
+    def _open(self, write):
+        if self._map is not None and (self._writable or not write):
+            return True
+        self.close()
+        if not os.path.exists(self.path):
+            if not write:
+                return False
+            self._create()
+        self._file = open(self.path, 'r+b' if write else 'rb')
+        access = mmap.ACCESS_WRITE if write else mmap.ACCESS_READ
+        if os.fstat(self._file.fileno()).st_size == self._size():
+            self._map = mmap.mmap(self._file.fileno(), 0, access=access)
+            magic, version, capacity, _, _ = self._header()
+            if magic == MAGIC and version == VERSION and capacity == self.capacity:
+                self._writable = write
+                return True
+        self.close()
+        if not write:
+            logging.error("Ring buffer %s has an unexpected layout; ignoring it", self.path)
+            return False
+        # The text log is the source of truth; start the cache over.
+        logging.warning("Recreating ring buffer %s with capacity %d", self.path, self.capacity)
+        self._create()
+        return self._open(write)
+
+    def _header(self):
+        return HEADER.unpack_from(self._map, 0)
+
+    def __len__(self):
+        if not self._open(write=False):
+            return 0
+        return self._header()[3]
+
+    def append(self, timestamp, distance_in_inches):
+        if not self._open(write=True):
+            return
+        _, _, capacity, count, head = self._header()
+        if isinstance(timestamp, datetime.datetime):
+            timestamp = timestamp.timestamp()
+        RECORD.pack_into(self._map, HEADER.size + head * RECORD.size, timestamp, distance_in_inches)
+        # Publish the record before moving head so readers never see a slot
+        # that is counted but not yet written.
+        count = min(count + 1, capacity)
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, capacity, count, (head + 1) % capacity)
+
+    def last(self, n):
+        """Return up to n newest readings as (datetime, distance) pairs, oldest first."""
+        if n <= 0 or not self._open(write=False):
+            return []
+        _, _, capacity, count, head = self._header()
+        n = min(n, count)
+        start = (head - n) % capacity
+        if start + n <= capacity:
+            chunks = [self._map[HEADER.size + start * RECORD.size:HEADER.size + (start + n) * RECORD.size]]
+        else:
+            chunks = [
+                self._map[HEADER.size + start * RECORD.size:HEADER.size + capacity * RECORD.size],
+                self._map[HEADER.size:HEADER.size + head * RECORD.size],
+            ]
+        readings = []
+        for chunk in chunks:
+            for timestamp, distance in RECORD.iter_unpack(chunk):
+                readings.append((datetime.datetime.fromtimestamp(timestamp), distance))
+        return readings
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+'''
+Hourly and daily gallon rollups maintained as readings are appended.
+
+Each granularity has an append-only text file of closed buckets plus one small
+JSON state file holding the buckets still open. An append only rewrites the
+small state file (and appends one line when a bucket closes), which keeps SD
+card writes low. Rendering a window reads a fixed number of buckets from the
+tail of a file, so it costs the same whatever the size of the history.
+Buckets older than the window's time span are dropped, so a gap in the
+readings shows as a shorter graph rather than older data.
+
+Run as a script to rebuild the rollups from the full log, e.g. after the tank
+configuration changes.
+'''
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+
+from config_loader import ConfigLoader, file_signature
+from log_distance import LogDistance
+from tank_message import parse_log_block, parse_timestamp
+from watertank import WaterTank
+
+REBUILD_BLOCK_SIZE = 10000
+
+HOURLY = 'hourly'
+DAILY = 'daily'
+
+# window name -> (granularity, time span, buckets merged per character)
+WINDOWS = {
+    '24h': (HOURLY, datetime.timedelta(hours=24), 1),
+    '7d': (HOURLY, datetime.timedelta(days=7), 6),
+    '30d': (DAILY, datetime.timedelta(days=30), 1),
+}
+
+BUCKET_SPANS = {
+    HOURLY: datetime.timedelta(hours=1),
+    DAILY: datetime.timedelta(days=1),
+}
+
+
+def bucket_start(timestamp, granularity):
+    if granularity == HOURLY:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class Bucket:
+    __slots__ = ('start', 'count', 'min', 'max', 'total', 'last')
+
+    def __init__(self, start, count=0, min_gal=None, max_gal=None, total=0.0, last=None):
+        self.start = start
+        self.count = count
+        self.min = min_gal
+        self.max = max_gal
+        self.total = total
+        self.last = last
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def add(self, gallons):
+        self.count += 1
+        self.total += gallons
+        self.last = gallons
+        self.min = gallons if self.min is None else min(self.min, gallons)
+        self.max = gallons if self.max is None else max(self.max, gallons)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.last = other.last
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def to_line(self):
+        return "%s\t%d\t%.2f\t%.2f\t%.2f\t%.2f" % (self.start, self.count, self.min, self.max, self.mean, self.last)
+
+    @classmethod
+    def from_line(cls, line):
+        start, count, min_gal, max_gal, mean, last = line.split('\t')
+        count = int(count)
+        return cls(start, count, float(min_gal), float(max_gal), float(mean) * count, float(last))
+
+    def to_state(self):
+        return [self.start, self.count, self.min, self.max, self.total, self.last]
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(*state)
+
+
+class GallonRollups:
+    def __init__(self, base_path, tank_config):
+        self.base_path = base_path
+        self.state_path = base_path + '.open.json'
+        self.tank = WaterTank.from_config(tank_config)
+        self._open = None
+        self._signature = None
+
+    def _bucket_path(self, granularity):
+        return "%s.%s" % (self.base_path, granularity)
+
+    def _load_open(self):
+        # Reread when another process (the sampler) has saved newer open buckets.
+        signature = file_signature(self.state_path)
+        if self._open is None or signature != self._signature:
+            self._signature = signature
+            self._open = {}
+            if os.path.exists(self.state_path):
+                try:
+                    with open(self.state_path, 'r') as f:
+                        state = json.load(f)
+                    self._open = dict((g, Bucket.from_state(b)) for g, b in state.items())
+                except Exception as exc:
+                    logging.error("Error loading rollup state %s: %s", self.state_path, exc)
+        return self._open
+
+    def _save_open(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(dict((g, b.to_state()) for g, b in self._open.items()), f)
+        os.rename(tmp_path, self.state_path)
+        self._signature = file_signature(self.state_path)
+
+    def add(self, timestamp, distance_in_inches, save=True):
+        gallons = self.tank.gallons_at_height(self.tank.height_at_distance(distance_in_inches))
+        self.add_gallons(timestamp, gallons, save=save)
+
+    def add_gallons(self, timestamp, gallons, save=True):
+        open_buckets = self._load_open()
+        for granularity in (HOURLY, DAILY):
+            start = str(bucket_start(timestamp, granularity))
+            bucket = open_buckets.get(granularity)
+            if bucket is not None and bucket.start != start:
+                if start < bucket.start:
+                    # Out-of-order reading (clock step); fold it into the open bucket.
+                    start = bucket.start
+                else:
+                    self._append_closed(granularity, bucket)
+                    bucket = None
+            if bucket is None:
+                bucket = open_buckets[granularity] = Bucket(start)
+            bucket.add(gallons)
+        if save:
+            self._save_open()
+
+    def _append_closed(self, granularity, bucket):
+        path = self._bucket_path(granularity)
+        # The line and the open-bucket state are written separately; after a
+        # crash between the two the bucket closes again and must not repeat.
+        last = LogDistance(path).read_last_line()
+        if last and last.startswith(bucket.start + '\t'):
+            return
+        with open(path, 'a') as f:
+            f.write(bucket.to_line())
+            f.write("\n")
+
+    def buckets(self, granularity, count):
+        """Return up to count newest buckets, oldest first, including the open one."""
+        open_bucket = self._load_open().get(granularity)
+        closed_count = count - 1 if open_bucket is not None else count
+        lines = LogDistance(self._bucket_path(granularity)).read_last_lines(closed_count)
+        result = []
+        for line in lines:
+            try:
+                result.append(Bucket.from_line(line))
+            except ValueError:
+                continue
+        if open_bucket is not None:
+            result.append(open_bucket)
+        return result
+
+    def window(self, name, now=None):
+        """Return the buckets starting within a named window before now, merged to sparkline width."""
+        granularity, span, group = WINDOWS[name]
+        if now is None:
+            now = datetime.datetime.now()
+        cutoff = str(now - span)
+        count = span // BUCKET_SPANS[granularity]
+        buckets = [b for b in self.buckets(granularity, count) if b.start >= cutoff]
+        if group == 1:
+            return buckets
+        merged = []
+        for bucket in buckets:
+            key = bucket_start(parse_timestamp(bucket.start), granularity)
+            key = str(key.replace(hour=key.hour - key.hour % group))
+            if not merged or merged[-1].start != key:
+                merged.append(Bucket(key))
+            merged[-1].merge(bucket)
+        return merged
+
+    def rebuild(self, lines):
+        """Discard all rollups and recompute them from log lines, oldest first."""
+        for path in (self._bucket_path(HOURLY), self._bucket_path(DAILY), self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._open = {}
+        self._signature = None
+        count = 0
+        lines = iter(lines)
+        while True:
+            block = list(itertools.islice(lines, REBUILD_BLOCK_SIZE))
+            if not block:
+                break
+            timestamps, _, gallons = parse_log_block(block, self.tank)
+            for timestamp, gal in zip(timestamps, gallons):
+                self.add_gallons(datetime.datetime.fromtimestamp(timestamp), float(gal), save=False)
+            count += len(timestamps)
+        self._save_open()
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the hourly/daily gallon rollups from the distance log.')
+    parser.add_argument('--config', type=str, help='Path to config.json', required=False)
+    args = parser.parse_args()
+    logging.getLogger().setLevel('INFO')
+
+    loader = ConfigLoader(config_path=args.config or ConfigLoader.default_config_path())
+    config = loader.load_config()
+    base_path = (config.get('log') or {}).get('rollup_file')
+    if not base_path:
+        raise SystemExit("Missing rollup path. Set log.rollup_file in config.json.")
+
+    reader = LogDistance.from_config(config, rollups=None)
+    rollups = GallonRollups(base_path, config.get('tank') or {})
+    count = rollups.rebuild(reader.read_range(datetime.datetime.min))
+    logging.info("Rebuilt rollups from %d readings", count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+'''
+Reads the distance sensor and appends readings to the log.
+
+`log_distance.py` runs main() from here. The sampler is a module of its own
+because multi_tank and fleet_shipper import its pieces: imported from a
+script running as __main__, they would load that script a second time, with
+a second LogDistance class and set of metrics.
+
+    python3 log_distance.py             # one reading (cron)
+    python3 log_distance.py --daemon    # sample on a schedule until SIGTERM
+'''
+import argparse
+import logging
+import signal
+import threading
+import time
+
+import metrics
+from config_loader import ConfigLoader
+from log_distance import LogDistance
+
+DEFAULT_SAMPLE_INTERVAL = 60.0
+
+
+def read_sensor(sensor, burst_count=1):
+    """Read the sensor once, or as a filtered burst; return (distance, quality or None)."""
+    if burst_count > 1:
+        burst = sensor.read_burst(burst_count)
+        return burst.median, burst
+    return sensor.distance_in_inches(), None
+
+
+def take_reading(sensor, logger, burst_count=1):
+    """Read the sensor once, or as a filtered burst, and append it to the log."""
+    distance, quality = read_sensor(sensor, burst_count)
+    return logger.append_reading(distance, quality=quality)
+
+
+class AdaptiveSampler:
+    """Chooses the next sample interval and whether a reading is worth logging.
+
+    A reading is logged only when it is more than deadband inches from the
+    last logged one, or max_gap seconds have passed since then. Each logged
+    move gives a rate of change; at or above rate_threshold (inches/minute)
+    the interval drops to min_interval. Once the level has stayed inside the
+    deadband for longer than a move at that rate would take, it cannot be
+    changing that fast, and the interval grows by backoff toward
+    max_interval, like the command checker's polling.
+    """
+
+    def __init__(self, min_interval, max_interval, rate_threshold, deadband, max_gap, backoff=2.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.rate_threshold = rate_threshold
+        self.deadband = deadband
+        self.max_gap = max_gap
+        self.backoff = backoff
+        self.interval = min_interval
+        self.fast = False
+        self._last_logged = None
+
+    @classmethod
+    def from_config(cls, sensor_config):
+        return cls(sensor_config.min_sample_interval, sensor_config.max_sample_interval,
+                   sensor_config.change_rate_in_per_min, sensor_config.deadband_in, sensor_config.max_gap_seconds)
+
+    def configure(self, sensor_config):
+        self.min_interval = sensor_config.min_sample_interval
+        self.max_interval = sensor_config.max_sample_interval
+        self.rate_threshold = sensor_config.change_rate_in_per_min
+        self.deadband = sensor_config.deadband_in
+        self.max_gap = sensor_config.max_gap_seconds
+
+    def observe(self, now, distance_in_inches):
+        """Record a sample taken at monotonic time now; return True if it should be logged."""
+        if self._last_logged is None:
+            self._last_logged = (now, distance_in_inches)
+            return True
+        logged_at, logged_distance = self._last_logged
+        minutes = (now - logged_at) / 60.0
+        change = abs(distance_in_inches - logged_distance)
+        moved = change > self.deadband
+        if moved and minutes > 0:
+            self.fast = change / minutes >= self.rate_threshold
+        elif minutes * self.rate_threshold > self.deadband:
+            self.fast = False
+        if self.fast:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(max(self.interval * self.backoff, self.min_interval), self.max_interval)
+
+        if moved or now - logged_at >= self.max_gap:
+            self._last_logged = (now, distance_in_inches)
+            return True
+        return False
+
+    def next_interval(self, now):
+        """Seconds to the next sample, early enough to honour max_gap."""
+        if self._last_logged is None:
+            return self.interval
+        due = self._last_logged[0] + self.max_gap - now
+        return max(min(self.interval, due), self.min_interval)
+
+
+def run_daemon(sensor, logger, interval, stop_event, burst_count=1, loader=None, sampler=None):
+    """Sample on a schedule until stop_event is set.
+
+    The schedule is anchored to a monotonic clock so a slow reading does not
+    make later samples drift. With a ConfigLoader, sample_interval,
+    burst_count and the adaptive settings are re-read each cycle (a stat()
+    unless config.json changed), so edits apply without a restart. With an
+    AdaptiveSampler the interval follows the level's rate of change and
+    readings inside the deadband are skipped.
+    """
+    from distance_sensor import EchoTimeoutError
+    next_at = time.monotonic()
+    while not stop_event.is_set():
+        if loader is not None:
+            sensor_config = loader.sensor()
+            interval = sensor_config.sample_interval
+            burst_count = sensor_config.burst_count
+            if not sensor_config.adaptive:
+                sampler = None
+            elif sampler is None:
+                sampler = AdaptiveSampler.from_config(sensor_config)
+            else:
+                sampler.configure(sensor_config)
+        try:
+            distance, quality = read_sensor(sensor, burst_count)
+            if sampler is None or sampler.observe(time.monotonic(), distance):
+                logger.append_reading(distance, quality=quality)
+        except EchoTimeoutError as exc:
+            logging.warning("Missed echo: %s", exc)
+        except Exception as exc:
+            logging.error("Failed to record reading: %s", exc)
+        now = time.monotonic()
+        if sampler is not None:
+            interval = sampler.next_interval(now)
+        next_at += interval
+        if next_at < now:
+            # Missed one or more slots (e.g. after a long stall); skip ahead.
+            next_at = now + interval
+        stop_event.wait(next_at - now)
+
+
+def stop_event_on_signals():
+    """threading.Event set by SIGTERM/SIGINT, for a clean daemon shutdown."""
+    stop_event = threading.Event()
+
+    def handle_stop(signum, frame):
+        logging.info("Received signal %s; stopping sampler", signum)
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    return stop_event
+
+
+def run_tanks(loader, sites, daemon=False, append=True):
+    """Sample every tank in config.json's `tanks` list from this one process."""
+    from multi_tank import MultiTankSampler, close_channels, open_channels
+
+    def alerts_for(site):
+        if not site.config.get('alerts'):
+            return None
+        from alerts import build_alert_engine
+        return build_alert_engine(site.config, loader.load_secrets(), site.name)
+
+    channels = open_channels(sites, alerts_for, append=append, keep_open=daemon)
+    sampler = MultiTankSampler(channels)
+    try:
+        if daemon:
+            sampler.run(stop_event_on_signals(), loader=loader)
+        else:
+            sampler.take_readings()
+    finally:
+        sampler.close()
+        close_channels(channels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Logs the distance in inches from the distance sensor to input file.')
+    parser.add_argument('--output', help='Path to file to write to. Defaults to config.json log_file', default=None)
+    parser.add_argument('--config', help='Path to config.json', default=None)
+    parser.add_argument('--secrets', help='Path to secrets.json (for alerts)', default=None)
+    parser.add_argument('--append', type=bool, help='True = append to file, False = overwrite file, Defaults to True', default=True)
+    parser.add_argument('--verbose', type=bool, help='verbose output will also go to log file', default=False)
+    parser.add_argument('--daemon', help='Keep running and sample on a schedule until SIGTERM', action='store_true')
+    parser.add_argument('--burst', type=int, help='Pings per reading; >1 logs the median with a quality figure. Defaults to config.json burst_count', default=None)
+    parser.add_argument('--interval', type=float, help='Seconds between samples in daemon mode. Defaults to config.json sample_interval', default=None)
+    args = parser.parse_args()
+    # Imported here: RPi.GPIO is only needed by the sampler, not by code that reads the log.
+    from distance_sensor import DistanceSensor, EchoTimeoutError
+
+    config_path = args.config or ConfigLoader.default_config_path()
+    loader = ConfigLoader(config_path=config_path, secrets_path=args.secrets)
+    # Daemons rewrite the textfile periodically; a cron run writes it once on exit.
+    with metrics.exporting(loader, 'sampler', periodic=args.daemon):
+        config = loader.load_config()
+        sites = loader.tanks()
+        if sites[0].name is not None:
+            if args.output or args.interval or args.burst:
+                raise SystemExit("--output, --interval and --burst do not apply to a `tanks` list; "
+                                 "set them per tank.")
+            run_tanks(loader, sites, daemon=args.daemon, append=args.append)
+            return
+        alerts = None
+        if config.get('alerts'):
+            from alerts import build_alert_engine
+            alerts = build_alert_engine(config, loader.load_secrets())
+
+        sensor_config = loader.sensor()
+
+        output_path = args.output or loader.paths().log_file or 'out.txt'
+        burst_count = args.burst or sensor_config.burst_count
+        interval = args.interval or sensor_config.sample_interval
+
+        if args.verbose:
+            logging.getLogger().setLevel('DEBUG')
+            logging.debug("Distance Read...")
+            logging.debug("Output: %s" % output_path)
+            logging.debug("Append: %r" % args.append)
+            logging.debug("Verbose: %r" % args.verbose)
+
+        if args.daemon:
+            stop_event = stop_event_on_signals()
+            # Schedule settings given on the command line stay fixed; otherwise follow config.json.
+            reload_loader = None if args.interval or args.burst else loader
+            with DistanceSensor(pin_trigger=sensor_config.pin_trigger, pin_echo=sensor_config.pin_echo,
+                                sleep_time=sensor_config.sleep_time, timing=sensor_config.timing,
+                                echo_timeout=sensor_config.echo_timeout) as sensor:
+                with LogDistance.from_config(config, output_path, append=args.append, keep_open=True,
+                                             alerts=alerts) as logger:
+                    adaptive = sensor_config.adaptive and not args.interval
+                    sampler = AdaptiveSampler.from_config(sensor_config) if adaptive else None
+                    run_daemon(sensor, logger, interval, stop_event, burst_count, loader=reload_loader,
+                               sampler=sampler)
+            return
+
+        with DistanceSensor(pin_trigger=sensor_config.pin_trigger, pin_echo=sensor_config.pin_echo,
+                            sleep_time=sensor_config.sleep_time, timing=sensor_config.timing,
+                            echo_timeout=sensor_config.echo_timeout) as sensor:
+            with LogDistance.from_config(config, output_path, append=args.append, alerts=alerts) as logger:
+                try:
+                    take_reading(sensor, logger, burst_count)
+                except EchoTimeoutError as exc:
+                    logging.error("Missed echo; no reading logged: %s", exc)
+
+
+if __name__ == "__main__":
+    main()
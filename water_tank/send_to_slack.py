@@ -4,8 +4,9 @@ Send data to Slack
 import argparse
 import logging
 
+import metrics
 from config_loader import ConfigLoader
-from slack_client import SlackClient
+from outbox import KIND_STATUS, outbox_from_config
 from tank_message import build_tank_message
 
 # Parse Inputs
@@ -24,23 +25,37 @@ def main():
     secrets_path = args.secrets or ConfigLoader.default_secrets_path()
     loader = ConfigLoader(config_path=config_path, secrets_path=secrets_path)
     config = loader.load_config()
-    secrets = loader.load_secrets()
 
-    slack_secrets = secrets.get('slack') or {}
-    endpoint = args.endpoint or slack_secrets.get('webhook_endpoint')
+    endpoint = args.endpoint or loader.slack().webhook_endpoint
     if not endpoint:
         raise SystemExit("Missing Slack webhook endpoint. Use --endpoint or set secrets.json.")
 
-    tank_config = config.get('tank') or {}
+    tank_config = loader.tank()
     message, meter_read, water_height, gallons_remaining = build_tank_message(args.rawread, tank_config)
+    flow_config = config.get('flow') or {}
+    if flow_config.get('state_file'):
+        from flow_rate import FlowRateTracker
+        tracker = FlowRateTracker(flow_config['state_file'], tank_config, flow_config)
+        message = "{}\n{}".format(message, tracker.summary())
     if args.dryrun:
         logging.info(args.rawread)
         logging.info(meter_read)
         logging.info(water_height)
         logging.info(gallons_remaining)
 
+    outbox = outbox_from_config(config, kind=KIND_STATUS)
+    if outbox is not None and not args.dryrun:
+        # Queue first so the report survives an outage, then try to drain the backlog.
+        if not outbox.post_message(message):
+            return
+    # Imported here: requests is the slowest import on a Pi Zero.
+    from slack_client import SlackClient
     client = SlackClient(webhook_endpoint=endpoint)
-    client.post_message(message, dryrun=args.dryrun)
+    with metrics.exporting(loader, 'status'):
+        if outbox is None or args.dryrun:
+            client.post_message(message, dryrun=args.dryrun)
+        else:
+            outbox.flush(client, endpoint=endpoint)
 
 
 if __name__ == "__main__":
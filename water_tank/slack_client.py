@@ -1,15 +1,151 @@
 import json
 import logging
+import time
 
 import requests
+import urllib3
+
+import metrics
 
 SLACK_API_BASE = 'https://slack.com/api'
 
+# (connect, read) seconds; a post must never hang a cron job or the daemon.
+DEFAULT_TIMEOUT = (5.0, 15.0)
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+# Cap on honoured Retry-After so a misbehaving server can't park us for hours.
+MAX_RETRY_AFTER = 60.0
+RETRY_STATUSES = (500, 502, 503, 504)
+# Methods that are safe to send twice; anything else is only retried when it
+# provably never reached the server (see _never_sent).
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+REQUEST_SECONDS = metrics.histogram('water_tank_slack_request_seconds',
+                                    'Slack call latency, retries included', ('call',))
+REQUEST_FAILURES = metrics.counter('water_tank_slack_request_failures_total',
+                                   'Slack calls that got no 200 after all retries', ('call',))
+REQUEST_RETRIES = metrics.counter('water_tank_slack_request_retries_total', 'Slack call retries', ('call',))
+
+
+def _never_sent(exc):
+    '''True if a requests exception means the connection was never established'''
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    if not isinstance(exc, requests.ConnectionError):
+        return False
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class SlackHistoryError(Exception):
+    '''Raised when a page of channel history cannot be fetched.'''
+
+
+class CallStats:
+    __slots__ = ('calls', 'failures', 'retries', 'total_seconds', 'max_seconds', 'last_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+
+    def record(self, seconds, ok, retries):
+        self.calls += 1
+        self.retries += retries
+        if not ok:
+            self.failures += 1
+        self.total_seconds += seconds
+        self.last_seconds = seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def as_dict(self):
+        mean = self.total_seconds / self.calls if self.calls else 0.0
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'retries': self.retries,
+            'mean_seconds': mean,
+            'max_seconds': self.max_seconds,
+            'last_seconds': self.last_seconds,
+        }
+
 
 class SlackClient:
-    def __init__(self, webhook_endpoint=None, bot_token=None):
+    def __init__(self, webhook_endpoint=None, bot_token=None, api_base=None,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
         self.webhook_endpoint = webhook_endpoint
         self.bot_token = bot_token
+        # Overridable so the client can run against a local fake Slack server.
+        self.api_base = api_base or SLACK_API_BASE
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = {}
+        self._session = None
+        self._sleep = time.sleep
+
+    @property
+    def session(self):
+        """Pooled keep-alive session, so repeated calls skip the TCP/TLS handshake."""
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def latency_stats(self):
+        """Per-call latency/failure counters, keyed by call name."""
+        return dict((name, stats.as_dict()) for name, stats in self.stats.items())
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None and response.status_code == 429:
+            try:
+                return min(float(response.headers.get('Retry-After', self.backoff)), MAX_RETRY_AFTER)
+            except ValueError:
+                pass
+        return self.backoff * (2 ** attempt)
+
+    def _request(self, name, method, url, **kwargs):
+        """Send with timeouts and retries; return the final response, or None if none arrived."""
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.monotonic()
+        response = None
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+                retryable = response.status_code == 429 or response.status_code in RETRY_STATUSES
+                error = "HTTP %s" % response.status_code
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                response = None
+                # A read timeout or dropped connection may come after Slack
+                # accepted a post; sending it again would duplicate it.
+                retryable = method in IDEMPOTENT_METHODS or _never_sent(exc)
+                error = exc
+            if not retryable or attempt >= self.retries:
+                break
+            delay = self._retry_delay(attempt, response)
+            logging.warning("Slack %s failed (%s); retry %d/%d in %.1fs", name, error, attempt + 1, self.retries, delay)
+            self._sleep(delay)
+            attempt += 1
+        ok = response is not None and response.status_code == 200
+        elapsed = time.monotonic() - started
+        self.stats.setdefault(name, CallStats()).record(elapsed, ok, attempt)
+        REQUEST_SECONDS.labels(name).observe(elapsed)
+        if attempt:
+            REQUEST_RETRIES.labels(name).inc(attempt)
+        if not ok:
+            REQUEST_FAILURES.labels(name).inc()
+        if response is None:
+            logging.error("Slack %s failed after %d attempts: %s", name, attempt + 1, error)
+        return response
 
     def post_message(self, message, endpoint=None, dryrun=False):
         endpoint = endpoint or self.webhook_endpoint
@@ -25,7 +161,9 @@ class SlackClient:
         logging.info(payload)
         if dryrun:
             return True
-        response = requests.post(endpoint, headers=headers, data=json.dumps(payload))
+        response = self._request('post_message', 'POST', endpoint, headers=headers, data=json.dumps(payload))
+        if response is None:
+            return False
         if response.status_code == 200:
             logging.debug("Message sent successfully to Slack!")
             return True
@@ -33,11 +171,15 @@ class SlackClient:
         logging.debug("Response: %s", response.text)
         return False
 
-    def fetch_history(self, channel_id, oldest_ts, limit=50):
+    def iter_history_pages(self, channel_id, oldest_ts, limit=200):
+        """Yield pages (lists, newest first) of conversations.history, following the cursor.
+
+        Raises SlackHistoryError if a page cannot be fetched, so callers never
+        mistake a partial history for a complete one.
+        """
         if not self.bot_token:
-            logging.error("Missing Slack bot token")
-            return None
-        url = "{}/conversations.history".format(SLACK_API_BASE)
+            raise SlackHistoryError("Missing Slack bot token")
+        url = "{}/conversations.history".format(self.api_base)
         headers = {
             "Authorization": "Bearer {}".format(self.bot_token)
         }
@@ -46,18 +188,30 @@ class SlackClient:
             "oldest": str(oldest_ts),
             "limit": limit
         }
-
-        try:
-            resp = requests.get(url, headers=headers, params=params, timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-
+        while True:
+            resp = self._request('fetch_history', 'GET', url, headers=headers, params=params)
+            if resp is None:
+                raise SlackHistoryError("No response from Slack")
+            try:
+                resp.raise_for_status()
+                data = resp.json()
+            except Exception as exc:
+                raise SlackHistoryError(exc)
             if not data.get("ok"):
-                logging.error("Slack API error: %s", data.get("error", "unknown"))
-                return None
-
-            return data.get("messages", [])
+                raise SlackHistoryError("Slack API error: %s" % data.get("error", "unknown"))
+            yield data.get("messages", [])
+            cursor = (data.get("response_metadata") or {}).get("next_cursor")
+            if not data.get("has_more") or not cursor:
+                return
+            params["cursor"] = cursor
 
-        except Exception as exc:
+    def fetch_history(self, channel_id, oldest_ts, limit=200):
+        """All messages newer than oldest_ts, newest first, or None on any error."""
+        messages = []
+        try:
+            for page in self.iter_history_pages(channel_id, oldest_ts, limit):
+                messages.extend(page)
+        except SlackHistoryError as exc:
             logging.error("Error fetching Slack messages: %s", exc)
             return None
+        return messages
@@ -0,0 +1,137 @@
+'''
+Tank geometries compiled into height -> gallons strapping tables.
+
+A geometry's volume curve is evaluated once, at a fixed height step, when the
+tank config is loaded; the resulting table is optionally cached on disk.
+Per-reading lookups are then a bisect plus linear interpolation, and batch
+lookups use numpy.interp when NumPy is installed.
+'''
+import array
+import bisect
+import hashlib
+import json
+import logging
+import math
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CUBIC_INCHES_PER_GALLON = 231.0
+
+DEFAULT_STEP_IN = 0.1
+
+VERTICAL_CYLINDER = 'vertical_cylinder'
+HORIZONTAL_CYLINDER = 'horizontal_cylinder'
+CONE_BOTTOM = 'cone_bottom'
+TABLE = 'table'
+
+
+def horizontal_cylinder_volume(radius, length):
+    '''Volume (cubic inches) of a horizontal cylinder filled to height h'''
+    def volume(h):
+        h = min(max(h, 0.0), 2.0 * radius)
+        segment = radius * radius * math.acos((radius - h) / radius) - (radius - h) * math.sqrt(2.0 * radius * h - h * h)
+        return segment * length
+    return volume
+
+
+def cone_bottom_volume(radius, cone_height):
+    '''Volume (cubic inches) of a vertical cylinder with a cone (apex down) below it'''
+    cone_full = math.pi * radius * radius * cone_height / 3.0
+
+    def volume(h):
+        if h <= 0:
+            return 0.0
+        if h < cone_height:
+            r = radius * h / cone_height
+            return math.pi * r * r * h / 3.0
+        return cone_full + math.pi * radius * radius * (h - cone_height)
+    return volume
+
+
+class StrappingTable:
+    '''Monotonic height -> gallons table with linear interpolation; clamps outside its range'''
+
+    def __init__(self, heights, gallons):
+        if len(heights) != len(gallons) or len(heights) < 2:
+            raise ValueError("Strapping table needs at least two matching height/gallon points")
+        self.heights = array.array('d', heights)
+        self.gallons = array.array('d', gallons)
+
+    @classmethod
+    def from_volume(cls, volume, height, step=DEFAULT_STEP_IN):
+        '''Sample volume(h) in cubic inches from 0 to height every step inches'''
+        count = int(math.ceil(height / step))
+        heights = [min(i * step, height) for i in range(count + 1)]
+        return cls(heights, [volume(h) / CUBIC_INCHES_PER_GALLON for h in heights])
+
+    def gallons_at(self, height):
+        heights = self.heights
+        if height <= heights[0]:
+            return self.gallons[0]
+        if height >= heights[-1]:
+            return self.gallons[-1]
+        i = bisect.bisect_right(heights, height)
+        h0, h1 = heights[i - 1], heights[i]
+        g0, g1 = self.gallons[i - 1], self.gallons[i]
+        return g0 + (g1 - g0) * (height - h0) / (h1 - h0)
+
+    def gallons_at_many(self, heights):
+        if numpy is not None:
+            return numpy.interp(numpy.asarray(heights, dtype=numpy.float64), self.heights, self.gallons)
+        return array.array('d', [self.gallons_at(h) for h in heights])
+
+    def to_json(self):
+        return {'heights': list(self.heights), 'gallons': list(self.gallons)}
+
+
+def _geometry_volume(tank_config):
+    shape = tank_config.get('shape', VERTICAL_CYLINDER)
+    radius = float(tank_config.get('radius_in', 54.23))
+    if shape == HORIZONTAL_CYLINDER:
+        return horizontal_cylinder_volume(radius, float(tank_config['length_in']))
+    if shape == CONE_BOTTOM:
+        return cone_bottom_volume(radius, float(tank_config['cone_height_in']))
+    raise ValueError("Unknown tank shape: %r" % shape)
+
+
+def compile_table(tank_config):
+    '''Build the strapping table for a non-cylindrical tank config, using the disk cache if valid'''
+    if tank_config.get('shape') == TABLE:
+        points = sorted((float(h), float(g)) for h, g in tank_config['strapping_table'])
+        for (h0, g0), (h1, g1) in zip(points, points[1:]):
+            if h1 == h0:
+                raise ValueError("Strapping table has two entries for height %g: %g and %g gallons" % (h1, g0, g1))
+            if g1 < g0:
+                raise ValueError("Strapping table entry [%g, %g] holds less than [%g, %g] below it"
+                                 % (h1, g1, h0, g0))
+        return StrappingTable([h for h, _ in points], [g for _, g in points])
+
+    height = float(tank_config.get('height_in', 75.0))
+    step = float(tank_config.get('table_step_in', DEFAULT_STEP_IN))
+    cache_path = tank_config.get('table_cache_file')
+    key = hashlib.sha1(json.dumps(tank_config, sort_keys=True).encode('utf-8')).hexdigest()
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+            if cached.get('key') == key:
+                return StrappingTable(cached['heights'], cached['gallons'])
+        except Exception as exc:
+            logging.error("Ignoring unreadable strapping table cache %s: %s", cache_path, exc)
+
+    table = StrappingTable.from_volume(_geometry_volume(tank_config), height, step)
+    if cache_path:
+        try:
+            data = table.to_json()
+            data['key'] = key
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp_path, cache_path)
+        except Exception as exc:
+            logging.error("Failed to write strapping table cache %s: %s", cache_path, exc)
+    return table
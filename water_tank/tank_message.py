@@ -1,25 +1,72 @@
-from watertank import WaterTank
+import array
+import datetime
+
+TIMESTAMP_FORMATS = (
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+)
+
+
+def parse_timestamp(raw_entry):
+    """Parse the timestamp of a log line, or a bare timestamp/date string."""
+    stamp = raw_entry.strip().partition(': ')[0]
+    if len(stamp) in (19, 26) and stamp[10] == ' ':
+        # Fast path for the format the logger writes; strptime is ~10x slower.
+        try:
+            return datetime.datetime(
+                int(stamp[0:4]), int(stamp[5:7]), int(stamp[8:10]),
+                int(stamp[11:13]), int(stamp[14:16]), int(stamp[17:19]),
+                int(stamp[20:26]) if len(stamp) == 26 else 0)
+        except ValueError:
+            pass
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(stamp, fmt)
+        except ValueError:
+            continue
+    raise ValueError("Unexpected timestamp format: %r" % raw_entry)
+
 
 def parse_distance_in_inches(raw_entry):
     tokens = raw_entry.strip().split()
     if len(tokens) < 2:
         raise ValueError("Unexpected log line format: %r" % raw_entry)
+    # Burst readings carry a quality suffix after the unit, so anchor on "in".
+    if 'in' in tokens[1:]:
+        return float(tokens[tokens.index('in', 1) - 1])
     return float(tokens[-2])
 
 
+def parse_log_block(lines, tank):
+    """Parse a block of log lines and convert them to gallons in one pass.
+
+    Returns (timestamps, distances, gallons) as float arrays (numpy when
+    installed, array('d') otherwise); timestamps are Unix seconds. Lines that
+    do not parse are skipped.
+    """
+    # Imported on use: watertank may pull in numpy, which log readers never need.
+    from watertank import as_float_array
+    timestamps = array.array('d')
+    distances = array.array('d')
+    for line in lines:
+        try:
+            stamp = parse_timestamp(line)
+            distance = parse_distance_in_inches(line)
+        except ValueError:
+            continue
+        timestamps.append(stamp.timestamp())
+        distances.append(distance)
+    return as_float_array(timestamps), as_float_array(distances), tank.gallons_at_distances(distances)
+
+
 def build_tank_message(raw_entry, tank_config):
-    tank_height = float(tank_config.get('height_in', 75.0))
-    tank_radius = float(tank_config.get('radius_in', 54.23))
-    meter_height = float(tank_config.get('meter_height_in', 4.0))
-    tank = WaterTank(tank_radius, tank_height)
+    from watertank import WaterTank
+    tank = WaterTank.from_config(tank_config)
 
     meter_read = parse_distance_in_inches(raw_entry)
-    gallons_remaining = gallons_from_distance(meter_read, tank, tank_height, meter_height)
-    water_height = (tank_height + meter_height) - meter_read
+    water_height = tank.height_at_distance(meter_read)
+    gallons_remaining = tank.gallons_at_height(water_height)
     message = "Distance: {}\n    Estimated: {:,.0f} gallons".format(raw_entry, gallons_remaining)
     return message, meter_read, water_height, gallons_remaining
-
-
-def gallons_from_distance(meter_read, tank, tank_height, meter_height):
-    water_height = (tank_height + meter_height) - meter_read
-    return tank.gallons_at_height(water_height)
@@ -1,22 +1,86 @@
 
+import array
+import json
 import math
 
-CUBIC_INCHES_PER_GALLON = 231.0
+from config_loader import TankConfig
+from tank_geometry import CUBIC_INCHES_PER_GALLON, VERTICAL_CYLINDER, compile_table
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_CONFIG_CACHE = {}
+
+
+def as_float_array(values):
+    '''numpy float64 array when numpy is installed, otherwise array('d')'''
+    if numpy is not None:
+        return numpy.asarray(values, dtype=numpy.float64)
+    if isinstance(values, array.array) and values.typecode == 'd':
+        return values
+    return array.array('d', values)
 
 class WaterTank:
     '''The water tank is known to hold 3000 gallons with a depth of 75 inches'''
 
-    def __init__(self, radius=54.23, height=75) -> None:
+    def __init__(self, radius=54.23, height=75, meter_height=4.0, table=None) -> None:
         self.radius_in_inches = radius
         self.height_in_inches = height
-        base_area = math.pi * self.radius_in_inches * self.radius_in_inches
-        self.volume_in_gallons = base_area * self.height_in_inches/CUBIC_INCHES_PER_GALLON
+        self.meter_height_in_inches = meter_height
+        # StrappingTable for non-cylindrical tanks; None means a plain vertical cylinder.
+        self.table = table
+        if table is not None:
+            self.volume_in_gallons = table.gallons_at(self.height_in_inches)
+        else:
+            base_area = math.pi * self.radius_in_inches * self.radius_in_inches
+            self.volume_in_gallons = base_area * self.height_in_inches/CUBIC_INCHES_PER_GALLON
+        # Average for shaped tanks; exact for cylinders.
         self.gallons_per_inch = self.volume_in_gallons/self.height_in_inches
 
+    @classmethod
+    def from_config(cls, tank_config):
+        '''Shared WaterTank for a `tank` config section, built once per distinct config'''
+        if isinstance(tank_config, TankConfig):
+            return tank_config.water_tank()
+        key = json.dumps(tank_config, sort_keys=True)
+        tank = _CONFIG_CACHE.get(key)
+        if tank is None:
+            table = None
+            if tank_config.get('shape', VERTICAL_CYLINDER) != VERTICAL_CYLINDER:
+                table = compile_table(tank_config)
+            tank = cls(float(tank_config.get('radius_in', 54.23)), float(tank_config.get('height_in', 75.0)),
+                       float(tank_config.get('meter_height_in', 4.0)), table=table)
+            _CONFIG_CACHE[key] = tank
+        return tank
+
     def gallons_at_height(self, height) -> float:
         '''Remaining gallons at given height'''
+        if self.table is not None:
+            return self.table.gallons_at(height)
         return height * self.gallons_per_inch
 
+    def height_at_distance(self, meter_read) -> float:
+        '''Water height for a sensor reading taken meter_height above the tank top'''
+        return (self.height_in_inches + self.meter_height_in_inches) - meter_read
+
+    def gallons_at_heights(self, heights):
+        '''Remaining gallons for a sequence of heights, as a float array'''
+        if self.table is not None:
+            return self.table.gallons_at_many(heights)
+        if numpy is not None:
+            return numpy.asarray(heights, dtype=numpy.float64) * self.gallons_per_inch
+        per_inch = self.gallons_per_inch
+        return array.array('d', [h * per_inch for h in heights])
+
+    def gallons_at_distances(self, meter_reads):
+        '''Remaining gallons for a sequence of sensor readings, as a float array'''
+        top = self.height_in_inches + self.meter_height_in_inches
+        if numpy is not None:
+            return self.gallons_at_heights(top - numpy.asarray(meter_reads, dtype=numpy.float64))
+        return self.gallons_at_heights([top - d for d in meter_reads])
+
     def rate_change(self, from_height, to_height, window) -> float:
         '''Return gallons per minute'''
         gallons_from = self.gallons_at_height(from_height)